@@ -13,15 +13,19 @@ main_page = st.Page(main, title="Main", icon=":material/home:", default=True)
 
 chat_page = st.Page("chat/page_chat.py", title="角色扮演", icon=":material/chat:")
 chat_scenario_editor_page = st.Page("chat/page_scenario_editor.py", title="场景编辑器", icon=":material/edit:")
+chat_search_page = st.Page("chat/page_search.py", title="对话搜索", icon=":material/search:")
 
 img_page = st.Page("img/page_img_gen.py", title="文生图", icon=":material/image:")
 img_page_qwen = st.Page("img/page_img_gen_qwen.py", title="文生图(Qwen)", icon=":material/image:")
 
+metrics_page = st.Page("common/page_metrics.py", title="调用监控", icon=":material/monitoring:")
+
 pg = st.navigation(
     {
         "主页": [main_page],
-        "角色扮演": [chat_page, chat_scenario_editor_page],
-        "生图": [img_page, img_page_qwen]
+        "角色扮演": [chat_page, chat_scenario_editor_page, chat_search_page],
+        "生图": [img_page, img_page_qwen],
+        "监控": [metrics_page]
     },
     position="top"
 )
@@ -0,0 +1,100 @@
+import os
+import json
+import random
+
+
+# 对话历史规模 -> 消息数
+HISTORY_SIZES = {
+    "small": 20,
+    "medium": 500,
+    "large": 5000,
+}
+
+ASSISTANT_NAME = "艾琳"
+USER_NAME = "旅人"
+SENTENCES = [
+    "窗外的雨还没有停。",
+    "她把茶杯推到你面前，示意你先暖暖手。",
+    "你听说过北方山谷里的那座钟楼吗？",
+    "我们明天一早就出发，趁着雾还没散。",
+    "地图上的这条路已经很多年没有人走过了。",
+    "他沉默了一会儿，终于点了点头。",
+    "灯芯噼啪作响，影子在墙上轻轻晃动。",
+    "如果你愿意，我可以把那段往事讲给你听。",
+]
+
+
+def make_text(rng: random.Random, length: int) -> str:
+    """由固定句子随机拼成约 length 个字符的文本"""
+    parts = []
+    while sum(len(p) for p in parts) < length:
+        parts.append(rng.choice(SENTENCES))
+    return "".join(parts)
+
+
+def make_messages(count: int, message_length: int = 120, seed: int = 0) -> list[dict]:
+    """生成 count 条用户和角色交替的消息，相同参数生成的内容相同"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(count):
+        name = USER_NAME if i % 2 == 0 else ASSISTANT_NAME
+        messages.append({
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"{name}: {make_text(rng, message_length)}",
+            "name": name
+        })
+    return messages
+
+
+def make_scenario(system_prompt_length: int = 2000, start_count: int = 4, seed: int = 0) -> dict:
+    """生成场景数据，格式见 chat.scenario.Scenario"""
+    rng = random.Random(seed)
+    return {
+        "assistant_name": ASSISTANT_NAME,
+        "user_name": USER_NAME,
+        "system_prompt": make_text(rng, system_prompt_length),
+        "break_prompt": "",
+        "start": make_messages(start_count, seed=seed + 1)
+    }
+
+
+def make_history(count: int, message_length: int = 120, seed: int = 0) -> dict:
+    """生成对话历史数据，格式同 AIBot.get_history"""
+    return {
+        "assistant_name": ASSISTANT_NAME,
+        "user_name": USER_NAME,
+        "config": {"base_url": "", "model": "mock", "temperature": 0.7, "max_tokens": 0},
+        "messages": make_messages(count, message_length, seed)
+    }
+
+
+def write_llm_config(workspace: str, base_url: str, type: str = "chat", name: str = "config.json",
+                     model: str = "mock", **options) -> str:
+    """在工作目录的 chat 或 img 目录中写入指向模拟服务的模型配置，options 为其他配置项"""
+    config_dir = os.path.join(workspace, type)
+    os.makedirs(config_dir, exist_ok=True)
+    path = os.path.join(config_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"base_url": base_url, "model": model, "key": "mock", **options}, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def populate_workspace(scenario_name: str = "bench", sizes: dict = None) -> dict:
+    """
+    通过 ScenarioMgr / ChatHistoryMgr 写入场景和各规模的对话历史，
+    需要在设置 PROMPT_ME_WORKSPACE 后调用，数据按当前存储后端（PROMPT_ME_STORAGE）写入
+
+    :param sizes: 规模名称 -> 消息数，默认为 HISTORY_SIZES
+    :return: 规模名称 -> 对话历史名称
+    """
+    from chat.scenario import ScenarioMgr
+    from chat.chat_history import ChatHistoryMgr
+
+    scenario_mgr = ScenarioMgr()
+    if not scenario_mgr.scenario_exists(scenario_name):
+        scenario_mgr.create_scenario(scenario_name, make_scenario())
+    history_mgr = ChatHistoryMgr(scenario_name)
+    histories = {}
+    for size_name, count in (sizes or HISTORY_SIZES).items():
+        histories[size_name] = history_mgr.save_history(f"history_{size_name}", make_history(count, seed=count))
+    return histories
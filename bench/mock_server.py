@@ -0,0 +1,253 @@
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# 模拟回复使用的文本，每个字符视为一个token
+REPLY_TEXT = "她轻轻推开窗，夜风带着雨后泥土的气息吹了进来，远处的灯火一盏一盏亮起。"
+
+
+def make_png(width: int, height: int, seed: int = 0) -> bytes:
+    """生成随机像素的 RGB PNG 图片，随机像素几乎不可压缩，文件大小约为 width * height * 3 字节"""
+    rng = random.Random(seed)
+    raw = b"".join(b"\x00" + rng.randbytes(width * 3) for _ in range(height))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b""))
+
+
+class MockLLMServer:
+    """
+    本地的 OpenAI 兼容模拟服务，用于基准测试
+
+    支持的接口：
+        POST /v1/chat/completions    流式和非流式对话，extra_body 中 modalities 包含 image 时返回图片（Gemini 格式）
+        POST /v1/embeddings          固定维度的伪向量
+        POST /v1/images/generations  返回图片地址（Qwen 格式）
+        GET  /images/<n>.png         图片内容
+
+    :param ttft: 首个token延迟（秒）
+    :param tokens_per_second: 流式输出速度，0 为不限速
+    :param reply_tokens: 每个回复的token数
+    :param image_latency: 生成图片的耗时（秒）
+    :param image_pixels: 图片边长（像素）
+    :param error_rate: 返回 429 的请求比例
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ttft: float = 0.2,
+                 tokens_per_second: float = 200, reply_tokens: int = 200,
+                 image_latency: float = 0.5, image_pixels: int = 512, error_rate: float = 0.0):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.image_latency = image_latency
+        self.error_rate = error_rate
+        self.image = make_png(image_pixels, image_pixels)
+        self.request_count = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.request_count += 1
+            return self.error_rate > 0 and self._rng.random() < self.error_rate
+
+    def _reply_pieces(self) -> list[str]:
+        text = (REPLY_TEXT * (self.reply_tokens // len(REPLY_TEXT) + 1))[:self.reply_tokens]
+        return list(text)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, data: dict, status: int = 200, headers: dict = None):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def do_GET(self):
+                if self.path.startswith("/images/"):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/png")
+                    self.send_header("Content-Length", str(len(server.image)))
+                    self.end_headers()
+                    self.wfile.write(server.image)
+                else:
+                    self.send_error(404)
+
+            def do_POST(self):
+                body = self._read_json()
+                if server._should_fail():
+                    self._send_json({"error": {"message": "rate limited", "type": "rate_limit"}},
+                                    status=429, headers={"Retry-After": "0"})
+                elif self.path.endswith("/chat/completions"):
+                    modalities = body.get("modalities") or []
+                    if "image" in modalities:
+                        self._image_completion(body)
+                    elif body.get("stream"):
+                        self._stream_completion(body)
+                    else:
+                        self._completion(body)
+                elif self.path.endswith("/embeddings"):
+                    self._embeddings(body)
+                elif self.path.endswith("/images/generations"):
+                    self._image_generation(body)
+                else:
+                    self.send_error(404)
+
+            @staticmethod
+            def _prompt_tokens(body: dict) -> int:
+                return sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+
+            def _completion(self, body: dict):
+                time.sleep(server.ttft + server.reply_tokens / (server.tokens_per_second or float("inf")))
+                n = body.get("n", 1)
+                self._send_json({
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+                    "choices": [{"index": i, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(server._reply_pieces())}}
+                                for i in range(n)],
+                    "usage": {"prompt_tokens": self._prompt_tokens(body), "completion_tokens": server.reply_tokens * n,
+                              "total_tokens": self._prompt_tokens(body) + server.reply_tokens * n}
+                })
+
+            def _stream_completion(self, body: dict):
+                n = body.get("n", 1)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+                def send(data):
+                    payload = f"data: {data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)}\n\n"
+                    payload = payload.encode("utf-8")
+                    self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+                    self.wfile.flush()
+
+                def frame(choices, usage=None):
+                    return {"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                            "model": body.get("model"), "choices": choices, "usage": usage}
+
+                interval = 1 / server.tokens_per_second if server.tokens_per_second else 0
+                try:
+                    time.sleep(server.ttft)
+                    for piece in server._reply_pieces():
+                        send(frame([{"index": i, "delta": {"content": piece}, "finish_reason": None}
+                                    for i in range(n)]))
+                        if interval:
+                            time.sleep(interval)
+                    send(frame([{"index": i, "delta": {}, "finish_reason": "stop"} for i in range(n)]))
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        prompt_tokens = self._prompt_tokens(body)
+                        send(frame([], {"prompt_tokens": prompt_tokens, "completion_tokens": server.reply_tokens * n,
+                                        "total_tokens": prompt_tokens + server.reply_tokens * n}))
+                    send("[DONE]")
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端取消请求
+                    pass
+
+            def _image_completion(self, body: dict):
+                time.sleep(server.image_latency)
+                url = "data:image/png;base64," + base64.b64encode(server.image).decode()
+                n = body.get("n", 1)
+                self._send_json({
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": body.get("model"),
+                    "choices": [{"index": i, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "",
+                                             "images": [{"type": "image_url", "image_url": {"url": url}}]}}
+                                for i in range(n)],
+                    "usage": {"prompt_tokens": self._prompt_tokens(body), "completion_tokens": 1290 * n,
+                              "total_tokens": self._prompt_tokens(body) + 1290 * n}
+                })
+
+            def _image_generation(self, body: dict):
+                time.sleep(server.image_latency)
+                host, port = server._server.server_address[:2]
+                self._send_json({"images": [{"url": f"http://{host}:{port}/images/{i}.png"}
+                                            for i in range(body.get("batch_size", 1))]})
+
+            def _embeddings(self, body: dict):
+                inputs = body.get("input")
+                inputs = inputs if isinstance(inputs, list) else [inputs]
+                data = []
+                for i, text in enumerate(inputs):
+                    digest = hashlib.sha256(str(text).encode("utf-8")).digest()
+                    data.append({"object": "embedding", "index": i,
+                                 "embedding": [(b - 128) / 128 for b in digest * 8]})
+                self._send_json({"object": "list", "data": data, "model": body.get("model"),
+                                 "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首个token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=200, help="每秒输出token数，0 为不限速")
+    parser.add_argument("--reply-tokens", type=int, default=200, help="每个回复的token数")
+    parser.add_argument("--image-latency", type=float, default=0.5, help="生成图片耗时（秒）")
+    parser.add_argument("--image-pixels", type=int, default=512, help="图片边长（像素）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 429 的请求比例")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.host, args.port, args.ttft, args.tps, args.reply_tokens,
+                           args.image_latency, args.image_pixels, args.error_rate)
+    print(f"模拟服务: {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
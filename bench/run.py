@@ -0,0 +1,288 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# 直接运行 python bench/run.py 时保证可以导入项目模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.mock_server import MockLLMServer
+from bench import fixtures
+
+
+RESULT_VERSION = 1
+SCENARIO_NAME = "bench"
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+def timing(samples: list[float]) -> dict:
+    """耗时样本（秒）的统计，单位为毫秒"""
+    return {
+        "runs": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(_percentile(samples, 0.5) * 1000, 3),
+        "p90_ms": round(_percentile(samples, 0.9) * 1000, 3),
+        "min_ms": round(min(samples) * 1000, 3)
+    }
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """运行 func repeat 次，setup 在每次运行前调用且不计入耗时"""
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return timing(samples)
+
+
+# ---------- 基准测试 ----------
+
+def bench_chat(requests: int, concurrency_levels: list[int]) -> dict:
+    """AIBot.chat 的吞吐量和首个文本片段延迟"""
+    from common.config import global_config
+    from chat.aibot import AIBot
+    from chat.scenario import ScenarioMgr
+
+    config = global_config.get_llm_config()
+    scenario = ScenarioMgr().get_scenario(SCENARIO_NAME)
+
+    def one_chat() -> tuple[float, float]:
+        ai_bot = AIBot(config, scenario)
+        start = time.perf_counter()
+        first = None
+        for _ in ai_bot.chat("你好", use_cache=False):
+            if first is None:
+                first = time.perf_counter() - start
+        if ai_bot.last_status != "completed":
+            raise RuntimeError(f"请求未完成: {ai_bot.last_status}")
+        return first, time.perf_counter() - start
+
+    results = {}
+    for concurrency in concurrency_levels:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            samples = list(executor.map(lambda _: one_chat(), range(requests)))
+        elapsed = time.perf_counter() - start
+        results[f"concurrency_{concurrency}"] = {
+            "requests": requests,
+            "requests_per_second": round(requests / elapsed, 3),
+            "first_chunk": timing([s[0] for s in samples]),
+            "total": timing([s[1] for s in samples])
+        }
+    return results
+
+
+def bench_history(histories: dict, repeat: int) -> dict:
+    """对话历史的读取、追加保存和整体保存"""
+    from chat.chat_history import ChatHistoryMgr
+
+    history_mgr = ChatHistoryMgr(SCENARIO_NAME)
+    results = {}
+    for size_name, history_name in histories.items():
+        history = history_mgr.get_history(history_name)
+        data = history.to_json()
+        state = {"messages": list(data["messages"])}
+
+        def append():
+            # 每次追加一轮对话，走日志追加的路径
+            state["messages"] = state["messages"] + fixtures.make_messages(2, seed=len(state["messages"]))
+            history.update({**data, "messages": state["messages"]})
+
+        results[size_name] = {
+            "messages": len(data["messages"]),
+            "load": measure(lambda: history_mgr.get_history(history_name), repeat),
+            "append": measure(append, repeat),
+            "save": measure(lambda: history_mgr.save_history(f"copy_{history_name}", data), repeat)
+        }
+    return results
+
+
+def bench_editor(repeat: int) -> dict:
+    """ChatHistoryEditor 消息与文本的往返转换"""
+    from chat.chat_history import ChatHistoryEditor
+
+    results = {}
+    for size_name, count in fixtures.HISTORY_SIZES.items():
+        messages = fixtures.make_messages(count, seed=count)
+
+        def round_trip():
+            text = ChatHistoryEditor.llm_messages_to_text(messages)
+            if ChatHistoryEditor.text_to_llm_messages(text) != messages:
+                raise RuntimeError("往返转换结果不一致")
+
+        results[size_name] = {"messages": count, "round_trip": measure(round_trip, repeat)}
+    return results
+
+
+def bench_image(workspace: str, base_url: str, repeat: int, count: int) -> dict:
+    """图片生成的完整流程：请求、解析、记录到图片工作目录"""
+    try:
+        from common.config import LLMConfig
+        from img.generator import GeminiImgGenerator, QwenImgGenerator
+    except ImportError as e:
+        # 图片模块依赖 Pillow 等可选依赖
+        return {"skipped": str(e)}
+
+    gemini_config = LLMConfig(fixtures.write_llm_config(workspace, base_url, "img", "gemini.json", "gemini-mock"))
+    qwen_config = LLMConfig(fixtures.write_llm_config(workspace, base_url, "img", "qwen.json", "qwen-image"))
+    qwen_edit_config = LLMConfig(fixtures.write_llm_config(workspace, base_url, "img", "qwen-edit.json",
+                                                           "qwen-image-edit"))
+
+    def gemini():
+        ok, result = GeminiImgGenerator(gemini_config).generate_img("雨夜的钟楼", [], count=count)
+        if not ok:
+            raise RuntimeError(result)
+
+    def qwen():
+        generator = QwenImgGenerator(qwen_config, qwen_edit_config)
+        ok, result = generator.generate_img("雨夜的钟楼", [], batch_size=count)
+        if not ok:
+            raise RuntimeError(result)
+        # 包括后台下载图片的时间
+        if not all(download.ok for download in generator.last_downloads.wait()):
+            raise RuntimeError("图片下载失败")
+
+    return {
+        "images_per_request": count,
+        "gemini": measure(gemini, repeat),
+        "qwen": measure(qwen, repeat)
+    }
+
+
+# ---------- 结果 ----------
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(data: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list[str]:
+    """
+    与基准结果比较耗时（*_ms）和吞吐量（*_per_second）
+
+    :param threshold: 变化超过该比例时标记为变慢或变快
+    :return: 变慢的指标列表
+    """
+    base = _flatten(baseline["results"])
+    regressions = []
+    for name, value in _flatten(current["results"]).items():
+        if not (name.endswith("_ms") or name.endswith("_per_second")) or not base.get(name):
+            continue
+        change = value / base[name] - 1
+        # 耗时越小越好，吞吐量越大越好
+        worse = change > threshold if name.endswith("_ms") else change < -threshold
+        better = change < -threshold if name.endswith("_ms") else change > threshold
+        mark = "变慢" if worse else ("变快" if better else "")
+        print(f"{name:60s} {base[name]:>12.3f} -> {value:>12.3f} {change:+7.1%} {mark}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="使用本地模拟服务运行基准测试，结果写入 JSON 文件")
+    parser.add_argument("--output", default=None, help="结果文件，默认为 bench/results/<时间>.json")
+    parser.add_argument("--compare", default=None, help="与之前的结果文件比较，有指标变慢时返回非零")
+    parser.add_argument("--threshold", type=float, default=0.1, help="比较时视为变化的比例")
+    parser.add_argument("--only", nargs="*", choices=["chat", "history", "editor", "image"], default=None,
+                        help="只运行指定的基准测试")
+    parser.add_argument("--quick", action="store_true", help="减少重复次数和规模，用于快速检查")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json", help="对话历史存储方式")
+    parser.add_argument("--ttft", type=float, default=0.05, help="模拟服务的首个token延迟（秒）")
+    parser.add_argument("--tps", type=float, default=0, help="模拟服务每秒输出token数，0 为不限速")
+    parser.add_argument("--reply-tokens", type=int, default=200, help="模拟服务每个回复的token数")
+    parser.add_argument("--image-latency", type=float, default=0.05, help="模拟服务生成图片耗时（秒）")
+    parser.add_argument("--image-pixels", type=int, default=512, help="模拟服务图片边长（像素）")
+    args = parser.parse_args()
+
+    only = set(args.only or ["chat", "history", "editor", "image"])
+    repeat = 3 if args.quick else 20
+    if args.quick:
+        fixtures.HISTORY_SIZES = {"small": 20, "medium": 200}
+
+    # 工作目录和存储方式在导入项目模块前设置
+    workspace = tempfile.mkdtemp(prefix="prompt_me_bench_")
+    os.environ["PROMPT_ME_WORKSPACE"] = workspace
+    os.environ["PROMPT_ME_STORAGE"] = args.storage
+
+    server = MockLLMServer(ttft=args.ttft, tokens_per_second=args.tps, reply_tokens=args.reply_tokens,
+                           image_latency=args.image_latency, image_pixels=args.image_pixels)
+    with server:
+        fixtures.write_llm_config(workspace, server.base_url)
+        histories = fixtures.populate_workspace(SCENARIO_NAME)
+
+        results = {}
+        if "chat" in only:
+            print("运行 chat ...")
+            results["chat"] = bench_chat(10 if args.quick else 100, [1, 8])
+        if "history" in only:
+            print("运行 history ...")
+            results["history"] = bench_history(histories, repeat)
+        if "editor" in only:
+            print("运行 editor ...")
+            results["editor"] = bench_editor(repeat)
+        if "image" in only:
+            print("运行 image ...")
+            results["image"] = bench_image(workspace, server.base_url, repeat, 2)
+
+    report = {
+        "version": RESULT_VERSION,
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "storage": args.storage,
+            "quick": args.quick,
+            "server": {"ttft": args.ttft, "tps": args.tps, "reply_tokens": args.reply_tokens,
+                       "image_latency": args.image_latency, "image_pixels": args.image_pixels}
+        },
+        "results": results
+    }
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), "results",
+                                         time.strftime("%Y%m%d_%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} 项指标变慢")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,22 +5,52 @@ from dotenv import load_dotenv
 from common.config import LLMConfig
 from common.utils import get_openai_client
 from chat.scenario import Scenario
+from chat.context import ContextManager, estimate_tokens
+from chat.summary import RollingSummarizer
+from chat.engine import chat_engine, ChatStream
+from chat.router import ProviderRouter
+from chat.completion_cache import completion_cache, ReplayStream
+from chat.prompt_cache import canonical_message, mark_cache_breakpoint, prompt_cache_stats
+from common.ratelimit import PRIORITY_CHAT
+from common.metrics import metrics_store
 
 
 # 加载环境变量
 load_dotenv()
 
+# 被中断的回复末尾追加的标记
+INTERRUPTED_MARKER = "[回复已中断]"
+
 
 class AIBot:
-    """AI聊天机器人类"""
-    def __init__(self, config: LLMConfig, scene: Scenario):
+    """
+    AI聊天机器人类
+
+    传入 router 时每次请求由路由在多个接口之间选择并故障转移，
+    config 仍用于上下文预算、候选数量等会话级设置。
+    """
+    def __init__(self, config: LLMConfig, scene: Scenario, router: ProviderRouter = None):
         self._config = config
         self._scenario = scene
+        self._router = router
         self.ctx_messages = []
-        self._client = get_openai_client(self._config)
+        # 有尚未写入历史记录的回复（例如生成被中断时脚本已停止运行）
+        self.pending_save = False
+        # 最后一条回复的候选缓存
+        self._candidates = None
+        # 最后一次请求的结束状态，见 ChatStream.status
+        self.last_status = None
+        # 限流排队优先级，批量任务使用 PRIORITY_BATCH
+        self.priority = PRIORITY_CHAT
+        self._context = ContextManager(self._config.context_tokens, self._config.context_strategy)
+        self._summarizer = RollingSummarizer(self._config)
         # 初始化对话历史
         self._init_messages()
 
+    @property
+    def _client(self) -> OpenAI:
+        return get_openai_client(self._config)
+
     def _init_messages(self):
         """初始化对话历史"""
         # 添加破甲提示词
@@ -41,6 +71,7 @@ class AIBot:
     def reset(self):
         """重置会话，清空对话历史"""
         self.ctx_messages = []
+        self._summarizer.reset()
         self._init_messages()
 
     def update_ctx_messages(self, messages: list):
@@ -49,7 +80,7 @@ class AIBot:
 
     def get_history(self):
         """获取当前会话历史"""
-        return {
+        history = {
             "assistant_name": self._scenario.assistant_name,
             "user_name": self._scenario.user_name,
             "config": {
@@ -60,17 +91,54 @@ class AIBot:
             },
             "messages": self.ctx_messages
         }
+        summary = self._summarizer.to_json()
+        if summary:
+            history["summary"] = summary
+        return history
 
-    def load_history_messages(self, messages: list):
-        """加载历史消息"""
+    def load_history_messages(self, messages: list, summary: dict = None):
+        """加载历史消息及对话摘要"""
         self.ctx_messages = messages
+        self._summarizer.load(summary)
+
+    def _body_start(self) -> int:
+        """对话消息（系统提示词和 start 消息之后）的起始位置"""
+        head_count = 0
+        while head_count < len(self.ctx_messages) and self.ctx_messages[head_count].get("role") == "system":
+            head_count += 1
+        return min(head_count + len(self._scenario.start_messages), len(self.ctx_messages))
+
+    def get_request_messages(self) -> list:
+        """
+        获取本轮需要发送给模型的消息（用摘要替换早期对话，并按上下文预算裁剪）
+
+        系统提示词和 start 消息组成的前缀在同一会话的每一轮中保持字节级一致，
+        配置了 prompt_cache 时在前缀末尾打上缓存标记，以命中接口的提示词缓存
+        """
+        body_start = self._body_start()
+        messages, pinned_end = self._summarizer.apply(self.ctx_messages, body_start)
+        head_count = body_start - len(self._scenario.start_messages)
+        messages = [canonical_message(m) for m in self._context.pack(messages, pinned_end - head_count)]
+
+        # 前缀被上下文裁剪策略丢弃时不再打缓存标记
+        prefix_len = body_start
+        prefix_intact = (0 < prefix_len <= len(messages)
+                         and messages[prefix_len - 1]["content"] == self.ctx_messages[prefix_len - 1]["content"])
+        if self._config.prompt_cache == "cache_control" and prefix_intact:
+            messages[prefix_len - 1] = mark_cache_breakpoint(messages[prefix_len - 1])
+        return messages
 
     def format_input(self, user_input: str):
         """格式化用户输入"""
         return f"{self._scenario.user_name}: {user_input}"
 
-    def chat(self, user_input: str, new_system_prompt: str = ""):
-        """处理用户输入，返回AI角色的回复（流式输出）"""
+    def chat(self, user_input: str, new_system_prompt: str = "", use_cache: bool = True):
+        """
+        处理用户输入，返回AI角色的回复（流式输出）
+
+        配置了 completion_cache 时先查找回复缓存，命中则直接回放缓存的回复；
+        重新生成时应传入 use_cache=False，避免得到相同的回复
+        """
         # 普通消息，添加到对话历史
         if user_input.strip():
             self.ctx_messages.append({
@@ -86,31 +154,137 @@ class AIBot:
                 "name": "system"
             })
 
+        messages = self.get_request_messages()
+        # 自动路由时回复可能来自任何一个接口，缓存按全部候选接口区分
+        endpoints = self._router.configs if self._router is not None else None
+        cached, embedding = None, None
+        if self._config.completion_cache and use_cache:
+            cached, embedding = completion_cache.lookup(self._config, messages, endpoints)
+
+        if cached is not None:
+            stream = ReplayStream(self._config, cached)
+        else:
+            # 调用模型获取流式回复，迭代被中止时（如页面点击停止）请求会被取消
+            stream = chat_engine.stream(self._config, messages,
+                                        n=self._config.candidates, mode=self._config.candidate_mode,
+                                        router=self._router, priority=self.priority)
+        self._candidates = None
         try:
-            # 调用OpenAI API获取流式回复
-            stream = self._client.chat.completions.create(
-                model=self._config.model,
-                messages=self.ctx_messages,
-                stream=True  # 启用流式响应
-            )
-            full_response = ""
-            for chunk in stream:
-                content = chunk.choices[0].delta.content or ''
-                if content:
-                    full_response += content
-                    yield content  # 逐块返回内容
-            # 流式结束后保存完整响应到历史
-            full_response = full_response.strip()
-            if not full_response.startswith(self._scenario.assistant_name):
-                full_response = f"{self._scenario.assistant_name}: {full_response}"
-                
-            self.ctx_messages.append({
-                "role": "assistant",
-                "content": full_response,
-                "name": self._scenario.assistant_name
-            })
-        except Exception as e:
-            yield f"发生错误: {str(e)}"
+            # 合并细碎的片段后再交给页面，减少 st.write_stream 重绘整段 markdown 的次数
+            frames = stream.frames(self._config.stream_frame_chars, self._config.stream_frame_interval)
+            yield from self._prefix_name(frames)
+        finally:
+            self._save_response(stream)
+            if cached is None:
+                self._record_metrics(stream)
+
+        self.last_status = stream.status
+        if cached is None and stream.status == "completed" and self._config.completion_cache:
+            completion_cache.put(self._config, messages, stream.text, embedding, endpoints)
+
+        if stream.status == "error":
+            yield f"发生错误: {str(stream.error)}"
+        elif stream.status == "timeout":
+            yield f"\n\n{INTERRUPTED_MARKER}请求超时"
+
+    def _record_metrics(self, stream: ChatStream):
+        """记录本次请求的延迟和token数，接口未返回 usage 时按文本估算输出token数"""
+        usage = stream.usage
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if completion_tokens is None and stream.text:
+            completion_tokens = estimate_tokens(stream.text)
+        metrics_store.record("chat", stream.config, stream.status, stream.latency or 0.0,
+                             scenario=self._scenario.name, ttft=stream.ttft, queue_wait=stream.queue_wait,
+                             prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, error=stream.error)
+
+    def _prefix_name(self, frames):
+        """
+        流式输出时按 _format_response 的规则补上角色名：
+        只缓存开头不足以判断是否以角色名开头的部分，判断后其余帧原样输出
+        """
+        name = self._scenario.assistant_name
+        head = ""
+        for frame in frames:
+            if head is None:
+                yield frame
+                continue
+            head += frame
+            text = head.lstrip()
+            if len(text) < len(name) and name.startswith(text):
+                continue
+            yield text if text.startswith(name) else f"{name}: {text}"
+            head = None
+        if head and head.strip():
+            yield self._format_response(head)
+
+    def _format_response(self, response: str) -> str:
+        """回复统一以角色名开头"""
+        response = response.strip()
+        if not response.startswith(self._scenario.assistant_name):
+            response = f"{self._scenario.assistant_name}: {response}"
+        return response
+
+    def _save_response(self, stream: ChatStream | ReplayStream):
+        """保存模型回复到历史，被取消或超时的部分回复追加中断标记后保存"""
+        full_response = stream.text.strip()
+        if not full_response:
+            return
+        if stream.status in ("cancelled", "timeout"):
+            full_response = f"{full_response}\n\n{INTERRUPTED_MARKER}"
+        elif stream.status != "completed":
+            return
+
+        message = {
+            "role": "assistant",
+            "content": self._format_response(full_response),
+            "name": self._scenario.assistant_name
+        }
+        self.ctx_messages.append(message)
+        self.pending_save = True
+        if stream.status == "completed":
+            prompt_cache_stats.record(self._scenario.name, stream.usage, stream.ttft)
+            # 其余候选回复只缓存在内存中，不写入历史，也不发送给模型
+            self._candidates = {"message": message, "stream": stream, "texts": [message["content"]], "current": 0}
+        # 对话过长时在后台更新滚动摘要
+        self._summarizer.maybe_update(self.ctx_messages, self._body_start())
+
+    def _candidate_texts(self) -> list[str]:
+        """最后一条回复的全部候选，候选缓存在最后一条回复被修改或回退后失效"""
+        if self._candidates is None:
+            return []
+        message = self._candidates["message"]
+        if not self.ctx_messages or self.ctx_messages[-1] is not message:
+            self._candidates = None
+            return []
+        texts = self._candidates["texts"]
+        for candidate in self._candidates["stream"].candidates[len(texts) - 1:]:
+            texts.append(self._format_response(candidate))
+        return texts
 
+    def candidate_info(self) -> tuple[int, int]:
+        """最后一条回复的 (当前候选序号, 已生成的候选数量)"""
+        texts = self._candidate_texts()
+        if not texts:
+            return 0, 0
+        return self._candidates["current"], len(texts)
 
+    def switch_candidate(self, step: int = 1, wrap: bool = True) -> bool:
+        """
+        将最后一条回复切换为其他候选，无需重新请求模型
 
+        :param step: 切换的步长，1为下一个，-1为上一个
+        :param wrap: 是否循环切换，为 False 时超出范围返回 False
+        :return: 是否切换成功
+        """
+        texts = self._candidate_texts()
+        if len(texts) < 2:
+            return False
+        index = self._candidates["current"] + step
+        if not wrap and not 0 <= index < len(texts):
+            return False
+        index %= len(texts)
+        self._candidates["current"] = index
+        self._candidates["message"]["content"] = texts[index]
+        self.pending_save = True
+        return True
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from common.config import LLMConfig, global_config
+from common.fileio import append_json_line, read_json_lines
+from common.ratelimit import PRIORITY_BATCH
+from chat.aibot import AIBot
+from chat.router import get_router
+from chat.scenario import ScenarioMgr
+from chat.chat_history import ChatHistoryMgr
+from chat.search import search_index
+
+
+class ProviderLimiter:
+    """
+    按接口限制批量任务的并发数
+
+    每分钟请求数和token数由模型配置的 rpm/tpm 经共享的 common.ratelimit 控制，这里只限制并发
+
+    :param concurrency: 每个接口同时进行的请求数
+    """
+    def __init__(self, concurrency: int = 4):
+        self._concurrency = concurrency
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _semaphore(self, key) -> threading.Semaphore:
+        with self._lock:
+            if key not in self._semaphores:
+                self._semaphores[key] = threading.Semaphore(self._concurrency)
+            return self._semaphores[key]
+
+    def run(self, key, func, *args):
+        with self._semaphore(key):
+            return func(*args)
+
+
+class BatchRunner:
+    """
+    批量运行对话任务
+
+    任务文件为 JSONL，每行一个任务：
+        {
+            "id": "job-1",                  // 可选，默认为行号
+            "scenario": "场景名称",
+            "history": "结果历史名称",        // 可选，默认为 id
+            "from_history": "已有历史名称",   // 可选，在已有对话的基础上继续
+            "llm": "config.json",           // 可选，默认为 default_llm
+            "turns": ["用户输入1", {"user": "用户输入2", "system": "追加的系统提示词"}]
+        }
+    每个任务依次发送 turns 中的用户输入，全部完成后将对话写入场景的对话历史。
+    完成的任务记录在完成记录文件中，中断后重新运行时跳过已成功的任务。
+
+    :param jobs_path: 任务文件路径
+    :param done_path: 完成记录文件路径，默认为任务文件路径加 .done
+    :param workers: 同时运行的任务数
+    :param limiter: 接口并发限制
+    :param default_llm: 任务未指定模型配置时使用的配置名称
+    :param route: 使用自动路由时的策略（fastest、ordered、weighted），为 None 时不使用路由
+    :param use_cache: 是否使用回复缓存
+    """
+    def __init__(self, jobs_path: str, done_path: str = None, workers: int = 8,
+                 limiter: ProviderLimiter = None, default_llm: str = "config.json",
+                 route: str = None, use_cache: bool = False):
+        self._jobs_path = jobs_path
+        self._done_path = done_path or f"{jobs_path}.done"
+        self._workers = workers
+        self._limiter = limiter or ProviderLimiter()
+        self._default_llm = default_llm
+        self._router = get_router(route) if route else None
+        self._use_cache = use_cache
+        self._scenario_mgr = ScenarioMgr()
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def load_jobs(self) -> list[dict]:
+        """读取任务，跳过已成功完成的任务"""
+        done = {record["id"] for record in read_json_lines(self._done_path) if record.get("status") == "ok"}
+        jobs = []
+        with open(self._jobs_path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                job = json.loads(line)
+                job.setdefault("id", f"line-{line_no}")
+                if job["id"] not in done:
+                    jobs.append(job)
+        return jobs
+
+    def _get_config(self, name: str) -> LLMConfig:
+        with self._lock:
+            if name not in self._configs:
+                self._configs[name] = global_config.get_llm_config(name=name)
+            return self._configs[name]
+
+    def _chat_turn(self, ai_bot: AIBot, user_input: str, system_prompt: str) -> str:
+        return "".join(ai_bot.chat(user_input, system_prompt, use_cache=self._use_cache))
+
+    def run_job(self, job: dict) -> dict:
+        """运行单个任务，返回完成记录"""
+        start = time.monotonic()
+        history_name = job.get("history") or job["id"]
+        record = {"id": job["id"], "scenario": job["scenario"], "history": history_name}
+        try:
+            config = self._get_config(job.get("llm") or self._default_llm)
+            scenario = self._scenario_mgr.get_scenario(job["scenario"])
+            history_mgr = ChatHistoryMgr(job["scenario"])
+            ai_bot = AIBot(config, scenario, self._router)
+            # 与页面对话共用接口时，批量任务排在对话之后
+            ai_bot.priority = PRIORITY_BATCH
+            if job.get("from_history"):
+                history = history_mgr.get_history(job["from_history"])
+                ai_bot.load_history_messages(history.messages, history.summary)
+
+            for turn in job["turns"]:
+                if isinstance(turn, str):
+                    turn = {"user": turn}
+                self._limiter.run(config.base_url, self._chat_turn,
+                                  ai_bot, turn.get("user", ""), turn.get("system", ""))
+                if ai_bot.last_status != "completed":
+                    raise RuntimeError(f"请求未完成: {ai_bot.last_status}")
+
+            record["history"] = history_mgr.save_history(history_name, ai_bot.get_history())
+            record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "failed"
+            record["error"] = str(e)
+        record["seconds"] = round(time.monotonic() - start, 3)
+        return record
+
+    def run(self) -> tuple[int, int]:
+        """
+        运行全部未完成的任务，打印进度和吞吐量
+
+        :return: (成功数, 失败数)
+        """
+        jobs = self.load_jobs()
+        total = len(jobs)
+        print(f"共 {total} 个待运行任务，{self._workers} 个并发")
+        ok, failed = 0, 0
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            futures = [executor.submit(self.run_job, job) for job in jobs]
+            for future in as_completed(futures):
+                record = future.result()
+                append_json_line(self._done_path, record)
+                if record["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+
+                finished = ok + failed
+                elapsed = time.monotonic() - start
+                rate = finished / elapsed if elapsed else 0
+                eta = (total - finished) / rate if rate else 0
+                message = f"[{finished}/{total}] {record['status']} {record['id']} {record['seconds']:.1f}s"
+                if record["status"] != "ok":
+                    message += f" ({record['error']})"
+                print(f"{message} | {rate * 3600:.0f} 个/小时，剩余约 {eta / 60:.1f} 分钟")
+        print(f"完成: 成功 {ok}，失败 {failed}，耗时 {time.monotonic() - start:.1f}s")
+        return ok, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量运行场景对话任务，结果写入对话历史，任务格式见 BatchRunner")
+    parser.add_argument("jobs", help="任务文件（JSONL）")
+    parser.add_argument("--done-file", default=None, help="完成记录文件，默认为任务文件加 .done")
+    parser.add_argument("--workers", type=int, default=8, help="同时运行的任务数")
+    parser.add_argument("--per-provider", type=int, default=4, help="每个接口同时进行的请求数")
+    parser.add_argument("--llm", default="config.json", help="任务未指定时使用的模型配置")
+    parser.add_argument("--route", choices=["fastest", "ordered", "weighted"], default=None,
+                        help="在全部模型配置之间自动路由")
+    parser.add_argument("--use-cache", action="store_true", help="使用回复缓存")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.jobs):
+        parser.error(f"任务文件 {args.jobs} 不存在")
+    runner = BatchRunner(args.jobs, args.done_file, args.workers,
+                         ProviderLimiter(args.per_provider),
+                         args.llm, args.route, args.use_cache)
+    ok, failed = runner.run()
+    # 搜索索引在后台线程更新，退出前等待完成
+    search_index.wait()
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
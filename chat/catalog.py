@@ -0,0 +1,297 @@
+import os
+import json
+import time
+import threading
+
+from common.config import global_config
+from common.fileio import atomic_write_json
+from chat.context import message_text
+from chat.scenario import Scenario, scenario_update_hooks
+from chat.chat_history import ChatHistory, get_history_dir, get_journal_path, history_update_hooks
+
+
+CATALOG_VERSION = 2
+PREVIEW_LENGTH = 60
+
+
+def _stat(*paths) -> tuple[list, int]:
+    """返回 (各文件修改时间, 文件总大小)，文件不存在时修改时间为0"""
+    mtimes, size = [], 0
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            mtimes.append(0)
+            continue
+        mtimes.append(stat.st_mtime_ns)
+        size += stat.st_size
+    return mtimes, size
+
+
+def _dir_mtime(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _preview(messages: list) -> str:
+    """最后一条非系统消息的开头部分"""
+    for msg in reversed(messages):
+        if msg.get("role") != "system":
+            return " ".join(message_text(msg).split())[:PREVIEW_LENGTH]
+    return ""
+
+
+def format_mtime(info: dict) -> str:
+    """条目最后修改时间的显示文本"""
+    mtime = max(info["mtime"]) / 1e9
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime)) if mtime else ""
+
+
+class WorkspaceCatalog:
+    """
+    工作目录的场景和对话历史目录，保存在 chat 工作目录的 index 子目录中：
+    场景列表保存在 catalog.json，每个场景的对话历史列表保存在 histories/<场景>.json，
+    对话历史更新时只重写所在场景的文件。
+
+    记录每个场景和对话历史的消息数、修改时间、大小、参与者和最后一条消息的预览。
+    列出场景/对话历史时只检查所在目录的修改时间，目录未变化时直接使用缓存的结果；
+    新增、删除文件时目录修改时间变化，只重新读取新出现的文件。
+    读取单个条目时检查文件的修改时间，文件被外部修改时重新读取该文件。
+    本进程内的写入通过 history_update_hooks / scenario_update_hooks 增量更新，无需重新读取文件。
+    """
+    def __init__(self, catalog_path: str = None):
+        self._scenario_dir = os.path.join(global_config.get_chat_workspace(), "scenario")
+        # chat 工作目录下的 json 文件为模型配置，索引保存在子目录中
+        self._catalog_path = catalog_path or os.path.join(global_config.get_chat_workspace(), "index", "catalog.json")
+        self._histories_dir = os.path.join(os.path.dirname(self._catalog_path), "histories")
+        self._lock = threading.RLock()
+        self._data = None
+        # 场景名称 -> {"dir_mtime": 对话历史目录修改时间, "histories": {文件名: 条目}}，按需加载
+        self._history_data = {}
+
+    def _load(self) -> dict:
+        if self._data is None:
+            try:
+                with open(self._catalog_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") != CATALOG_VERSION:
+                    raise ValueError("catalog version mismatch")
+            except (FileNotFoundError, ValueError):
+                data = {"version": CATALOG_VERSION, "dir_mtime": 0, "scenarios": {}}
+            self._data = data
+        return self._data
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._catalog_path), exist_ok=True)
+            atomic_write_json(self._catalog_path, self._data, indent=None)
+        except OSError as e:
+            print(f"保存目录索引出错: {e}")
+
+    def _histories_path(self, scenario_name: str) -> str:
+        return os.path.join(self._histories_dir, f"{scenario_name}.json")
+
+    def _load_histories(self, scenario_name: str) -> dict:
+        if scenario_name not in self._history_data:
+            try:
+                with open(self._histories_path(scenario_name), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") != CATALOG_VERSION:
+                    raise ValueError("catalog version mismatch")
+            except (FileNotFoundError, ValueError):
+                data = {"version": CATALOG_VERSION, "dir_mtime": 0, "histories": {}}
+            self._history_data[scenario_name] = data
+        return self._history_data[scenario_name]
+
+    def _save_histories(self, scenario_name: str):
+        try:
+            os.makedirs(self._histories_dir, exist_ok=True)
+            atomic_write_json(self._histories_path(scenario_name), self._history_data[scenario_name], indent=None)
+        except OSError as e:
+            print(f"保存对话历史目录索引出错: {e}")
+
+    def _drop_histories(self, scenario_name: str):
+        """场景删除后删除其对话历史列表"""
+        self._history_data.pop(scenario_name, None)
+        try:
+            os.remove(self._histories_path(scenario_name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"删除对话历史目录索引出错: {e}")
+
+    # ---------- 读取文件 ----------
+
+    def _scenario_entry(self, scenario_name: str, scene_data: dict = None) -> dict:
+        scene_path = os.path.join(self._scenario_dir, scenario_name, "scene.json")
+        if scene_data is None:
+            try:
+                scene_data = Scenario(scene_path).to_json()
+            except (OSError, ValueError) as e:
+                print(f"读取场景 {scenario_name} 出错: {e}")
+                scene_data = {}
+        mtime, size = _stat(scene_path)
+        return {
+            "mtime": mtime,
+            "size": size,
+            "participants": [scene_data.get("assistant_name", "AI"), scene_data.get("user_name", "用户")],
+            "message_count": len(scene_data.get("start", [])),
+            "preview": " ".join(scene_data.get("system_prompt", "").split())[:PREVIEW_LENGTH]
+        }
+
+    @staticmethod
+    def _history_entry(history_path: str) -> dict:
+        mtime, size = _stat(history_path, get_journal_path(history_path))
+        try:
+            history = ChatHistory(history_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"读取对话历史 {history_path} 出错: {e}")
+            return {"mtime": mtime, "size": size, "participants": [], "message_count": 0, "preview": ""}
+        return {
+            "mtime": mtime,
+            "size": size,
+            "participants": [history.assistant_name, history.user_name],
+            "message_count": len(history.messages),
+            "preview": _preview(history.messages)
+        }
+
+    # ---------- 列表 ----------
+
+    def _scenarios(self) -> dict:
+        """场景目录的修改时间变化时重新扫描，已知场景的条目直接复用"""
+        data = self._load()
+        dir_mtime = _dir_mtime(self._scenario_dir)
+        if dir_mtime == data["dir_mtime"]:
+            return data["scenarios"]
+
+        scenarios = {}
+        if os.path.isdir(self._scenario_dir):
+            for dirname in sorted(os.listdir(self._scenario_dir)):
+                if not os.path.exists(os.path.join(self._scenario_dir, dirname, "scene.json")):
+                    continue
+                scenarios[dirname] = data["scenarios"].get(dirname) or self._scenario_entry(dirname)
+        for scenario_name in data["scenarios"].keys() - scenarios.keys():
+            self._drop_histories(scenario_name)
+        data["scenarios"] = scenarios
+        data["dir_mtime"] = dir_mtime
+        self._save()
+        return scenarios
+
+    def _histories(self, scenario_name: str) -> dict:
+        """对话历史目录的修改时间变化时重新扫描，已知对话历史的条目直接复用"""
+        if scenario_name not in self._scenarios():
+            return {}
+        entry = self._load_histories(scenario_name)
+        history_dir = get_history_dir(scenario_name)
+        dir_mtime = _dir_mtime(history_dir)
+        if dir_mtime == entry["dir_mtime"]:
+            return entry["histories"]
+
+        histories = {}
+        if os.path.isdir(history_dir):
+            for filename in sorted(os.listdir(history_dir)):
+                if not filename.endswith(".json"):
+                    continue
+                histories[filename] = (entry["histories"].get(filename)
+                                       or self._history_entry(os.path.join(history_dir, filename)))
+        entry["histories"] = histories
+        entry["dir_mtime"] = dir_mtime
+        self._save_histories(scenario_name)
+        return histories
+
+    def list_scenarios(self) -> list[str]:
+        """列出所有场景名称"""
+        with self._lock:
+            return list(self._scenarios().keys())
+
+    def list_histories(self, scenario_name: str) -> list[str]:
+        """列出场景的所有对话历史文件名"""
+        with self._lock:
+            return list(self._histories(scenario_name).keys())
+
+    def scenario_info(self, scenario_name: str) -> dict | None:
+        """
+        场景信息
+
+        :return: 包含 name、mtime、size、participants、message_count（start 消息数）、
+            preview（系统提示词开头）、history_count 的字典，场景不存在时为 None
+        """
+        with self._lock:
+            scenarios = self._scenarios()
+            entry = scenarios.get(scenario_name)
+            if entry is None:
+                return None
+            scene_path = os.path.join(self._scenario_dir, scenario_name, "scene.json")
+            if _stat(scene_path)[0] != entry["mtime"]:
+                entry = scenarios[scenario_name] = self._scenario_entry(scenario_name)
+                self._save()
+            return {"name": scenario_name, "history_count": len(self._histories(scenario_name)), **entry}
+
+    def history_info(self, scenario_name: str, history_name: str) -> dict | None:
+        """
+        对话历史信息
+
+        :return: 包含 name、mtime、size、participants、message_count、preview 的字典，对话历史不存在时为 None
+        """
+        with self._lock:
+            histories = self._histories(scenario_name)
+            entry = histories.get(history_name)
+            if entry is None:
+                return None
+            history_path = os.path.join(get_history_dir(scenario_name), history_name)
+            if _stat(history_path, get_journal_path(history_path))[0] != entry["mtime"]:
+                entry = histories[history_name] = self._history_entry(history_path)
+                self._save_histories(scenario_name)
+            return {"name": history_name, **entry}
+
+    # ---------- 增量更新 ----------
+
+    def on_history_update(self, history_path: str, start: int, messages: list | None):
+        """history_update_hooks 回调"""
+        history_path = os.path.abspath(history_path)
+        # 其他存储方式（如 SQLite）的写入不对应文件
+        if messages is not None and not os.path.exists(history_path):
+            return
+        history_name = os.path.basename(history_path)
+        scenario_name = os.path.basename(os.path.dirname(os.path.dirname(history_path)))
+        with self._lock:
+            if scenario_name not in self._scenarios():
+                return
+            histories = self._load_histories(scenario_name)["histories"]
+            old = histories.get(history_name)
+            if messages is None:
+                histories.pop(history_name, None)
+            elif old is not None and (start == 0 or _preview(messages)):
+                # 变化部分之前的消息未改变，只需更新消息数和预览
+                mtime, size = _stat(history_path, get_journal_path(history_path))
+                histories[history_name] = {
+                    **old,
+                    "mtime": mtime,
+                    "size": size,
+                    "message_count": start + len(messages),
+                    "preview": _preview(messages)
+                }
+            else:
+                histories[history_name] = self._history_entry(history_path)
+            self._save_histories(scenario_name)
+
+    def on_scenario_update(self, scene_path: str, scene_data: dict | None):
+        """scenario_update_hooks 回调"""
+        if scene_data is not None and not os.path.exists(scene_path):
+            return
+        scenario_name = os.path.basename(os.path.dirname(os.path.abspath(scene_path)))
+        with self._lock:
+            scenarios = self._scenarios()
+            if scene_data is None:
+                scenarios.pop(scenario_name, None)
+                self._drop_histories(scenario_name)
+            else:
+                scenarios[scenario_name] = self._scenario_entry(scenario_name, scene_data)
+            self._save()
+
+
+workspace_catalog = WorkspaceCatalog()
+history_update_hooks.append(workspace_catalog.on_history_update)
+scenario_update_hooks.append(workspace_catalog.on_scenario_update)
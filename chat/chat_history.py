@@ -2,65 +2,272 @@ import os
 import json
 
 from common.config import global_config
+from common.fileio import atomic_write_json, append_json_line, read_json_lines
+from common.filelock import FileLock
+
+
+# 历史记录写入后的回调，参数为 (history_path, start, messages)，
+# messages 为从第 start 条开始发生变化的消息，为 None 表示历史记录被删除
+history_update_hooks = []
+
+
+def notify_history_update(history_path: str, start: int, messages: list | None):
+    """通知历史记录已写入，回调出错不影响历史记录的保存"""
+    for hook in history_update_hooks:
+        try:
+            hook(history_path, start, messages)
+        except Exception as e:
+            print(f"历史记录更新回调出错: {e}")
+
+
+def get_journal_path(history_path: str) -> str:
+    """获取聊天历史对应的追加日志文件路径，例如 abc.json 对应 abc.jsonl"""
+    return os.path.splitext(history_path)[0] + ".jsonl"
+
+
+def get_lock_path(history_path: str) -> str:
+    """获取聊天历史写入时使用的锁文件路径，例如 abc.json 对应 abc.lock"""
+    return os.path.splitext(history_path)[0] + ".lock"
+
+
+def _disk_stamp(*paths) -> tuple:
+    """文件的 (修改时间, 大小)，用于判断文件是否被其他会话修改"""
+    stamps = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+
+class HistoryConflictError(Exception):
+    """聊天历史已被其他会话修改，且无法与本次修改合并"""
+
+
+def merge_appends(base: list, ours: list, theirs: list) -> list | None:
+    """
+    三方合并消息列表：双方都只在 base 之后追加了消息时，返回 theirs 加上 ours 追加的消息
+
+    :param base: 双方修改前的消息
+    :param ours: 本会话修改后的消息
+    :param theirs: 其他会话已写入的消息
+    :return: 合并后的消息，无法合并（有一方回退或编辑了 base 中的消息）时为 None
+    """
+    count = len(base)
+    if ours[:count] != base or theirs[:count] != base:
+        return None
+    return theirs + ours[count:]
 
 
 class ChatHistory:
-    """聊天历史记录类"""
+    """
+    聊天历史记录类
+
+    存储格式为 快照 + 追加日志：
+        xxx.json: 快照，完整的历史记录，journal_seq 记录快照已包含的日志序号
+        xxx.jsonl: 追加日志，每次更新追加一行，记录相对上次写入的变化（修改元数据、截断、追加消息）
+    加载时读取快照并重放序号大于 journal_seq 的日志；日志过长或变化过大时压缩为新的快照。
+    旧版本只有 xxx.json 的历史记录即为没有日志的快照，无需转换即可加载，首次压缩时自动升级。
+
+    多个会话同时写入同一历史记录时使用乐观并发控制：日志序号即版本号，
+    写入时持有 xxx.lock 文件锁，发现文件在加载后被其他会话修改则重新加载并合并（见 update），
+    读取不加锁，不会被写入阻塞。
+    """
+    # 日志行数超过该值时压缩为快照
+    COMPACT_LINES = 200
+    # 单次更新追加的消息数超过该值时（如整体编辑对话）直接写快照
+    COMPACT_MESSAGES = 50
+
     def __init__(self, history_path: str):
         self.history_path = history_path
+        self.journal_path = get_journal_path(history_path)
 
         self.assistant_name = ""
         self.user_name = ""
         self.system_prompt = ""
 
         self.messages = []
+        self.summary = {}
+
+        self._meta = {}
+        self._persisted = []
+        self._seq = 0
+        self._journal_lines = 0
+        self._stamp = None
 
         self._content = self.load_history()
 
+    @property
+    def version(self) -> int:
+        """版本号，每次写入加1"""
+        return self._seq
+
     def load_history(self):
-        """加载聊天历史记录"""
+        """加载聊天历史记录：读取快照并重放追加日志"""
+        # 先记录时间戳再读取，读取期间的写入会在下次写入时被发现
+        self._stamp = _disk_stamp(self.history_path, self.journal_path)
         with open(self.history_path, 'r', encoding='utf-8') as f:
-            # print("=================== load history", self.history_path)
             history_data = json.load(f)
-        
-            self.assistant_name = history_data["assistant_name"]
-            self.user_name = history_data["user_name"]
-            self.system_prompt = history_data.get("system_prompt", "")
 
-            self.messages = history_data["messages"]
+        self._seq = history_data.pop("journal_seq", 0)
+        messages = history_data.pop("messages")
+        self._meta = history_data
+        self._journal_lines = 0
+
+        for record in read_json_lines(self.journal_path):
+            self._journal_lines += 1
+            # 快照已包含的日志（压缩后、清空日志前崩溃时残留）跳过
+            if record["seq"] <= self._seq:
+                continue
+            self._seq = record["seq"]
+            if "meta" in record:
+                self._meta = record["meta"]
+            if "truncate" in record:
+                del messages[record["truncate"]:]
+            messages.extend(record.get("append", []))
+
+        self._set_state(messages)
+        return self._content
+
+    def _set_state(self, messages: list):
+        self.messages = messages
+        self._persisted = [dict(m) for m in messages]
+        self._content = {**self._meta, "messages": messages}
+
+        self.assistant_name = self._meta["assistant_name"]
+        self.user_name = self._meta["user_name"]
+        self.system_prompt = self._meta.get("system_prompt", "")
+        self.summary = self._meta.get("summary", {})
+
+    def _write_lock(self):
+        """写入时持有的锁，其他存储方式的历史记录重写该方法"""
+        return FileLock(get_lock_path(self.history_path))
+
+    def _changed_on_disk(self) -> bool:
+        """加载或上次写入之后是否被其他会话修改，在持有写入锁时调用"""
+        return _disk_stamp(self.history_path, self.journal_path) != self._stamp
+
+    def update(self, history_data: dict) -> bool:
+        """
+        更新聊天历史记录
+
+        只将相对上次写入的变化追加到日志中，普通的一轮对话只追加一行。
+        加载后被其他会话修改时重新加载：双方都只追加了消息则合并，其他会话的消息在前；
+        否则抛出 HistoryConflictError，本次修改不写入，对象保持为重新加载后的内容
+
+        :return: 是否合并了其他会话的修改，为 True 时 messages 与传入的不同，调用方需要重新加载
+        """
+        messages = history_data["messages"]
+        meta = {k: v for k, v in history_data.items() if k != "messages"}
+        merged = False
+
+        with self._write_lock():
+            if self._changed_on_disk():
+                base, base_meta, base_version = self._persisted, self._meta, self._seq
+                self.load_history()
+                if self._seq != base_version:
+                    messages = merge_appends(base, messages, self._persisted)
+                    if messages is None:
+                        raise HistoryConflictError(f"聊天历史 {self.history_path} 已被其他会话修改")
+                    # 只有本会话修改了元数据时才覆盖
+                    if meta == base_meta:
+                        meta = self._meta
+                    merged = True
+
+            common = 0
+            max_common = min(len(messages), len(self._persisted))
+            while common < max_common and messages[common] == self._persisted[common]:
+                common += 1
+
+            record = {}
+            if meta != self._meta:
+                record["meta"] = meta
+            if common < len(self._persisted):
+                record["truncate"] = common
+            if common < len(messages):
+                record["append"] = messages[common:]
+            if not record:
+                return merged
+
+            self._meta = meta
+            self._write_changes(common, record, messages)
+        notify_history_update(self.history_path, common, messages[common:])
+        return merged
+
+    def _write_changes(self, common: int, record: dict, messages: list):
+        """
+        写入变化：追加一行日志，或者压缩为快照。其他存储方式的历史记录重写该方法
 
-            return history_data
+        :param common: 与上次写入相同的消息数
+        :param record: 变化内容，包含 meta、truncate、append 中的若干项
+        :param messages: 完整的消息列表
+        """
+        appended = len(messages) - common
+        if appended > self.COMPACT_MESSAGES or self._journal_lines + 1 > self.COMPACT_LINES:
+            self._seq += 1
+            self._set_state(messages)
+            self.compact()
+            return
 
-    def update(self, history_data: dict):
-        """更新聊天历史记录"""
-        with open(self.history_path, 'w', encoding='utf-8') as f:
-            # print("=================== update history", self.history_path)
-            json.dump(history_data, f, ensure_ascii=False, indent=2)
+        self._seq += 1
+        append_json_line(self.journal_path, {"seq": self._seq, **record})
+        self._journal_lines += 1
+        self._stamp = _disk_stamp(self.history_path, self.journal_path)
+        self._advance_state(common, messages)
+
+    def _advance_state(self, common: int, messages: list):
+        """增量写入后更新状态，只复制发生变化的消息"""
+        del self._persisted[common:]
+        self._persisted.extend(dict(m) for m in messages[common:])
+        self.messages = messages
+        self._content = {**self._meta, "messages": messages}
+        self.summary = self._meta.get("summary", {})
+
+    def compact(self):
+        """将当前状态压缩为快照并清空追加日志"""
+        snapshot = {**self._content, "journal_seq": self._seq}
+        atomic_write_json(self.history_path, snapshot)
+        # 快照已替换，此时崩溃残留的日志会因序号不大于 journal_seq 而被跳过
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_lines = 0
+        self._stamp = _disk_stamp(self.history_path, self.journal_path)
 
     def to_json(self):
         return self._content
 
 
+def get_history_dir(scenario_name: str) -> str:
+    """获取指定场景的聊天历史目录"""
+    return os.path.join(global_config.get_chat_workspace(), "scenario", scenario_name, "history")
+
+
 class ChatHistoryMgr:
+    """
+    场景的聊天历史管理
+
+    聊天历史的读写由存储后端（chat.storage）完成，默认为 JSON 文件，
+    设置环境变量 PROMPT_ME_STORAGE=sqlite 时使用 SQLite
+    """
     def __init__(self, scenario_name: str, ):
-        scenario_dir = os.path.join(global_config.get_chat_workspace(), "scenario")
-        self._history_dir = os.path.join(scenario_dir, scenario_name, "history")
+        # 存储后端依赖本模块，延迟导入
+        from chat.storage import get_storage
+        self._storage = get_storage()
+        self._scenario_name = scenario_name
 
-        self._all_history_files = {}
+        self._all_history_files = []
         self._load_all_history_files()
 
     def _load_all_history_files(self):
-        """加载指定场景的聊天历史文件"""
-        if os.path.exists(self._history_dir):
-            for filename in os.listdir(self._history_dir):
-                if filename.endswith('.json'):
-                    self._all_history_files[filename] = os.path.join(self._history_dir, filename)
-                    
-        return list(self._all_history_files.keys())
+        """加载指定场景的聊天历史名称"""
+        self._all_history_files = self._storage.list_histories(self._scenario_name)
+        return list(self._all_history_files)
 
     def list_histories(self) -> list[str]:
         """列出指定场景的聊天历史名称"""
-        return list(self._all_history_files.keys())
+        return list(self._all_history_files)
 
     def save_history(self, history_file: str, history: str) -> str:
         """添加新聊天历史到指定场景"""
@@ -68,31 +275,40 @@ class ChatHistoryMgr:
         if not history_file.endswith('.json'):
             history_file += '.json'
 
-        history_path = os.path.join(self._history_dir, history_file)
-
-        with open(history_path, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-
+        self._storage.save_history(self._scenario_name, history_file, history)
         return history_file
 
     def remove_history(self, history_name: str) -> bool:
         """删除指定场景的聊天历史"""
         if history_name in self._all_history_files:
-            os.remove(self._all_history_files[history_name])
-
+            self._storage.remove_history(self._scenario_name, history_name)
             return True
         return False
 
     def get_history(self, history_name: str) -> ChatHistory:
         """获取指定场景的聊天历史数据"""
         if history_name in self._all_history_files:
-            return ChatHistory(self._all_history_files[history_name])
+            return self._storage.get_history(self._scenario_name, history_name)
 
         raise FileNotFoundError(f"聊天历史文件 {history_name} 不存在")
 
     def get_history_path(self, history_name: str) -> str:
         """获取指定场景的聊天历史文件路径"""
-        return self._all_history_files.get(history_name)
+        if history_name in self._all_history_files:
+            return self._storage.history_path(self._scenario_name, history_name)
+        return None
+
+    def get_history_info(self, history_name: str) -> dict | None:
+        """获取聊天历史的消息数、修改时间等信息，见 WorkspaceCatalog.history_info"""
+        return self._storage.history_info(self._scenario_name, history_name)
+
+    def get_stamp(self, history_name: str = None) -> tuple:
+        """
+        聊天历史的版本戳，聊天历史变化时改变，用于判断缓存是否需要重新加载
+
+        :param history_name: 为 None 时返回聊天历史列表的版本戳
+        """
+        return self._storage.history_stamp(self._scenario_name, history_name)
 
     def history_exists(self, history_name: str) -> bool:
         """检查指定场景的聊天历史是否存在"""
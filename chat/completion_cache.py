@@ -0,0 +1,202 @@
+import os
+import json
+import math
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from common.config import LLMConfig, global_config
+from common.fileio import atomic_write_json
+from common.utils import get_openai_client
+from chat.context import message_text
+
+
+def _hash(data) -> str:
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _cosine(a: list, b: list) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ReplayStream:
+    """
+    命中缓存时回放缓存的回复，接口与 chat.engine.ChatStream 一致，
+    页面仍以流式方式显示，无需区分是否命中缓存
+    """
+    def __init__(self, config: LLMConfig, text: str, chunk_size: int = 16):
+        self.config = config
+        self._text = text
+        self._chunk_size = chunk_size
+        self.status = "completed"
+        self.error = None
+        self.usage = None
+        self.ttft = 0.0
+        self.candidates = []
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def done(self) -> bool:
+        return True
+
+    def cancel(self):
+        pass
+
+    def __iter__(self):
+        return self.frames()
+
+    def frames(self, frame_chars: int = 1, frame_interval: float = 0.0):
+        """与 ChatStream.frames 一致，每帧至少 chunk_size 个字符"""
+        size = max(frame_chars, self._chunk_size)
+        for i in range(0, len(self._text), size):
+            yield self._text[i:i + size]
+
+
+class CompletionCache:
+    """
+    对话回复缓存，保存在 chat 工作目录的 completion_cache 目录中，每条缓存一个文件
+
+    精确匹配：按 (model, temperature, messages) 的哈希查找
+    近似匹配（可选）：配置了 completion_cache_embedding_model 时，对除最后一条消息外完全相同的请求，
+        比较最后一条消息的向量相似度，超过 completion_cache_similarity 时视为命中
+    缓存超过 completion_cache_ttl 秒后过期，条数超过 completion_cache_size 时淘汰最久未使用的缓存
+    """
+    def __init__(self, cache_dir: str = None):
+        self._cache_dir = cache_dir or os.path.join(global_config.get_chat_workspace(), "completion_cache")
+        self._lock = threading.Lock()
+        self._entries = None
+
+    def _load(self) -> OrderedDict:
+        """首次使用时加载全部缓存的索引，按最近使用时间（文件修改时间）排序"""
+        if self._entries is not None:
+            return self._entries
+
+        entries = []
+        if os.path.exists(self._cache_dir):
+            for filename in os.listdir(self._cache_dir):
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(self._cache_dir, filename)
+                try:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        entry = json.load(f)
+                    entries.append((os.path.getmtime(path), entry))
+                except (OSError, ValueError):
+                    continue
+        entries.sort(key=lambda item: item[0])
+        self._entries = OrderedDict((entry["key"], entry) for _, entry in entries)
+        return self._entries
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, f"{key}.json")
+
+    def _remove(self, key: str):
+        self._entries.pop(key, None)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _touch(self, key: str):
+        self._entries.move_to_end(key)
+        try:
+            os.utime(self._path(key))
+        except OSError:
+            pass
+
+    @staticmethod
+    def make_keys(config: LLMConfig, messages: list, endpoints: list = None) -> tuple[str, str]:
+        """
+        返回 (精确匹配的key, 除最后一条消息外的上下文key)
+
+        :param endpoints: 多接口路由时的全部候选接口，回复可能来自其中任何一个，key 按接口集合而不是 config 计算
+        """
+        if endpoints:
+            scope = sorted([c.base_url, c.model, c.temperature] for c in endpoints)
+        else:
+            scope = [config.model, config.temperature]
+        key = _hash([scope, messages])
+        context_key = _hash([scope, messages[:-1]])
+        return key, context_key
+
+    def _embed(self, config: LLMConfig, messages: list) -> list | None:
+        if not config.completion_cache_embedding_model or not messages:
+            return None
+        try:
+            response = get_openai_client(config).embeddings.create(
+                model=config.completion_cache_embedding_model,
+                input=message_text(messages[-1])
+            )
+            return response.data[0].embedding
+        except Exception as e:
+            print(f"计算缓存向量出错: {e}")
+            return None
+
+    def lookup(self, config: LLMConfig, messages: list, endpoints: list = None) -> tuple[str | None, list | None]:
+        """
+        查找缓存的回复
+
+        :param endpoints: 见 make_keys
+        :return: (缓存的回复, 最后一条消息的向量)，未命中时回复为 None，向量可在写入缓存时复用
+        """
+        key, context_key = self.make_keys(config, messages, endpoints)
+        now = time.time()
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key)
+            if entry is not None:
+                if now - entry["created"] <= config.completion_cache_ttl:
+                    self._touch(key)
+                    return entry["text"], None
+                self._remove(key)
+
+        embedding = self._embed(config, messages)
+        if embedding is None:
+            return None, None
+
+        with self._lock:
+            best_key, best_score = None, config.completion_cache_similarity
+            for entry in list(self._entries.values()):
+                if entry["context_key"] != context_key or not entry.get("embedding"):
+                    continue
+                if now - entry["created"] > config.completion_cache_ttl:
+                    self._remove(entry["key"])
+                    continue
+                score = _cosine(embedding, entry["embedding"])
+                if score >= best_score:
+                    best_key, best_score = entry["key"], score
+            if best_key is not None:
+                self._touch(best_key)
+                return self._entries[best_key]["text"], embedding
+        return None, embedding
+
+    def put(self, config: LLMConfig, messages: list, text: str, embedding: list = None, endpoints: list = None):
+        """写入缓存，超过条数上限时淘汰最久未使用的缓存，endpoints 见 make_keys"""
+        key, context_key = self.make_keys(config, messages, endpoints)
+        entry = {
+            "key": key,
+            "context_key": context_key,
+            "model": config.model,
+            "created": time.time(),
+            "text": text,
+            "embedding": embedding
+        }
+        with self._lock:
+            entries = self._load()
+            os.makedirs(self._cache_dir, exist_ok=True)
+            atomic_write_json(self._path(key), entry, indent=None)
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > config.completion_cache_size:
+                oldest_key = next(iter(entries))
+                self._remove(oldest_key)
+
+
+completion_cache = CompletionCache()
@@ -0,0 +1,161 @@
+import re
+
+
+# 中日韩字符（含全角标点）大致按1个字符1个token计算
+CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+# 每条消息的固定开销（role、name 等字段）
+MESSAGE_OVERHEAD = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估算文本的token数：中日韩字符按1个token计，其余字符按4个字符1个token计
+
+    :param text: 文本内容
+    :type text: str
+    :return: 估算的token数
+    :rtype: int
+    """
+    if not text:
+        return 0
+    cjk_count = len(CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def message_text(msg: dict) -> str:
+    """获取消息的文本内容，兼容 content 为分段列表的格式"""
+    content = msg.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+class TrimStrategy:
+    """
+    上下文裁剪策略基类
+
+    消息被划分为三段：
+        head: 开头的系统提示词（破甲提示词、场景提示词），始终保留
+        pinned: 场景的 start 消息
+        body: 其余对话消息
+    """
+    name = ""
+
+    def trim(self, head: list, pinned: list, body: list, budget: int, counter) -> list:
+        raise NotImplementedError()
+
+    @staticmethod
+    def _take_newest(messages: list, budget: int, counter) -> list:
+        """从最新的消息开始向前选取，直到超出预算；与按对丢弃相同，超出预算时也至少保留最后一条消息"""
+        kept = []
+        for msg in reversed(messages):
+            tokens = counter(msg)
+            if kept and tokens > budget:
+                break
+            budget -= tokens
+            kept.append(msg)
+        kept.reverse()
+        return kept
+
+
+TRIM_STRATEGIES = {}
+
+
+def register_trim_strategy(cls):
+    """注册裁剪策略，可作为类装饰器使用"""
+    TRIM_STRATEGIES[cls.name] = cls
+    return cls
+
+
+@register_trim_strategy
+class SlidingWindowStrategy(TrimStrategy):
+    """滑动窗口：只保留系统提示词和最新的若干条消息，start 消息和普通消息一样可被裁剪"""
+    name = "sliding_window"
+
+    def trim(self, head, pinned, body, budget, counter):
+        remain = budget - sum(counter(m) for m in head)
+        return head + self._take_newest(pinned + body, remain, counter)
+
+
+@register_trim_strategy
+class KeepPinnedStrategy(TrimStrategy):
+    """保留 start 消息：系统提示词和 start 消息始终保留，其余消息按滑动窗口裁剪"""
+    name = "keep_pinned"
+
+    def trim(self, head, pinned, body, budget, counter):
+        fixed = head + pinned
+        remain = budget - sum(counter(m) for m in fixed)
+        return fixed + self._take_newest(body, remain, counter)
+
+
+@register_trim_strategy
+class DropOldestPairsStrategy(TrimStrategy):
+    """按对丢弃：保留系统提示词和 start 消息，从最早的一问一答开始成对丢弃，避免留下没有提问的回答"""
+    name = "drop_oldest_pairs"
+
+    def trim(self, head, pinned, body, budget, counter):
+        fixed = head + pinned
+        total = sum(counter(m) for m in fixed) + sum(counter(m) for m in body)
+        start = 0
+        # 至少保留最后一条消息
+        while total > budget and start < len(body) - 1:
+            total -= counter(body[start])
+            start += 1
+            # 用户消息和紧随其后的回复一起丢弃
+            if (body[start - 1].get("role") == "user" and start < len(body) - 1
+                    and body[start].get("role") == "assistant"):
+                total -= counter(body[start])
+                start += 1
+        return fixed + body[start:]
+
+
+class ContextManager:
+    """
+    上下文窗口管理器，按token预算裁剪发送给模型的消息
+
+    每条消息的token数只计算一次并缓存，预算为0时不裁剪
+    """
+    def __init__(self, budget: int = 0, strategy: str = "keep_pinned"):
+        if strategy not in TRIM_STRATEGIES:
+            raise ValueError(f"不支持的上下文裁剪策略: {strategy}")
+        self.budget = budget
+        self._strategy = TRIM_STRATEGIES[strategy]()
+        self._token_cache = {}
+
+    def count(self, msg: dict) -> int:
+        """计算单条消息的token数（带缓存）"""
+        text = message_text(msg)
+        key = (msg.get("role", ""), msg.get("name", ""), text)
+        tokens = self._token_cache.get(key)
+        if tokens is None:
+            tokens = estimate_tokens(text) + MESSAGE_OVERHEAD
+            self._token_cache[key] = tokens
+        return tokens
+
+    def total_tokens(self, messages: list) -> int:
+        """计算消息列表的总token数"""
+        return sum(self.count(m) for m in messages)
+
+    def pack(self, messages: list, pinned_count: int = 0) -> list:
+        """
+        将消息裁剪到token预算之内
+
+        :param messages: 完整的上下文消息
+        :type messages: list
+        :param pinned_count: 紧随系统提示词之后的 start 消息数量
+        :type pinned_count: int
+        :return: 裁剪后需要发送给模型的消息
+        :rtype: list
+        """
+        if self.budget <= 0 or self.total_tokens(messages) <= self.budget:
+            return messages
+
+        head_count = 0
+        while head_count < len(messages) and messages[head_count].get("role") == "system":
+            head_count += 1
+        pinned_end = min(head_count + pinned_count, len(messages))
+
+        head = messages[:head_count]
+        pinned = messages[head_count:pinned_end]
+        body = messages[pinned_end:]
+        return self._strategy.trim(head, pinned, body, self.budget, self.count)
@@ -0,0 +1,308 @@
+import time
+import queue
+import asyncio
+
+from common.config import LLMConfig
+from common.utils import get_async_openai_client
+from common.async_loop import background_loop
+from common.ratelimit import rate_limiter, PRIORITY_CHAT
+from chat.context import estimate_tokens, message_text, MESSAGE_OVERHEAD
+
+
+# 流式输出结束的哨兵
+_DONE = object()
+
+
+class ChatStream:
+    """
+    一次流式对话请求
+
+    请求在后台事件循环中通过 AsyncOpenAI 执行，文本片段经队列交给调用线程，
+    可以像同步生成器一样迭代（供 st.write_stream 使用），也可以随时取消。
+    迭代被提前中止（例如 Streamlit 脚本被中断）时自动取消请求。
+
+    n > 1 时同时生成多个候选回复，只有第一个候选以流式输出，其余候选在后台生成，
+    完成后可通过 candidates 获取。mode 为 n 时使用接口的 n 参数，为 parallel 时并发发起多个请求。
+
+    configs 为按顺序尝试的接口，请求在收到首个token前失败时自动切换到下一个接口重试，
+    传入 router 时将每个接口的成功、失败和首个token延迟反馈给路由。
+
+    每个请求发起前经 common.ratelimit 按接口的 rpm/tpm 排队，priority 为排队优先级，
+    排队时间不计入超时，记录在 queue_wait 中。
+
+    第一个候选结束后 status 为以下之一：
+        completed: 正常结束
+        cancelled: 被取消
+        timeout: 超过总超时时间或首个token超时时间
+        error: 请求出错，错误保存在 error 中
+    """
+    def __init__(self, configs: list[LLMConfig], messages: list, n: int = 1, mode: str = "n",
+                 router=None, priority: int = PRIORITY_CHAT, **kwargs):
+        self._configs = configs
+        self._router = router
+        self._priority = priority
+        self._messages = messages
+        # 限流使用的预估输入token数，请求结束后按 usage 修正
+        self._estimated_tokens = sum(estimate_tokens(message_text(m)) + MESSAGE_OVERHEAD for m in messages)
+        self._n = max(n, 1)
+        self._mode = mode
+        self._kwargs = kwargs
+        self._queue = queue.Queue()
+        self._chunks = []
+        self._candidate_chunks = {i: [] for i in range(1, self._n)}
+        # 按完成先后顺序记录，保证 candidates 只会在末尾追加
+        self._candidate_done = []
+        self._primary_done = False
+
+        self.status = "running"
+        self.error = None
+        # 实际使用的接口
+        self.config = configs[0]
+        self.usage = None
+        self.started_at = None
+        self.first_token_at = None
+        self.finished_at = None
+        # 第一个候选的请求在限流队列中等待的秒数
+        self.queue_wait = 0.0
+        self._future = background_loop.submit(self._run())
+
+    @property
+    def text(self) -> str:
+        """第一个候选已收到的全部文本（被取消时为部分文本）"""
+        return "".join(self._chunks)
+
+    @property
+    def candidates(self) -> list[str]:
+        """其余已生成完成的候选回复，按完成先后排列"""
+        return ["".join(self._candidate_chunks[i]) for i in self._candidate_done]
+
+    @property
+    def ttft(self) -> float | None:
+        """首个token延迟（秒）"""
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def latency(self) -> float | None:
+        """第一个候选的总耗时（秒），尚未结束时为已用时间"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def done(self) -> bool:
+        return self.status != "running"
+
+    def cancel(self):
+        """取消请求，线程安全"""
+        if self._future.cancel() and self.status == "running":
+            self.status = "cancelled"
+
+    def __iter__(self):
+        return self.frames()
+
+    def frames(self, frame_chars: int = 1, frame_interval: float = 0.0):
+        """
+        按帧迭代第一个候选的文本：收到片段后继续等待，累积到 frame_chars 个字符
+        或距帧内第一个片段超过 frame_interval 秒时合并输出，流停顿时不会积压超过 frame_interval 秒
+        """
+        try:
+            finished = False
+            while not finished:
+                content = self._queue.get()
+                if content is _DONE:
+                    break
+                parts, size = [content], len(content)
+                deadline = time.monotonic() + frame_interval
+                while size < frame_chars:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        content = self._queue.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                    if content is _DONE:
+                        finished = True
+                        break
+                    parts.append(content)
+                    size += len(content)
+                yield "".join(parts)
+        finally:
+            if not self.done:
+                self.cancel()
+
+    def _finish_primary(self, status: str):
+        """第一个候选结束，结束流式输出，其余候选继续在后台生成"""
+        if self._primary_done:
+            return
+        self._primary_done = True
+        self.finished_at = asyncio.get_running_loop().time()
+        if self.status == "running":
+            self.status = status
+        self._queue.put(_DONE)
+
+    def _append(self, candidate: int, content: str):
+        if candidate == 0:
+            if self.first_token_at is None:
+                self.first_token_at = asyncio.get_running_loop().time()
+            self._chunks.append(content)
+            self._queue.put(content)
+        else:
+            self._candidate_chunks[candidate].append(content)
+
+    def _finish_candidate(self, candidate: int):
+        if candidate == 0:
+            self._finish_primary("completed")
+        elif candidate not in self._candidate_done:
+            self._candidate_done.append(candidate)
+
+    async def _request(self, config: LLMConfig, first_candidate: int, n: int) -> float | None:
+        """
+        发起一次流式请求，第 i 个 choice 对应候选 first_candidate + i
+
+        :return: 本次请求的首个token延迟（秒），从取得限流许可开始计算，没有输出时为 None
+        """
+        loop = asyncio.get_running_loop()
+        queued_at = loop.time()
+        permit = await rate_limiter.acquire_async(config, self._estimated_tokens, self._priority)
+        started_at = loop.time()
+        if first_candidate == 0:
+            self.queue_wait += started_at - queued_at
+
+        timeout = config.timeout or None
+        first_token_timeout = config.first_token_timeout or timeout
+        deadline = loop.time() + timeout if timeout else None
+        kwargs = dict(self._kwargs)
+        if n > 1:
+            kwargs["n"] = n
+        if config.stream_usage:
+            kwargs["stream_options"] = {"include_usage": True}
+
+        stream = None
+        first_token_at = None
+        usage = None
+        received = []
+        try:
+            async with asyncio.timeout(first_token_timeout) as timer:
+                client = get_async_openai_client(config)
+                stream = await client.chat.completions.create(
+                    model=config.model,
+                    messages=self._messages,
+                    stream=True,
+                    **kwargs
+                )
+                async for chunk in stream:
+                    # 最后一个 chunk 只包含 usage，记录第一个请求的 usage
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                        if first_candidate == 0:
+                            self.usage = usage
+                    for choice in chunk.choices:
+                        candidate = first_candidate + choice.index
+                        content = choice.delta.content or ''
+                        if content:
+                            if first_token_at is None:
+                                # 收到首个token后改为总超时时间
+                                first_token_at = loop.time()
+                                timer.reschedule(deadline)
+                            received.append(content)
+                            self._append(candidate, content)
+                        if choice.finish_reason:
+                            self._finish_candidate(candidate)
+            # 部分接口不返回 finish_reason，流结束即视为全部完成
+            for candidate in range(first_candidate, first_candidate + n):
+                self._finish_candidate(candidate)
+        except Exception as e:
+            # 429 时按 Retry-After 暂停该接口的请求
+            rate_limiter.report_error(config, e)
+            raise
+        finally:
+            if stream is not None:
+                await stream.close()
+            # 每个请求按自己的 usage 修正限流用量，没有 usage（未要求返回或请求失败）时按预估的输入加已收到的输出计算
+            used = getattr(usage, "total_tokens", None)
+            permit.settle(used if used is not None else self._estimated_tokens + estimate_tokens("".join(received)))
+        rate_limiter.report_success(config)
+        return first_token_at - started_at if first_token_at is not None else None
+
+    async def _run(self):
+        self.started_at = asyncio.get_running_loop().time()
+        extras = []
+        parallel = self._n > 1 and self._mode == "parallel"
+        try:
+            for index, config in enumerate(self._configs):
+                self.config = config
+                if parallel:
+                    extras = [asyncio.create_task(self._request(config, i, 1)) for i in range(1, self._n)]
+                try:
+                    ttft = await self._request(config, 0, 1 if parallel else self._n)
+                except Exception as e:
+                    # 已经开始输出，或者没有其他接口可用时不再重试
+                    if self.first_token_at is not None:
+                        raise
+                    self._record(config, False)
+                    if index == len(self._configs) - 1:
+                        raise
+                    print(f"接口 {config.base_url} ({config.model}) 请求失败，切换到下一个接口: {e!r}")
+                    for task in extras:
+                        task.cancel()
+                    extras = []
+                    self._candidate_chunks = {i: [] for i in range(1, self._n)}
+                    self._candidate_done = []
+                    continue
+                self._record(config, True, ttft)
+                break
+            # 其余候选继续在后台生成，失败的候选直接丢弃
+            if extras:
+                await asyncio.gather(*extras, return_exceptions=True)
+        except TimeoutError:
+            self._finish_primary("timeout")
+        except asyncio.CancelledError:
+            self._finish_primary("cancelled")
+            raise
+        except Exception as e:
+            if not self._primary_done:
+                self.error = e
+            self._finish_primary("error")
+        finally:
+            for task in extras:
+                task.cancel()
+            self._finish_primary("completed")
+
+
+    def _record(self, config: LLMConfig, ok: bool, ttft: float = None):
+        """
+        反馈给路由
+
+        :param ttft: 该接口这次请求的首个token延迟，不包括限流排队时间和之前失败的接口的耗时
+        """
+        if self._router is None:
+            return
+        if ok:
+            self._router.record_success(config, ttft)
+        else:
+            self._router.record_failure(config)
+
+
+class ChatEngine:
+    """异步流式对话引擎"""
+    def stream(self, config: LLMConfig, messages: list, n: int = 1, mode: str = "n",
+               router=None, priority: int = PRIORITY_CHAT, **kwargs) -> ChatStream:
+        """
+        发起流式对话请求
+
+        :param config: 模型配置，超时时间取自 timeout 和 first_token_timeout
+        :param messages: 发送给模型的消息
+        :param n: 候选回复数量
+        :param mode: 多个候选的生成方式，n 使用接口的 n 参数，parallel 并发发起多个请求
+        :param router: 多接口路由（chat.router.ProviderRouter），传入时忽略 config，由路由选择接口并故障转移
+        :param priority: 限流排队优先级，见 common.ratelimit
+        :return: 可同步迭代、可取消的流式响应
+        """
+        configs = router.candidates() if router is not None else [config]
+        return ChatStream(configs, messages, n=n, mode=mode, router=router, priority=priority, **kwargs)
+
+
+chat_engine = ChatEngine()
@@ -2,15 +2,37 @@ import streamlit as st
 from streamlit_ace import st_ace
 
 from common.config import global_config, LLMConfig
+from common.session_cache import StampedCache
 from chat.scenario import ScenarioMgr, Scenario
-from chat.chat_history import ChatHistoryMgr, ChatHistory, ChatHistoryEditor
+from chat.chat_history import ChatHistoryMgr, ChatHistory, ChatHistoryEditor, HistoryConflictError
+from chat.storage import get_storage
 from chat.aibot import AIBot
+from chat.router import ProviderRouter, get_router
+from chat.prompt_cache import prompt_cache_stats
+from common.ratelimit import rate_limiter
+from chat.render import MessageWindow, markdown_cache
+from chat.catalog import format_mtime
+
+
+AUTO_ROUTE = "🔀自动路由"
 
 
 class PageState:
+    """
+    页面状态，保存在 st.session_state 中
+
+    场景、对话历史和 AIBot 按 (名称, 文件修改时间) 缓存，
+    选择未变化时脚本重新运行不会读取文件，也不会重新构建对象。
+    """
     def __init__(self):
         if not st.session_state.get("llm_config", None):
             st.session_state.llm_config = global_config.get_llm_config()
+
+        if "current_llm_name" not in st.session_state:
+            st.session_state.current_llm_name = None
+
+        if "router" not in st.session_state:
+            st.session_state.router = None
         
         if not st.session_state.get("scenario_mgr", None):
             st.session_state.scenario_mgr = ScenarioMgr()
@@ -30,6 +52,11 @@ class PageState:
         if "ai_bot" not in st.session_state:
             st.session_state.ai_bot = None
 
+        self._history_mgr_cache = StampedCache(st.session_state, "history_mgr_cache")
+        self._scenario_cache = StampedCache(st.session_state, "scenario_cache")
+        self._history_cache = StampedCache(st.session_state, "history_cache")
+        self.message_window = MessageWindow(st.session_state, "message_window")
+
     @property
     def llm_config(self) -> LLMConfig:
         return st.session_state.llm_config
@@ -40,9 +67,12 @@ class PageState:
     
     @property
     def history_mgr(self) -> ChatHistoryMgr:
-        if st.session_state.current_scenario_name is None:
+        scenario_name = st.session_state.current_scenario_name
+        if scenario_name is None:
             return None
-        return ChatHistoryMgr(st.session_state.current_scenario_name)
+        # 新建、删除历史记录时重新加载历史列表
+        return self._history_mgr_cache.get(scenario_name, get_storage().history_stamp(scenario_name),
+                                           lambda: ChatHistoryMgr(scenario_name))
     
     @property
     def current_scenario_name(self) -> str:
@@ -64,36 +94,67 @@ class PageState:
     def ai_bot(self) -> AIBot:
         return st.session_state.ai_bot
     
+    @property
+    def router(self) -> ProviderRouter:
+        return st.session_state.router
+
     def select_llm(self, llm_name) -> None:
-        llm_config = global_config.get_llm_config(name=llm_name)
-        st.session_state.llm_config = llm_config
+        if llm_name == st.session_state.current_llm_name:
+            return
+        if llm_name == AUTO_ROUTE:
+            # 自动路由：会话设置使用优先级最高的配置，请求由路由在全部配置之间分配
+            router = get_router()
+            st.session_state.router = router
+            st.session_state.llm_config = router.configs[0]
+        else:
+            st.session_state.router = None
+            st.session_state.llm_config = global_config.get_llm_config(name=llm_name)
+        st.session_state.current_llm_name = llm_name
     
     def select_scenario(self, scenario_name) -> None:
-        current_scenario = self.scenario_mgr.get_scenario(scenario_name)
+        def load():
+            scenario = self.scenario_mgr.get_scenario(scenario_name)
+            return scenario, AIBot(self.llm_config, scenario, self.router)
+
+        # 模型配置变化时同样需要重新构建 AIBot
+        key = (scenario_name, st.session_state.current_llm_name, str(self.llm_config.config_path))
+        stamp = self.scenario_mgr.get_stamp(scenario_name)
+        current_scenario, ai_bot = self._scenario_cache.get(key, stamp, load)
+        if ai_bot is st.session_state.ai_bot:
+            return
+
         st.session_state.current_scenario_name = scenario_name
         st.session_state.current_scenario = current_scenario
-
-        ai_boot = AIBot(self.llm_config, self.current_scenario)
-        st.session_state.ai_bot = ai_boot
+        st.session_state.ai_bot = ai_bot
+        # 新的 AIBot 需要重新加载对话历史
+        self._history_cache.invalidate()
 
     def select_history(self, history_name) -> None:
         if st.session_state.current_scenario_name is None:
             st.warning("请先选择场景")
             return
-        
-        current_history = self.history_mgr.get_history(history_name)
-        st.session_state.current_history_name = history_name
-        st.session_state.current_history = current_history
-        
-        if st.session_state.ai_bot is None:
-            ai_boot = AIBot(self.llm_config, self.current_scenario)
-            st.session_state.ai_bot = ai_boot
 
-        self.ai_bot.load_history_messages(current_history.messages)
+        def load():
+            history = self.history_mgr.get_history(history_name)
+            if st.session_state.ai_bot is None:
+                st.session_state.ai_bot = AIBot(self.llm_config, self.current_scenario, self.router)
+            self.ai_bot.load_history_messages(history.messages, history.summary)
+            return history
+
+        key = (self.current_scenario_name, history_name)
+        stamp = self.history_mgr.get_stamp(history_name)
+        st.session_state.current_history = self._history_cache.get(key, stamp, load)
+        st.session_state.current_history_name = history_name
 
-    def aibot_chat(self, user_input: str, new_system_prompt: str = "") -> str:
-        return self.ai_bot.chat(user_input, new_system_prompt)
+    def aibot_chat(self, user_input: str, new_system_prompt: str = "", use_cache: bool = True) -> str:
+        return self.ai_bot.chat(user_input, new_system_prompt, use_cache)
     
+    def aibot_switch_candidate(self, step: int, wrap: bool = True) -> bool:
+        if self.ai_bot.switch_candidate(step, wrap):
+            self.save_history()
+            return True
+        return False
+
     def aibot_pop_message(self) -> bool:
         if len(self.ai_bot.ctx_messages) > 0:
             self.ai_bot.ctx_messages.pop()
@@ -106,7 +167,53 @@ class PageState:
             st.warning("请先选择对话历史")
             return
         
-        self.current_history.update(self.ai_bot.get_history())
+        try:
+            merged = self.current_history.update(self.ai_bot.get_history())
+        except HistoryConflictError:
+            # 其他会话回退或编辑了对话，本次修改无法合并，重新加载
+            self.ai_bot.pending_save = False
+            self._history_cache.invalidate()
+            st.toast("对话历史已被其他会话修改，本次修改未保存，已重新加载", icon="⚠️")
+            st.rerun()
+        self.ai_bot.pending_save = False
+        if merged:
+            self.ai_bot.load_history_messages(self.current_history.messages, self.current_history.summary)
+            st.toast("已合并其他会话中的新消息", icon="🔀")
+        # 自身的写入不需要在下次运行时重新加载
+        self._history_cache.refresh((self.current_scenario_name, self.current_history_name),
+                                    self.history_mgr.get_stamp(self.current_history_name))
+
+def format_scenario_option(scenario_name: str) -> str:
+    info = get_storage().scenario_info(scenario_name)
+    if info is None:
+        return scenario_name
+    return f"{scenario_name}（{info['history_count']} 个对话）"
+
+
+def format_history_option(scenario_name: str, history_name: str) -> str:
+    info = get_storage().history_info(scenario_name, history_name)
+    if info is None:
+        return history_name
+    return f"{history_name} · {info['message_count']} 条 · {format_mtime(info)}"
+
+
+@st.fragment
+def chat_messages(state: PageState):
+    """
+    显示对话历史，只渲染最近的一页消息
+
+    作为 fragment 运行，加载更早的消息时只重新运行这一部分
+    """
+    messages = [msg for msg in state.ai_bot.ctx_messages if msg["role"] != "system"]
+    key = (state.current_scenario_name, state.current_history_name)
+    hidden, visible = state.message_window.visible(key, messages)
+    if hidden:
+        st.button(f"⏫加载更早的消息（还有 {hidden} 条）", key="load_earlier",
+                  on_click=state.message_window.load_more)
+    for msg in visible:
+        with st.chat_message(msg["role"]):
+            st.markdown(markdown_cache.get(msg))
+
 
 # 主程序入口
 def chat_page(state: PageState):
@@ -115,14 +222,18 @@ def chat_page(state: PageState):
     # 侧边栏 - 场景选择
     with st.sidebar:
         st.subheader("📁 模型")
-        llm_names = global_config.list_llm_config()
+        llm_names = global_config.list_llm_config() + [AUTO_ROUTE]
         selected_llm = st.selectbox("选择模型配置", llm_names, key="llm_selector", index=None)
         if selected_llm:
             state.select_llm(selected_llm)
+        if state.router is not None:
+            with st.expander("🔀 接口状态"):
+                st.dataframe(state.router.report(), hide_index=True)
 
         st.subheader("📁 场景")
         scenario_names = state.scenario_mgr.list_scenario()
-        selected_scenario = st.selectbox("选择场景", scenario_names, key="scene_selector")
+        selected_scenario = st.selectbox("选择场景", scenario_names, key="scene_selector",
+                                         format_func=format_scenario_option)
 
         if selected_scenario:
             # 加载场景配置
@@ -132,7 +243,11 @@ def chat_page(state: PageState):
             # 历史对话选择
             histories = state.history_mgr.list_histories()
             history_options =  histories + ["➕新建对话"]
-            selected_history = st.selectbox("选择对话历史", history_options, key="history_selector")
+            selected_history = st.selectbox("选择对话历史", history_options, key="history_selector",
+                                            format_func=lambda name: format_history_option(selected_scenario, name))
+            history_info = state.history_mgr.get_history_info(selected_history)
+            if history_info and history_info["preview"]:
+                st.caption(f"最近: {history_info['preview']}")
 
             # 创建新对话按钮
             if selected_history == "➕新建对话":
@@ -144,6 +259,25 @@ def chat_page(state: PageState):
                     st.success(f"已创建新对话: {new_history_name}")
                     st.rerun()
 
+        with st.expander("📊 提示词缓存"):
+            cache_report = prompt_cache_stats.report()
+            if cache_report:
+                st.dataframe(cache_report, hide_index=True)
+            else:
+                st.caption("暂无统计数据")
+
+        with st.expander("⏳ 限流排队"):
+            rows = [
+                {"接口": f"{ep['model']} @ {ep['base_url']}", "排队中": ep["queued"],
+                 "暂停(秒)": round(ep["blocked_seconds"], 1), "类别": name, "次数": wait["count"],
+                 "平均等待(秒)": round(wait["avg"], 2), "最长等待(秒)": round(wait["max"], 2)}
+                for ep in rate_limiter.report() for name, wait in ep["wait"].items()
+            ]
+            if rows:
+                st.dataframe(rows, hide_index=True)
+            else:
+                st.caption("暂无统计数据")
+
     if not selected_scenario:
         st.info("请从左侧选择一个场景开始对话")
         return
@@ -157,6 +291,9 @@ def chat_page(state: PageState):
         
     # 加载场景和历史
     state.select_history(selected_history)
+    # 上次运行中被中断的回复尚未保存
+    if state.ai_bot.pending_save:
+        state.save_history()
 
     st.markdown(f"""
     ### {selected_history}
@@ -168,11 +305,7 @@ def chat_page(state: PageState):
         # 对话历史显示
         chat_container = st.container()
         with chat_container:
-            for msg in state.ai_bot.ctx_messages:
-                if msg["role"] == "system":
-                    continue
-                with st.chat_message(msg["role"]):
-                    st.write(msg["content"])
+            chat_messages(state)
 
         with st.form("chat-form", clear_on_submit=True):
             user_input = st.text_area(f"{state.current_history.user_name} 输入...", height=100, key="user_input")
@@ -188,6 +321,8 @@ def chat_page(state: PageState):
 
                 response_stream = state.aibot_chat(user_input, new_system_prompt)
 
+                # 点击任意按钮都会中断当前运行，生成中的请求随之取消
+                st.button("⏹停止生成", key="stop_generation")
                 with st.chat_message("assistant"):
                     st.write_stream(response_stream)
 
@@ -202,10 +337,23 @@ def chat_page(state: PageState):
                 else:
                     st.warning("没有可回退的消息")
 
+            current, total = state.ai_bot.candidate_info()
+            if total > 1:
+                if st.button("◀", key="prev_candidate"):
+                    state.aibot_switch_candidate(-1)
+                    st.rerun()
+                st.markdown(f"{current + 1}/{total}")
+                if st.button("▶", key="next_candidate"):
+                    state.aibot_switch_candidate(1)
+                    st.rerun()
+
             if st.button("重新生成"):
-                if state.aibot_pop_message():
+                # 还有未查看的候选回复时直接切换，不再请求模型
+                if state.aibot_switch_candidate(1, wrap=False):
+                    st.rerun()
+                elif state.aibot_pop_message():
                     with chat_container:
-                        response_stream = state.aibot_chat("", "")
+                        response_stream = state.aibot_chat("", "", use_cache=False)
 
                         with st.chat_message("assistant"):
                             st.write_stream(response_stream)
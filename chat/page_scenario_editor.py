@@ -4,7 +4,7 @@ import streamlit as st
 from streamlit_ace import st_ace
 
 from common.constant import SCENARIO_TEMPLATE
-from chat.scenario import ScenarioMgr, Scenario
+from chat.scenario import ScenarioMgr, Scenario, ScenarioConflictError
 from chat.chat_history import ChatHistoryMgr, ChatHistory
 
 
@@ -79,7 +79,9 @@ def scenario_editor_page(state: EditorState):
     with editor_panel:
         st.subheader("场景编辑")
         if selected_scenario:
-            state.select_scenario(selected_scenario)
+            # 只在切换场景时加载，保留加载时的版本，保存时才能发现其他会话的修改
+            if selected_scenario != state.current_scenario_name or state.current_scenario is None:
+                state.select_scenario(selected_scenario)
             _edit_scenario(state)
         else:
             _create_scenario(state)
@@ -124,8 +126,11 @@ def _edit_scenario(state: EditorState):
             )
             scenario_edit_submitted = st.button("保存场景", key="scenario_edit_submitted")
             if scenario_edit_submitted:
-                state.current_scenario.update(json.loads(new_scenario))
-                st.success("场景保存成功")
+                try:
+                    state.current_scenario.update(json.loads(new_scenario))
+                    st.success("场景保存成功")
+                except ScenarioConflictError:
+                    st.error("场景已被其他会话修改，请在重新加载的内容上修改后再保存")
                 state.select_scenario(state.current_scenario_name)
         else:
             original_scenario_detail = state.current_scenario.system_prompt
@@ -142,8 +147,11 @@ def _edit_scenario(state: EditorState):
             )
             scenario_content_edit_submitted = st.button("保存场景", key="scenario_content_edit_submitted_detail")
             if scenario_content_edit_submitted:
-                state.current_scenario.update_system_prompt(new_scenario_detail)
-                st.success("场景保存成功")
+                try:
+                    state.current_scenario.update_system_prompt(new_scenario_detail)
+                    st.success("场景保存成功")
+                except ScenarioConflictError:
+                    st.error("场景已被其他会话修改，请在重新加载的内容上修改后再保存")
                 state.select_scenario(state.current_scenario_name)
 
 
@@ -0,0 +1,45 @@
+import time
+
+import streamlit as st
+
+from chat.search import search_index
+from chat.scenario import ScenarioMgr
+
+
+def search_page():
+    st.set_page_config(page_title="对话搜索", layout="wide")
+    st.title("对话搜索")
+
+    with st.sidebar:
+        st.subheader("🔍 搜索范围")
+        scenario_names = ScenarioMgr().list_scenario()
+        scenario = st.selectbox("场景", scenario_names, index=None, placeholder="全部场景")
+        limit = st.slider("最多显示", 10, 100, 20)
+
+        st.subheader("🗂️ 索引")
+        if search_index.is_empty():
+            st.info("索引为空，请先重建索引")
+        if st.button("重建索引"):
+            with st.spinner("正在重建索引..."):
+                search_index.rebuild()
+                search_index.wait()
+            st.success("索引已重建")
+
+    query = st.text_input("搜索内容", placeholder="输入要查找的对话内容")
+    if not query.strip():
+        return
+
+    start = time.perf_counter()
+    hits = search_index.search(query, limit=limit, scenario=scenario)
+    elapsed = (time.perf_counter() - start) * 1000
+    st.caption(f"找到 {len(hits)} 条结果，耗时 {elapsed:.1f} ms")
+
+    for hit in hits:
+        history = hit["history"] or "场景定义"
+        with st.container(border=True):
+            st.markdown(f"**{hit['scenario']} / {history}** · 第 {hit['index'] + 1} 条消息 · "
+                        f"{hit['role']}|{hit['name']} · 位置 {hit['offset']}")
+            st.text(hit["snippet"])
+
+
+search_page()
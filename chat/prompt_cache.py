@@ -0,0 +1,113 @@
+import os
+import json
+import threading
+
+from common.config import global_config
+from common.fileio import atomic_write_json
+
+
+# 支持显式缓存标记的接口（Anthropic、OpenRouter、通义等）使用的标记
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def canonical_message(msg: dict) -> dict:
+    """以固定的字段顺序重建消息，保证相同内容序列化后的字节完全一致"""
+    result = {"role": msg["role"]}
+    if msg.get("name"):
+        result["name"] = msg["name"]
+    result["content"] = msg.get("content", "")
+    return result
+
+
+def mark_cache_breakpoint(msg: dict) -> dict:
+    """将消息内容转换为分段格式，并在末尾打上缓存标记"""
+    content = msg["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    content = [dict(part) for part in content]
+    content[-1]["cache_control"] = CACHE_CONTROL
+    return {**msg, "content": content}
+
+
+def extract_cached_tokens(usage) -> int:
+    """从不同接口的 usage 中读取命中缓存的token数"""
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        # DeepSeek
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        # Anthropic 兼容接口
+        cached = getattr(usage, "cache_read_input_tokens", None)
+    return cached or 0
+
+
+class PromptCacheStats:
+    """
+    按场景统计提示词缓存命中情况，保存在 chat 工作目录的 stats/prompt_cache.json 中
+
+    每个场景记录：请求数、命中缓存的请求数、输入token数、命中缓存的token数，
+    以及命中/未命中缓存时的首个token延迟总和，用于比较缓存带来的延迟和费用节省。
+    """
+    def __init__(self, stats_path: str = None):
+        # chat 工作目录下的 json 文件为模型配置，统计数据保存在子目录中
+        self._stats_path = stats_path or os.path.join(global_config.get_chat_workspace(), "stats", "prompt_cache.json")
+        self._lock = threading.Lock()
+        self._stats = None
+
+    def _load(self) -> dict:
+        if self._stats is None:
+            try:
+                with open(self._stats_path, 'r', encoding='utf-8') as f:
+                    self._stats = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self._stats = {}
+        return self._stats
+
+    def record(self, scenario_name: str, usage, ttft: float = None):
+        """记录一次请求的 usage 和首个token延迟（秒）"""
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        cached_tokens = extract_cached_tokens(usage)
+        with self._lock:
+            stats = self._load()
+            item = stats.setdefault(scenario_name, {
+                "requests": 0,
+                "hit_requests": 0,
+                "prompt_tokens": 0,
+                "cached_tokens": 0,
+                "hit_ttft": 0.0,
+                "miss_ttft": 0.0
+            })
+            item["requests"] += 1
+            item["prompt_tokens"] += prompt_tokens
+            item["cached_tokens"] += cached_tokens
+            if cached_tokens:
+                item["hit_requests"] += 1
+            if ttft is not None:
+                item["hit_ttft" if cached_tokens else "miss_ttft"] += ttft
+            os.makedirs(os.path.dirname(self._stats_path), exist_ok=True)
+            atomic_write_json(self._stats_path, stats)
+
+    def report(self) -> list[dict]:
+        """各场景的缓存命中率和平均首个token延迟"""
+        with self._lock:
+            stats = self._load()
+            rows = []
+            for scenario_name, item in stats.items():
+                miss_requests = item["requests"] - item["hit_requests"]
+                rows.append({
+                    "scenario": scenario_name,
+                    "requests": item["requests"],
+                    "request_hit_ratio": item["hit_requests"] / item["requests"] if item["requests"] else 0,
+                    "token_hit_ratio": item["cached_tokens"] / item["prompt_tokens"] if item["prompt_tokens"] else 0,
+                    "avg_ttft_hit": item["hit_ttft"] / item["hit_requests"] if item["hit_requests"] else None,
+                    "avg_ttft_miss": item["miss_ttft"] / miss_requests if miss_requests else None
+                })
+            return rows
+
+
+prompt_cache_stats = PromptCacheStats()
@@ -0,0 +1,83 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+from chat.context import message_text
+
+
+# 代码块内的换行保持原样
+CODE_FENCE = re.compile(r"(```.*?(?:```|$))", re.S)
+# 单个换行在 markdown 中会被合并为空格，转换为硬换行以保留原文的分行
+SOFT_BREAK = re.compile(r"(?<!\n)\n(?!\n)")
+
+
+def message_key(msg: dict) -> str:
+    """消息的内容哈希，用作渲染缓存的 key"""
+    raw = f"{msg.get('role', '')}\0{msg.get('name', '')}\0{message_text(msg)}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def to_markdown(text: str) -> str:
+    """将消息文本转换为用于显示的 markdown"""
+    parts = CODE_FENCE.split(text)
+    # split 的结果中奇数位置为代码块
+    return "".join(part if i % 2 else SOFT_BREAK.sub("  \n", part) for i, part in enumerate(parts))
+
+
+class MarkdownCache:
+    """
+    按消息哈希缓存转换后的 markdown，进程内所有会话共享
+
+    未变化的消息在每次重新运行时不再重复处理，超过 max_size 条时淘汰最久未使用的缓存
+    """
+    def __init__(self, max_size: int = 5000):
+        self._max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, msg: dict) -> str:
+        key = message_key(msg)
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        markdown = to_markdown(message_text(msg))
+        with self._lock:
+            self._items[key] = markdown
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+        return markdown
+
+
+class MessageWindow:
+    """
+    长对话的分页显示窗口，保存在 st.session_state 这类字典中
+
+    默认只显示最近 page_size 条消息，每次加载更早的消息时窗口扩大 page_size 条，
+    切换对话（key 变化）时窗口恢复默认大小
+    """
+    def __init__(self, store, name: str, page_size: int = 30):
+        self._store = store
+        self._name = name
+        self._page_size = page_size
+        if self._name not in self._store:
+            self._store[self._name] = (None, page_size)
+
+    def visible(self, key, messages: list) -> tuple[int, list]:
+        """
+        :return: (未显示的更早消息数, 需要显示的消息)
+        """
+        current_key, size = self._store[self._name]
+        if current_key != key:
+            size = self._page_size
+            self._store[self._name] = (key, size)
+        start = max(len(messages) - size, 0)
+        return start, messages[start:]
+
+    def load_more(self):
+        key, size = self._store[self._name]
+        self._store[self._name] = (key, size + self._page_size)
+
+
+markdown_cache = MarkdownCache()
@@ -0,0 +1,135 @@
+import time
+import random
+import threading
+from collections import deque
+
+from common.config import LLMConfig, global_config
+
+
+class EndpointStats:
+    """
+    单个接口的滚动统计和熔断状态
+
+    latency 为首个token延迟的指数移动平均，error_rate 为最近 window 次请求的失败比例。
+    连续失败 failure_threshold 次后熔断，cooldown 秒内不再分配请求，之后放行请求进行探测，
+    探测成功则恢复，失败则再次熔断。
+    """
+    def __init__(self, window: int = 20, failure_threshold: int = 3, cooldown: float = 30):
+        self.latency = None
+        self.results = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    @property
+    def error_rate(self) -> float:
+        if not self.results:
+            return 0.0
+        return 1 - sum(self.results) / len(self.results)
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def record_success(self, latency: float):
+        self.results.append(True)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        if latency is not None:
+            self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+
+    def record_failure(self):
+        self.results.append(False)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.open_until = time.time() + self.cooldown
+
+    def to_json(self) -> dict:
+        return {
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "requests": len(self.results),
+            "circuit_open": not self.available(time.time())
+        }
+
+
+class ProviderRouter:
+    """
+    多接口路由与故障转移
+
+    从多个 LLMConfig 中为每次请求选择接口，返回按优先顺序排列的候选接口，
+    请求在收到首个token前失败时由调用方依次重试下一个接口。
+
+    strategy:
+        fastest: 按延迟和错误率选择最快、最健康的接口，weight 越大越优先
+        ordered: 按 priority 顺序使用，前面的接口不可用时才使用后面的
+        weighted: 按 weight 随机选择
+    统计数据在进程内所有会话之间共享。
+    """
+    _stats = {}
+    _lock = threading.RLock()
+
+    def __init__(self, configs: list[LLMConfig], strategy: str = "fastest"):
+        if not configs:
+            raise ValueError("路由至少需要一个模型配置")
+        self.configs = sorted(configs, key=lambda c: c.priority)
+        self.strategy = strategy
+
+    @staticmethod
+    def _key(config: LLMConfig) -> tuple:
+        return (config.base_url, config.model)
+
+    def stats(self, config: LLMConfig) -> EndpointStats:
+        with self._lock:
+            key = self._key(config)
+            if key not in self._stats:
+                self._stats[key] = EndpointStats()
+            return self._stats[key]
+
+    def _score(self, config: LLMConfig) -> tuple:
+        stats = self.stats(config)
+        weight = max(config.weight, 0.01)
+        # 还没有成功过（没有延迟数据）的接口排在已知延迟的接口之后，之间按权重排序
+        if stats.latency is None:
+            return 1, -weight
+        return 0, stats.latency * (1 + 4 * stats.error_rate) / weight
+
+    def candidates(self) -> list[LLMConfig]:
+        """按本次请求的尝试顺序返回接口，熔断中的接口排在最后作为兜底"""
+        now = time.time()
+        available = [c for c in self.configs if self.stats(c).available(now)]
+        broken = [c for c in self.configs if not self.stats(c).available(now)]
+
+        if self.strategy == "ordered":
+            ordered = available
+        elif self.strategy == "weighted":
+            ordered = []
+            pool = list(available)
+            while pool:
+                chosen = random.choices(pool, weights=[max(c.weight, 0.01) for c in pool])[0]
+                pool.remove(chosen)
+                ordered.append(chosen)
+        else:
+            ordered = sorted(available, key=self._score)
+        return ordered + broken
+
+    def record_success(self, config: LLMConfig, latency: float):
+        with self._lock:
+            self.stats(config).record_success(latency)
+
+    def record_failure(self, config: LLMConfig):
+        with self._lock:
+            self.stats(config).record_failure()
+
+    def report(self) -> list[dict]:
+        """各接口的统计数据"""
+        return [
+            {"config": str(c.config_path), "model": c.model, **self.stats(c).to_json()}
+            for c in self.configs
+        ]
+
+
+def get_router(strategy: str = "fastest") -> ProviderRouter:
+    """使用 chat 工作目录下的全部模型配置创建路由"""
+    configs = [global_config.get_llm_config(name=name) for name in global_config.list_llm_config()]
+    return ProviderRouter(configs, strategy)
@@ -1,13 +1,46 @@
 import os
 import json
 
-from common.config import global_config
+from common.fileio import atomic_write_json
+from common.filelock import FileLock
+
+
+# 场景写入后的回调，参数为 (scene_path, scene_data)，scene_data 为 None 表示场景被删除
+scenario_update_hooks = []
+
+
+def notify_scenario_update(scene_path: str, scene_data: dict | None):
+    """通知场景已写入，回调出错不影响场景的保存"""
+    for hook in scenario_update_hooks:
+        try:
+            hook(scene_path, scene_data)
+        except Exception as e:
+            print(f"场景更新回调出错: {e}")
+
+
+class ScenarioConflictError(Exception):
+    """场景在加载后已被其他会话修改"""
+
+
+def get_scene_lock_path(scene_path: str) -> str:
+    """获取场景写入时使用的锁文件路径"""
+    return os.path.join(os.path.dirname(scene_path), "scene.lock")
+
+
+def _scene_stamp(scene_path: str) -> tuple | None:
+    try:
+        stat = os.stat(scene_path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
 
 
 class Scenario:
     """
     场景类
         加载和解析场景文件
+
+    加载时记录版本（文件的修改时间和大小），保存时发现场景已被其他会话修改则抛出 ScenarioConflictError
     """
     def __init__(self, scene_path):
         self.scene_path = scene_path
@@ -16,24 +49,43 @@ class Scenario:
         self.system_prompt = ""
         self.break_prompt = ""
         self.start_messages = []
+        self._version = None
         self._content = self.load_scenario()
 
-    def load_scenario(self):
-        """加载场景文件"""
+    @property
+    def name(self) -> str:
+        """场景名称，即场景目录名"""
+        return os.path.basename(os.path.dirname(os.path.abspath(self.scene_path)))
+
+    def _read(self) -> dict:
+        """读取场景数据并记录版本，其他存储方式的场景重写该方法"""
+        self._version = _scene_stamp(self.scene_path)
         with open(self.scene_path, 'r', encoding='utf-8') as f:
             # print("=================== load scene", self.scene_path)
-            scenario = json.load(f)
-            self.assistant_name = scenario.get("assistant_name", "AI")
-            self.user_name = scenario.get("user_name", "用户")
-            self.break_prompt = scenario.get("break_prompt", "")
-            self.system_prompt = scenario.get("system_prompt", "")
-            self.start_messages = scenario.get("start", [])
-            return scenario
+            return json.load(f)
+
+    def _write(self, scene_data: dict):
+        """检查版本并写入场景数据，其他存储方式的场景重写该方法"""
+        with FileLock(get_scene_lock_path(self.scene_path)):
+            if _scene_stamp(self.scene_path) != self._version:
+                raise ScenarioConflictError(f"场景 {self.name} 已被其他会话修改")
+            atomic_write_json(self.scene_path, scene_data)
+            self._version = _scene_stamp(self.scene_path)
+
+    def load_scenario(self):
+        """加载场景文件"""
+        scenario = self._read()
+        self.assistant_name = scenario.get("assistant_name", "AI")
+        self.user_name = scenario.get("user_name", "用户")
+        self.break_prompt = scenario.get("break_prompt", "")
+        self.system_prompt = scenario.get("system_prompt", "")
+        self.start_messages = scenario.get("start", [])
+        return scenario
 
     def update(self, scene_data):
         """更新场景文件"""
-        with open(self.scene_path, 'w', encoding='utf-8') as f:
-            json.dump(scene_data, f, ensure_ascii=False, indent=2)
+        self._write(scene_data)
+        notify_scenario_update(self.scene_path, scene_data)
 
     def update_system_prompt(self, system_prompt):
         """更新系统提示词"""
@@ -46,63 +98,69 @@ class Scenario:
 
 
 class ScenarioMgr:
+    """
+    场景管理
+
+    场景的读写由存储后端（chat.storage）完成，默认为 JSON 文件，
+    设置环境变量 PROMPT_ME_STORAGE=sqlite 时使用 SQLite
+    """
     def __init__(self):
-        self._scenario_dir = os.path.join(global_config.get_chat_workspace(), "scenario")
-        self._all_scenario_files = {}
+        # 存储后端依赖本模块，延迟导入
+        from chat.storage import get_storage
+        self._storage = get_storage()
+        self._all_scenarios = []
 
         self._load_all_scenarios()
 
     def list_scenario(self):
         """列出所有场景名称"""
-        return list(self._all_scenario_files.keys())
+        return list(self._all_scenarios)
 
     def create_scenario(self, scene_name, scene_data):
         """添加新场景"""
-        scene_dir = os.path.join(self._scenario_dir, scene_name)
-        if os.path.exists(scene_dir):
-            raise FileExistsError(f"场景 {scene_name} 已存在")
-        
-        os.makedirs(scene_dir, exist_ok=True)
-        scene_json_path = os.path.join(scene_dir, 'scene.json')
-        with open(scene_json_path, 'w', encoding='utf-8') as f:
-            json.dump(scene_data, f, ensure_ascii=False, indent=2)
-        # 创建history目录
-        history_dir = os.path.join(scene_dir, 'history')
-        os.makedirs(history_dir, exist_ok=True)
+        self._storage.create_scenario(scene_name, scene_data)
         self._load_all_scenarios()
         return scene_name
 
     def remove_scenario(self, scene_name):
         """删除场景"""
-        import shutil
-        if scene_name in self._all_scenario_files:
-            shutil.rmtree(self._all_scenario_files[scene_name])
+        if scene_name in self._all_scenarios:
+            self._storage.remove_scenario(scene_name)
             self._load_all_scenarios()
             return True
         return False
 
     def get_scenario(self, scene_name):
         """获取场景配置"""
-        if scene_name in self._all_scenario_files:
-            scene_json_path = os.path.join(self._all_scenario_files[scene_name], 'scene.json')
-            return Scenario(scene_json_path)
+        if scene_name in self._all_scenarios:
+            return self._storage.get_scenario(scene_name)
         
         raise FileNotFoundError(f"场景 {scene_name} 未找到")
 
     def get_scenario_path(self, scene_name):
-        """获取场景文件路径"""
-        return self._all_scenario_files.get(scene_name)
+        """获取场景目录路径"""
+        if scene_name in self._all_scenarios:
+            return os.path.dirname(self._storage.scene_path(scene_name))
+        return None
+
+    def get_scenario_file(self, scene_name):
+        """获取场景定义文件 scene.json 的路径"""
+        if scene_name in self._all_scenarios:
+            return self._storage.scene_path(scene_name)
+        return None
+
+    def get_scenario_info(self, scene_name):
+        """获取场景的消息数、修改时间等信息，见 WorkspaceCatalog.scenario_info"""
+        return self._storage.scenario_info(scene_name)
+
+    def get_stamp(self, scene_name) -> tuple:
+        """场景的版本戳，场景变化时改变，用于判断缓存的场景是否需要重新加载"""
+        return self._storage.scenario_stamp(scene_name)
 
     def scenario_exists(self, scene_name):
         """检查场景是否存在"""
-        return scene_name in self._all_scenario_files
+        return scene_name in self._all_scenarios
     
     def _load_all_scenarios(self):
-        """加载所有场景目录"""
-        for dirname in os.listdir(self._scenario_dir):
-            dir_path = os.path.join(self._scenario_dir, dirname)
-            if os.path.isdir(dir_path):
-                scene_json_path = os.path.join(dir_path, 'scene.json')
-                if os.path.exists(scene_json_path):
-                    self._all_scenario_files[dirname] = dir_path
-
+        """加载所有场景名称"""
+        self._all_scenarios = self._storage.list_scenarios()
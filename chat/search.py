@@ -0,0 +1,298 @@
+import os
+import re
+import math
+import queue
+import sqlite3
+import threading
+from collections import Counter
+
+from common.config import global_config
+from chat.context import message_text
+from chat.scenario import ScenarioMgr, scenario_update_hooks
+from chat.chat_history import ChatHistoryMgr, history_update_hooks
+
+
+# 中日韩字符按二元组切分，其余按字母数字单词切分
+CJK_RUN = r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+"
+TOKEN_PATTERN = re.compile(rf"{CJK_RUN}|[a-z0-9]+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS docs (
+    id INTEGER PRIMARY KEY,
+    scenario TEXT NOT NULL,
+    history TEXT NOT NULL,
+    UNIQUE (scenario, history)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    doc_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    role TEXT,
+    name TEXT,
+    content TEXT,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (doc_id, idx)
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL,
+    doc_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    pos INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_postings_term ON postings (term);
+CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings (doc_id, idx);
+"""
+
+
+def tokenize(text: str) -> list[tuple[str, int]]:
+    """
+    分词，返回 (词, 字符位置) 列表
+
+    中文等没有空格分隔的文字切分为相邻两个字的二元组（单独一个字时保留单字），
+    英文和数字按单词切分并转为小写
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        run, start = match.group(), match.start()
+        if run.isascii() or len(run) == 1:
+            tokens.append((run, start))
+        else:
+            tokens.extend((run[i:i + 2], start + i) for i in range(len(run) - 1))
+    return tokens
+
+
+def _split_history_path(history_path: str) -> tuple[str, str]:
+    """从 scenario/<场景>/history/<历史>.json 中解析场景和历史名称"""
+    history_path = os.path.abspath(history_path)
+    scenario = os.path.basename(os.path.dirname(os.path.dirname(history_path)))
+    return scenario, os.path.basename(history_path)
+
+
+class SearchIndex:
+    """
+    全部场景和对话历史的全文索引，使用 SQLite 保存倒排索引
+
+    每条消息作为一个文档，按 BM25 排序。历史记录写入时通过 history_update_hooks
+    只索引发生变化的消息，索引更新在后台线程中执行，不阻塞对话。
+    场景的系统提示词和 start 消息以历史名称为空的文档索引。
+    """
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, index_path: str = None):
+        self._index_path = index_path or os.path.join(global_config.get_chat_workspace(), "search_index.db")
+        self._tasks = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._index_path, timeout=30)
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._schema_ready = True
+        return conn
+
+    # ---------- 写入 ----------
+
+    def _submit(self, func, *args):
+        """索引更新统一交给后台线程串行执行"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run_worker, name="search-index", daemon=True)
+                self._worker.start()
+        self._tasks.put((func, args))
+
+    def _run_worker(self):
+        conn = self._connect()
+        while True:
+            func, args = self._tasks.get()
+            try:
+                with conn:
+                    func(conn, *args)
+            except Exception as e:
+                print(f"更新搜索索引出错: {e}")
+            finally:
+                self._tasks.task_done()
+
+    def wait(self):
+        """等待已提交的索引更新完成"""
+        self._tasks.join()
+
+    @staticmethod
+    def _doc_id(conn: sqlite3.Connection, scenario: str, history: str) -> int:
+        conn.execute("INSERT OR IGNORE INTO docs (scenario, history) VALUES (?, ?)", (scenario, history))
+        return conn.execute("SELECT id FROM docs WHERE scenario = ? AND history = ?",
+                            (scenario, history)).fetchone()[0]
+
+    def _index_messages(self, conn, scenario: str, history: str, start: int, messages: list):
+        doc_id = self._doc_id(conn, scenario, history)
+        conn.execute("DELETE FROM postings WHERE doc_id = ? AND idx >= ?", (doc_id, start))
+        conn.execute("DELETE FROM messages WHERE doc_id = ? AND idx >= ?", (doc_id, start))
+        message_rows, posting_rows = [], []
+        for idx, msg in enumerate(messages, start):
+            text = message_text(msg)
+            tokens = tokenize(text)
+            message_rows.append((doc_id, idx, msg.get("role", ""), msg.get("name", ""), text, len(tokens)))
+            first_pos = {}
+            for term, pos in tokens:
+                first_pos.setdefault(term, pos)
+            for term, tf in Counter(term for term, _ in tokens).items():
+                posting_rows.append((term, doc_id, idx, tf, first_pos[term]))
+        conn.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)", message_rows)
+        conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?, ?)", posting_rows)
+
+    def _remove_docs(self, conn, scenario: str, history: str = None):
+        if history is None:
+            doc_ids = conn.execute("SELECT id FROM docs WHERE scenario = ?", (scenario,)).fetchall()
+        else:
+            doc_ids = conn.execute("SELECT id FROM docs WHERE scenario = ? AND history = ?",
+                                   (scenario, history)).fetchall()
+        for (doc_id,) in doc_ids:
+            conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM messages WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM docs WHERE id = ?", (doc_id,))
+
+    def on_history_update(self, history_path: str, start: int, messages: list | None):
+        """history_update_hooks 回调：增量索引变化的消息"""
+        scenario, history = _split_history_path(history_path)
+        if messages is None:
+            self._submit(self._remove_docs, scenario, history)
+        else:
+            self._submit(self._index_messages, scenario, history, start, list(messages))
+
+    @staticmethod
+    def _scenario_messages(scene_data: dict) -> list:
+        messages = []
+        if scene_data.get("system_prompt"):
+            messages.append({"role": "system", "content": scene_data["system_prompt"]})
+        messages.extend(scene_data.get("start", []))
+        return messages
+
+    def on_scenario_update(self, scene_path: str, scene_data: dict | None):
+        """scenario_update_hooks 回调：重新索引场景，场景删除时同时删除其全部历史记录的索引"""
+        scenario = os.path.basename(os.path.dirname(os.path.abspath(scene_path)))
+        if scene_data is None:
+            self._submit(self._remove_docs, scenario)
+        else:
+            self._submit(self._index_messages, scenario, "", 0, self._scenario_messages(scene_data))
+
+    def rebuild(self):
+        """重建全部场景和对话历史的索引"""
+        def _rebuild(conn):
+            conn.execute("DELETE FROM postings")
+            conn.execute("DELETE FROM messages")
+            conn.execute("DELETE FROM docs")
+            scenario_mgr = ScenarioMgr()
+            for scenario_name in scenario_mgr.list_scenario():
+                scenario = scenario_mgr.get_scenario(scenario_name)
+                self._index_messages(conn, scenario_name, "", 0, self._scenario_messages(scenario.to_json()))
+                history_mgr = ChatHistoryMgr(scenario_name)
+                for history_name in history_mgr.list_histories():
+                    history = history_mgr.get_history(history_name)
+                    self._index_messages(conn, scenario_name, history_name, 0, history.messages)
+        self._submit(_rebuild)
+
+    # ---------- 查询 ----------
+
+    @staticmethod
+    def _term_range(term: str) -> tuple[str, str]:
+        """词在 postings.term 上的查询范围 [lo, hi)，可以使用 term 索引"""
+        # 单个汉字查询时匹配以该字开头的二元组
+        if len(term) == 1 and not term.isascii():
+            return term, term + "\uffff"
+        return term, term + "\x00"
+
+    def search(self, query: str, limit: int = 20, scenario: str = None) -> list[dict]:
+        """
+        搜索消息，按 BM25 排序
+
+        打分和排序在 SQLite 中完成，只读取排名靠前的消息内容。
+
+        :param query: 查询语句，所有词都出现的消息才会命中
+        :param limit: 返回的最大条数
+        :param scenario: 只在指定场景中搜索
+        :return: 命中列表，包含场景、历史名称、消息序号 index、首个命中词在消息中的字符位置 offset、摘要等
+        """
+        terms = list(dict.fromkeys(term for term, _ in tokenize(query)))
+        if not terms or not os.path.exists(self._index_path):
+            return []
+
+        conn = self._connect()
+        try:
+            total, avg_length = conn.execute("SELECT COUNT(*), AVG(length) FROM messages").fetchone()
+            if not total:
+                return []
+            avg_length = avg_length or 1
+
+            query_terms = []
+            for term_no, term in enumerate(terms):
+                lo, hi = self._term_range(term)
+                df = conn.execute(
+                    "SELECT COUNT(*) FROM (SELECT 1 FROM postings WHERE term >= ? AND term < ? GROUP BY doc_id, idx)",
+                    (lo, hi)
+                ).fetchone()[0]
+                if not df:
+                    return []
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                query_terms.append((term_no, lo, hi, idf))
+
+            # 每个 (消息, 查询词) 汇总词频（单字查询可能匹配多个二元组），再按消息累加 BM25 得分
+            # 场景过滤在打分前进行；+p.doc_id 使查询按 term 索引读取倒排表，而不是扫描整个场景的倒排表
+            scenario_filter = "WHERE +p.doc_id IN (SELECT id FROM docs WHERE scenario = ?)" if scenario else ""
+            sql = f"""
+                WITH q(term_no, lo, hi, idf) AS (VALUES {", ".join(["(?, ?, ?, ?)"] * len(query_terms))}),
+                hits AS (
+                    SELECT p.doc_id, p.idx, q.term_no, q.idf, SUM(p.tf) AS tf, MIN(p.pos) AS pos
+                    FROM q JOIN postings p ON p.term >= q.lo AND p.term < q.hi
+                    {scenario_filter}
+                    GROUP BY p.doc_id, p.idx, q.term_no
+                )
+                SELECT h.doc_id, h.idx, MIN(h.pos),
+                       SUM(h.idf * h.tf * ? / (h.tf + ? * (? + ? * m.length / ?))) AS score
+                FROM hits h JOIN messages m ON m.doc_id = h.doc_id AND m.idx = h.idx
+                GROUP BY h.doc_id, h.idx
+                HAVING COUNT(*) = ?
+                ORDER BY score DESC
+                LIMIT ?
+            """
+            params = [value for query_term in query_terms for value in query_term]
+            if scenario:
+                params.append(scenario)
+            params += [self.K1 + 1, self.K1, 1 - self.B, self.B, float(avg_length), len(query_terms), limit]
+
+            results = []
+            for doc_id, idx, offset, score in conn.execute(sql, params).fetchall():
+                row = conn.execute(
+                    "SELECT d.scenario, d.history, m.role, m.name, m.content "
+                    "FROM messages m JOIN docs d ON d.id = m.doc_id WHERE m.doc_id = ? AND m.idx = ?",
+                    (doc_id, idx)
+                ).fetchone()
+                results.append({
+                    "scenario": row[0],
+                    "history": row[1],
+                    "index": idx,
+                    "offset": offset,
+                    "role": row[2],
+                    "name": row[3],
+                    "snippet": row[4][max(offset - 30, 0):offset + 70],
+                    "score": score
+                })
+            return results
+        finally:
+            conn.close()
+
+    def is_empty(self) -> bool:
+        if not os.path.exists(self._index_path):
+            return True
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0] == 0
+        finally:
+            conn.close()
+
+
+search_index = SearchIndex()
+history_update_hooks.append(search_index.on_history_update)
+scenario_update_hooks.append(search_index.on_scenario_update)
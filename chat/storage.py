@@ -0,0 +1,534 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import threading
+from contextlib import contextmanager
+
+from common.config import global_config
+from common.fileio import atomic_write_json
+from common.filelock import FileLock
+from common.session_cache import file_stamp
+from chat.scenario import Scenario, ScenarioConflictError, get_scene_lock_path, notify_scenario_update
+from chat.chat_history import ChatHistory, get_history_dir, get_journal_path, get_lock_path, notify_history_update
+from chat.context import message_text
+# 目录和搜索索引在导入时注册写入回调，所有经存储后端的写入（页面、批量任务、导入导出）都会增量更新
+from chat.catalog import workspace_catalog, PREVIEW_LENGTH
+from chat.search import search_index
+
+
+# 选择存储后端的环境变量，可选 json（默认）、sqlite
+STORAGE_ENV = "PROMPT_ME_STORAGE"
+
+
+class Storage:
+    """
+    场景和对话历史的存储后端接口
+
+    场景和对话历史在各种存储方式中都以 scenario/<场景>/scene.json、scenario/<场景>/history/<历史>.json
+    形式的路径标识，写入回调（scenario_update_hooks、history_update_hooks）收到的也是这些路径。
+    """
+    name = ""
+
+    def __init__(self):
+        self._scenario_dir = os.path.join(global_config.get_chat_workspace(), "scenario")
+
+    def scene_path(self, scenario_name: str) -> str:
+        return os.path.join(self._scenario_dir, scenario_name, "scene.json")
+
+    def history_path(self, scenario_name: str, history_name: str) -> str:
+        return os.path.join(get_history_dir(scenario_name), history_name)
+
+    # ---------- 场景 ----------
+
+    def list_scenarios(self) -> list[str]:
+        raise NotImplementedError()
+
+    def get_scenario(self, scenario_name: str) -> Scenario:
+        raise NotImplementedError()
+
+    def save_scenario(self, scenario_name: str, scene_data: dict):
+        """创建或覆盖场景"""
+        raise NotImplementedError()
+
+    def create_scenario(self, scenario_name: str, scene_data: dict):
+        if scenario_name in self.list_scenarios():
+            raise FileExistsError(f"场景 {scenario_name} 已存在")
+        self.save_scenario(scenario_name, scene_data)
+
+    def remove_scenario(self, scenario_name: str):
+        """删除场景及其全部对话历史"""
+        raise NotImplementedError()
+
+    def scenario_info(self, scenario_name: str) -> dict | None:
+        raise NotImplementedError()
+
+    def scenario_stamp(self, scenario_name: str) -> tuple:
+        """场景的版本戳，只在该场景变化时改变"""
+        raise NotImplementedError()
+
+    # ---------- 对话历史 ----------
+
+    def list_histories(self, scenario_name: str) -> list[str]:
+        raise NotImplementedError()
+
+    def get_history(self, scenario_name: str, history_name: str) -> ChatHistory:
+        raise NotImplementedError()
+
+    def save_history(self, scenario_name: str, history_name: str, history_data: dict):
+        """创建或覆盖对话历史"""
+        raise NotImplementedError()
+
+    def remove_history(self, scenario_name: str, history_name: str):
+        raise NotImplementedError()
+
+    def history_info(self, scenario_name: str, history_name: str) -> dict | None:
+        raise NotImplementedError()
+
+    def history_stamp(self, scenario_name: str, history_name: str = None) -> tuple:
+        """对话历史的版本戳，只在该对话历史变化时改变；history_name 为 None 时为历史列表的版本戳"""
+        raise NotImplementedError()
+
+
+class JsonStorage(Storage):
+    """
+    JSON 文件存储
+
+    每个场景一个目录，场景定义保存在 scene.json 中，
+    对话历史保存为 history 目录下的 快照 + 追加日志（见 ChatHistory），列表和信息由 workspace_catalog 提供
+    """
+    name = "json"
+
+    def list_scenarios(self) -> list[str]:
+        return workspace_catalog.list_scenarios()
+
+    def get_scenario(self, scenario_name: str) -> Scenario:
+        return Scenario(self.scene_path(scenario_name))
+
+    def save_scenario(self, scenario_name: str, scene_data: dict):
+        scene_path = self.scene_path(scenario_name)
+        # 创建history目录
+        os.makedirs(get_history_dir(scenario_name), exist_ok=True)
+        with FileLock(get_scene_lock_path(scene_path)):
+            atomic_write_json(scene_path, scene_data)
+        notify_scenario_update(scene_path, scene_data)
+
+    def create_scenario(self, scenario_name: str, scene_data: dict):
+        if os.path.exists(os.path.dirname(self.scene_path(scenario_name))):
+            raise FileExistsError(f"场景 {scenario_name} 已存在")
+        self.save_scenario(scenario_name, scene_data)
+
+    def remove_scenario(self, scenario_name: str):
+        scene_path = self.scene_path(scenario_name)
+        shutil.rmtree(os.path.dirname(scene_path))
+        notify_scenario_update(scene_path, None)
+
+    def scenario_info(self, scenario_name: str) -> dict | None:
+        return workspace_catalog.scenario_info(scenario_name)
+
+    def scenario_stamp(self, scenario_name: str) -> tuple:
+        return file_stamp(self.scene_path(scenario_name))
+
+    def list_histories(self, scenario_name: str) -> list[str]:
+        return workspace_catalog.list_histories(scenario_name)
+
+    def get_history(self, scenario_name: str, history_name: str) -> ChatHistory:
+        return ChatHistory(self.history_path(scenario_name, history_name))
+
+    def save_history(self, scenario_name: str, history_name: str, history_data: dict):
+        history_path = self.history_path(scenario_name, history_name)
+        journal_path = get_journal_path(history_path)
+        with FileLock(get_lock_path(history_path)):
+            # 覆盖时版本号继续递增，使其他会话发现修改
+            seq = 0
+            if os.path.exists(history_path):
+                seq = ChatHistory(history_path).version + 1
+            atomic_write_json(history_path, {**history_data, "journal_seq": seq})
+            # 同名的旧日志不属于新的历史记录
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+        notify_history_update(history_path, 0, list(history_data["messages"]))
+
+    def remove_history(self, scenario_name: str, history_name: str):
+        history_path = self.history_path(scenario_name, history_name)
+        with FileLock(get_lock_path(history_path)):
+            os.remove(history_path)
+            journal_path = get_journal_path(history_path)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+        notify_history_update(history_path, 0, None)
+
+    def history_info(self, scenario_name: str, history_name: str) -> dict | None:
+        return workspace_catalog.history_info(scenario_name, history_name)
+
+    def history_stamp(self, scenario_name: str, history_name: str = None) -> tuple:
+        if history_name is None:
+            # 新建、删除历史文件会改变目录的修改时间
+            return file_stamp(get_history_dir(scenario_name))
+        history_path = self.history_path(scenario_name, history_name)
+        return file_stamp(history_path, get_journal_path(history_path))
+
+
+class SqliteScenario(Scenario):
+    """保存在 SQLite 中的场景"""
+    def __init__(self, storage: "SqliteStorage", scene_path: str):
+        self._storage = storage
+        super().__init__(scene_path)
+
+    def _read(self) -> dict:
+        scene_data, self._version = self._storage.load_scenario_data(self.name)
+        return scene_data
+
+    def _write(self, scene_data: dict):
+        self._version = self._storage.write_scenario_data(self.name, scene_data, self._version)
+
+
+class SqliteChatHistory(ChatHistory):
+    """
+    保存在 SQLite 中的对话历史
+
+    每条消息一行，追加、回退、编辑只在一个事务中写入变化的消息，没有追加日志，也不需要压缩
+    """
+    def __init__(self, storage: "SqliteStorage", history_path: str):
+        self._storage = storage
+        self._scenario_name = os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(history_path))))
+        self._history_name = os.path.basename(history_path)
+        super().__init__(history_path)
+
+    def load_history(self):
+        self._meta, messages, self._seq = self._storage.load_history_data(self._scenario_name, self._history_name)
+        self._set_state(messages)
+        return self._content
+
+    def _write_lock(self):
+        # 检查版本和写入在同一个事务中完成
+        return self._storage.transaction()
+
+    def _changed_on_disk(self) -> bool:
+        return self._storage.history_version(self._scenario_name, self._history_name) != self._seq
+
+    def _write_changes(self, common: int, record: dict, messages: list):
+        self._seq = self._storage.write_history_changes(self._scenario_name, self._history_name, common, record)
+        self._advance_state(common, messages)
+
+    def compact(self):
+        """没有追加日志，无需压缩"""
+
+
+class SqliteStorage(Storage):
+    """
+    SQLite 存储，保存在 chat 工作目录的 storage.db 中
+
+    使用 WAL 模式，读写互不阻塞；对话历史每条消息一行，
+    每次写入在一个 BEGIN IMMEDIATE 事务中完成，多个会话同时写入时依次执行。
+    场景和对话历史各有版本号，每次写入加1，用于发现其他会话的修改。
+    版本戳使用各行的版本号和修改时间，写入一个场景或对话历史不会使其他缓存的场景和对话历史失效。
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS scenarios (
+        name TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS histories (
+        id INTEGER PRIMARY KEY,
+        scenario TEXT NOT NULL,
+        name TEXT NOT NULL,
+        meta TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated REAL NOT NULL,
+        UNIQUE (scenario, name)
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        history_id INTEGER NOT NULL,
+        idx INTEGER NOT NULL,
+        data TEXT NOT NULL,
+        PRIMARY KEY (history_id, idx)
+    ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_path: str = None):
+        super().__init__()
+        self._db_path = db_path or os.path.join(global_config.get_chat_workspace(), "storage.db")
+        # sqlite3 连接不能跨线程使用，每个线程一个连接
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self._db_path), exist_ok=True)
+            # 自动提交模式，事务由 transaction 显式开始
+            conn = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """写事务，开始时即获取写锁，避免多个会话同时写入时死锁；嵌套调用时使用外层事务"""
+        conn = self._connect()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _dumps(data) -> str:
+        return json.dumps(data, ensure_ascii=False)
+
+    # ---------- 场景 ----------
+
+    def list_scenarios(self) -> list[str]:
+        rows = self._connect().execute("SELECT name FROM scenarios ORDER BY name").fetchall()
+        return [name for (name,) in rows]
+
+    def load_scenario_data(self, scenario_name: str) -> tuple[dict, int]:
+        """返回 (场景数据, 版本号)"""
+        row = self._connect().execute("SELECT data, version FROM scenarios WHERE name = ?",
+                                      (scenario_name,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"场景 {scenario_name} 未找到")
+        return json.loads(row[0]), row[1]
+
+    def write_scenario_data(self, scenario_name: str, scene_data: dict, version: int = None) -> int:
+        """
+        写入场景数据
+
+        :param version: 加载时的版本号，与当前版本不同时抛出 ScenarioConflictError，为 None 时不检查
+        :return: 写入后的版本号
+        """
+        with self.transaction() as conn:
+            row = conn.execute("SELECT version FROM scenarios WHERE name = ?", (scenario_name,)).fetchone()
+            current = row[0] if row else 0
+            if version is not None and version != current:
+                raise ScenarioConflictError(f"场景 {scenario_name} 已被其他会话修改")
+            conn.execute("INSERT OR REPLACE INTO scenarios (name, data, version, updated) VALUES (?, ?, ?, ?)",
+                         (scenario_name, self._dumps(scene_data), current + 1, time.time()))
+            return current + 1
+
+    def get_scenario(self, scenario_name: str) -> Scenario:
+        return SqliteScenario(self, self.scene_path(scenario_name))
+
+    def save_scenario(self, scenario_name: str, scene_data: dict):
+        self.write_scenario_data(scenario_name, scene_data)
+        notify_scenario_update(self.scene_path(scenario_name), scene_data)
+
+    def remove_scenario(self, scenario_name: str):
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE history_id IN (SELECT id FROM histories WHERE scenario = ?)",
+                         (scenario_name,))
+            conn.execute("DELETE FROM histories WHERE scenario = ?", (scenario_name,))
+            conn.execute("DELETE FROM scenarios WHERE name = ?", (scenario_name,))
+        notify_scenario_update(self.scene_path(scenario_name), None)
+
+    def scenario_info(self, scenario_name: str) -> dict | None:
+        conn = self._connect()
+        row = conn.execute("SELECT data, updated FROM scenarios WHERE name = ?", (scenario_name,)).fetchone()
+        if row is None:
+            return None
+        scene_data = json.loads(row[0])
+        history_count = conn.execute("SELECT COUNT(*) FROM histories WHERE scenario = ?",
+                                     (scenario_name,)).fetchone()[0]
+        return {
+            "name": scenario_name,
+            "history_count": history_count,
+            "mtime": [int(row[1] * 1e9)],
+            "size": len(row[0].encode("utf-8")),
+            "participants": [scene_data.get("assistant_name", "AI"), scene_data.get("user_name", "用户")],
+            "message_count": len(scene_data.get("start", [])),
+            "preview": " ".join(scene_data.get("system_prompt", "").split())[:PREVIEW_LENGTH]
+        }
+
+    def scenario_stamp(self, scenario_name: str) -> tuple:
+        # 删除后重新创建的场景版本号可能相同，同时比较修改时间
+        row = self._connect().execute("SELECT version, updated FROM scenarios WHERE name = ?",
+                                      (scenario_name,)).fetchone()
+        return tuple(row) if row else (None, None)
+
+    # ---------- 对话历史 ----------
+
+    def list_histories(self, scenario_name: str) -> list[str]:
+        rows = self._connect().execute("SELECT name FROM histories WHERE scenario = ? ORDER BY name",
+                                       (scenario_name,)).fetchall()
+        return [name for (name,) in rows]
+
+    def load_history_data(self, scenario_name: str, history_name: str) -> tuple[dict, list, int]:
+        """返回 (元数据, 消息列表, 版本号)"""
+        conn = self._connect()
+        row = conn.execute("SELECT id, meta, version FROM histories WHERE scenario = ? AND name = ?",
+                           (scenario_name, history_name)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"聊天历史 {scenario_name}/{history_name} 不存在")
+        rows = conn.execute("SELECT data FROM messages WHERE history_id = ? ORDER BY idx", (row[0],)).fetchall()
+        return json.loads(row[1]), [json.loads(data) for (data,) in rows], row[2]
+
+    def history_version(self, scenario_name: str, history_name: str) -> int | None:
+        row = self._connect().execute("SELECT version FROM histories WHERE scenario = ? AND name = ?",
+                                      (scenario_name, history_name)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _history_id(conn, scenario_name: str, history_name: str) -> int:
+        row = conn.execute("SELECT id FROM histories WHERE scenario = ? AND name = ?",
+                           (scenario_name, history_name)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"聊天历史 {scenario_name}/{history_name} 不存在")
+        return row[0]
+
+    def write_history_changes(self, scenario_name: str, history_name: str, common: int, record: dict):
+        """
+        在一个事务中写入对话历史的变化
+
+        :param common: 未变化的消息数，追加的消息从该序号开始
+        :param record: 同 ChatHistory 的日志记录，包含 meta、truncate（保留的消息数）、append（追加的消息）中的若干项
+        :return: 写入后的版本号
+        """
+        with self.transaction() as conn:
+            history_id = self._history_id(conn, scenario_name, history_name)
+            if "meta" in record:
+                conn.execute("UPDATE histories SET meta = ? WHERE id = ?", (self._dumps(record["meta"]), history_id))
+            if "truncate" in record:
+                conn.execute("DELETE FROM messages WHERE history_id = ? AND idx >= ?",
+                             (history_id, record["truncate"]))
+            if record.get("append"):
+                conn.executemany("INSERT INTO messages (history_id, idx, data) VALUES (?, ?, ?)",
+                                 [(history_id, idx, self._dumps(msg))
+                                  for idx, msg in enumerate(record["append"], common)])
+            conn.execute("UPDATE histories SET version = version + 1, updated = ? WHERE id = ?",
+                         (time.time(), history_id))
+            return conn.execute("SELECT version FROM histories WHERE id = ?", (history_id,)).fetchone()[0]
+
+    def get_history(self, scenario_name: str, history_name: str) -> ChatHistory:
+        return SqliteChatHistory(self, self.history_path(scenario_name, history_name))
+
+    def save_history(self, scenario_name: str, history_name: str, history_data: dict):
+        messages = history_data["messages"]
+        meta = {k: v for k, v in history_data.items() if k not in ("messages", "journal_seq")}
+        with self.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO histories (scenario, name, meta, updated) VALUES (?, ?, '{}', 0)",
+                         (scenario_name, history_name))
+            history_id = self._history_id(conn, scenario_name, history_name)
+            conn.execute("UPDATE histories SET meta = ?, version = version + 1, updated = ? WHERE id = ?",
+                         (self._dumps(meta), time.time(), history_id))
+            conn.execute("DELETE FROM messages WHERE history_id = ?", (history_id,))
+            conn.executemany("INSERT INTO messages (history_id, idx, data) VALUES (?, ?, ?)",
+                             [(history_id, idx, self._dumps(msg)) for idx, msg in enumerate(messages)])
+        notify_history_update(self.history_path(scenario_name, history_name), 0, list(messages))
+
+    def remove_history(self, scenario_name: str, history_name: str):
+        with self.transaction() as conn:
+            history_id = self._history_id(conn, scenario_name, history_name)
+            conn.execute("DELETE FROM messages WHERE history_id = ?", (history_id,))
+            conn.execute("DELETE FROM histories WHERE id = ?", (history_id,))
+        notify_history_update(self.history_path(scenario_name, history_name), 0, None)
+
+    def history_info(self, scenario_name: str, history_name: str) -> dict | None:
+        conn = self._connect()
+        row = conn.execute("SELECT id, meta, updated FROM histories WHERE scenario = ? AND name = ?",
+                           (scenario_name, history_name)).fetchone()
+        if row is None:
+            return None
+        history_id, meta, updated = row
+        count, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM messages "
+                                   "WHERE history_id = ?", (history_id,)).fetchone()
+        preview = ""
+        # 从最后一条消息向前找第一条非系统消息
+        for (data,) in conn.execute("SELECT data FROM messages WHERE history_id = ? ORDER BY idx DESC",
+                                    (history_id,)):
+            msg = json.loads(data)
+            if msg.get("role") != "system":
+                preview = " ".join(message_text(msg).split())[:PREVIEW_LENGTH]
+                break
+        meta = json.loads(meta)
+        return {
+            "name": history_name,
+            "mtime": [int(updated * 1e9)],
+            "size": size,
+            "participants": [meta.get("assistant_name", ""), meta.get("user_name", "")],
+            "message_count": count,
+            "preview": preview
+        }
+
+    def history_stamp(self, scenario_name: str, history_name: str = None) -> tuple:
+        conn = self._connect()
+        if history_name is None:
+            # 历史列表只在新建、删除历史时变化
+            row = conn.execute("SELECT COUNT(*), GROUP_CONCAT(name, char(10)) FROM "
+                               "(SELECT name FROM histories WHERE scenario = ? ORDER BY name)",
+                               (scenario_name,)).fetchone()
+            return tuple(row)
+        row = conn.execute("SELECT version, updated FROM histories WHERE scenario = ? AND name = ?",
+                           (scenario_name, history_name)).fetchone()
+        return tuple(row) if row else (None, None)
+
+
+STORAGES = {
+    JsonStorage.name: JsonStorage,
+    SqliteStorage.name: SqliteStorage,
+}
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """获取环境变量 PROMPT_ME_STORAGE 指定的存储后端，进程内共享"""
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            name = os.getenv(STORAGE_ENV, JsonStorage.name).lower()
+            if name not in STORAGES:
+                raise ValueError(f"不支持的存储方式: {name}，可选 {', '.join(STORAGES)}")
+            _storage = STORAGES[name]()
+        return _storage
+
+
+def copy_storage(source: Storage, target: Storage) -> tuple[int, int]:
+    """
+    将全部场景和对话历史从 source 复制到 target，已存在的同名场景和对话历史被覆盖
+
+    :return: (场景数, 对话历史数)
+    """
+    scenario_count, history_count = 0, 0
+    for scenario_name in source.list_scenarios():
+        target.save_scenario(scenario_name, source.get_scenario(scenario_name).to_json())
+        scenario_count += 1
+        for history_name in source.list_histories(scenario_name):
+            history = source.get_history(scenario_name, history_name)
+            target.save_history(scenario_name, history_name, history.to_json())
+            history_count += 1
+    return scenario_count, history_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在 JSON 文件和 SQLite 存储之间导入、导出场景和对话历史")
+    parser.add_argument("action", choices=["import", "export"],
+                        help="import: 从 JSON 文件导入 SQLite；export: 从 SQLite 导出为 JSON 文件")
+    parser.add_argument("--db", default=None, help="SQLite 数据库路径，默认为 chat 工作目录下的 storage.db")
+    args = parser.parse_args()
+
+    json_storage, sqlite_storage = JsonStorage(), SqliteStorage(args.db)
+    if args.action == "import":
+        source, target = json_storage, sqlite_storage
+    else:
+        source, target = sqlite_storage, json_storage
+    scenario_count, history_count = copy_storage(source, target)
+    search_index.wait()
+    print(f"已{'导入' if args.action == 'import' else '导出'} {scenario_count} 个场景、{history_count} 个对话历史")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import hashlib
+import threading
+
+from common.config import LLMConfig
+from common.utils import get_openai_client
+from common.ratelimit import rate_limiter, PRIORITY_BATCH
+from chat.context import message_text, estimate_tokens
+
+
+SUMMARY_PROMPT = """你是对话记录整理助手。下面给出一段角色扮演对话已有的摘要，以及紧随其后的新对话内容。
+请将新对话内容合并进摘要，输出一份新的完整摘要：
+- 保留人物关系、关键事件、重要细节和尚未结束的情节
+- 按时间顺序叙述，使用第三人称
+- 只输出摘要正文，不要输出其他内容
+
+### 已有摘要
+
+{summary}
+
+### 新对话内容
+
+{dialogue}
+"""
+
+
+def _fingerprint(msg: dict) -> str:
+    return hashlib.sha1(message_text(msg).encode("utf-8")).hexdigest()
+
+
+class RollingSummarizer:
+    """
+    对话滚动摘要
+
+    当未摘要的对话消息超过阈值时，在后台线程中将最早的一段消息合并进摘要，
+    每次只处理一段新消息，不会从头重新摘要。
+    摘要记录 covered 表示 ctx_messages 中 [0, covered) 的对话消息已被摘要覆盖。
+    """
+    def __init__(self, config: LLMConfig):
+        self._config = config
+        self.threshold = config.summary_threshold
+        self.chunk_size = config.summary_chunk
+
+        self.content = ""
+        self.covered = 0
+        self._covered_fingerprint = ""
+        # 加载、重置摘要时加1，后台摘要完成时代数已变化则丢弃结果
+        self._generation = 0
+
+        self._lock = threading.Lock()
+        self._worker = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def load(self, data: dict):
+        """从历史记录中加载摘要"""
+        with self._lock:
+            data = data or {}
+            self._generation += 1
+            self.content = data.get("content", "")
+            self.covered = data.get("covered", 0)
+            self._covered_fingerprint = data.get("fingerprint", "")
+
+    def reset(self):
+        """清空摘要"""
+        self.load({})
+
+    def to_json(self) -> dict:
+        with self._lock:
+            if not self.content:
+                return {}
+            return {
+                "content": self.content,
+                "covered": self.covered,
+                "fingerprint": self._covered_fingerprint
+            }
+
+    def _is_valid(self, messages: list) -> bool:
+        """摘要覆盖的消息被回退或编辑后，摘要失效"""
+        if not self.content:
+            return False
+        if self.covered > len(messages):
+            return False
+        return _fingerprint(messages[self.covered - 1]) == self._covered_fingerprint
+
+    def apply(self, messages: list, body_start: int) -> tuple[list, int]:
+        """
+        用摘要替换已覆盖的对话消息
+
+        :param messages: 完整的上下文消息
+        :param body_start: 对话消息（系统提示词和 start 消息之后）的起始位置
+        :return: 替换后的消息，以及需要固定保留的 start 消息数量（含摘要消息）
+        """
+        with self._lock:
+            if not self._is_valid(messages) or self.covered <= body_start:
+                return messages, body_start
+            summary_msg = {
+                "role": "system",
+                "content": f"以下是之前对话的摘要：\n{self.content}",
+                "name": "system"
+            }
+            return messages[:body_start] + [summary_msg] + messages[self.covered:], body_start + 1
+
+    def maybe_update(self, messages: list, body_start: int):
+        """未摘要的消息超过阈值时，在后台摘要下一段消息"""
+        if not self.enabled:
+            return
+        if self._worker is not None and self._worker.is_alive():
+            return
+
+        with self._lock:
+            if not self._is_valid(messages):
+                self._generation += 1
+                self.content = ""
+                self.covered = 0
+                self._covered_fingerprint = ""
+            start = max(self.covered, body_start)
+            if len(messages) - start <= self.threshold:
+                return
+            chunk = messages[start:start + self.chunk_size]
+            summary = self.content
+            generation = self._generation
+
+        self._worker = threading.Thread(
+            target=self._summarize,
+            args=(summary, chunk, start + len(chunk), generation),
+            daemon=True
+        )
+        self._worker.start()
+
+    def _summarize(self, summary: str, chunk: list, covered: int, generation: int):
+        dialogue = "\n".join(message_text(m) for m in chunk if m.get("role") != "system")
+        prompt = SUMMARY_PROMPT.format(summary=summary or "（无）", dialogue=dialogue)
+        try:
+            # 后台摘要不抢占对话的限额
+            permit = rate_limiter.acquire(self._config, estimate_tokens(prompt), PRIORITY_BATCH)
+            response = get_openai_client(self._config).chat.completions.create(
+                model=self._config.model,
+                messages=[{"role": "user", "content": prompt}]
+            )
+            new_summary = (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            rate_limiter.report_error(self._config, e)
+            print(f"生成对话摘要出错: {e}")
+            return
+        rate_limiter.report_success(self._config)
+        if response.usage is not None:
+            permit.settle(response.usage.total_tokens)
+
+        if not new_summary:
+            return
+        with self._lock:
+            # 摘要期间可能已加载其他对话历史、上下文被重置或改写，只在代数和基础摘要都未变化时更新
+            if self._generation != generation or self.content != summary:
+                return
+            self.content = new_summary
+            self.covered = covered
+            self._covered_fingerprint = _fingerprint(chunk[-1])
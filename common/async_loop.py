@@ -0,0 +1,31 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+
+
+class BackgroundLoop:
+    """
+    进程级的后台事件循环线程
+
+    Streamlit 脚本线程是同步的，异步任务统一提交到该事件循环中执行，
+    异步 HTTP 客户端也都绑定在这个事件循环上。
+    """
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="async-loop", daemon=True)
+                thread.start()
+            return self._loop
+
+    def submit(self, coro) -> Future:
+        """在后台事件循环中执行协程，返回线程安全的 Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+background_loop = BackgroundLoop()
@@ -0,0 +1,274 @@
+import time
+import threading
+import importlib.util
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+from common.config import LLMConfig
+from common.async_loop import background_loop
+
+
+# 安装了 h2 时才能启用 HTTP/2
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class PooledClient:
+    """连接池中的一个 httpx 客户端（同步或异步），以及其复用统计"""
+    def __init__(self):
+        self.http_client = None
+        self.openai_client = None
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.hits = 0
+        self.requests = 0
+        self.connections = 0
+        # 进行中的请求数，流式响应在关闭后才结束
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+            self.last_used = time.time()
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+            self.last_used = time.time()
+
+    def on_request(self, request: httpx.Request):
+        self.last_used = time.time()
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    def on_response(self, response: httpx.Response):
+        self.last_used = time.time()
+
+    def _trace(self, event_name: str, info: dict):
+        # 新建 TCP 连接时计数，请求数与连接数之差即为连接复用次数
+        if event_name.endswith("connect_tcp.complete"):
+            self.connections += 1
+
+    async def on_request_async(self, request: httpx.Request):
+        self.last_used = time.time()
+        self.requests += 1
+        request.extensions["trace"] = self._trace_async
+
+    async def on_response_async(self, response: httpx.Response):
+        self.last_used = time.time()
+
+    async def _trace_async(self, event_name: str, info: dict):
+        self._trace(event_name, info)
+
+    def close(self):
+        if isinstance(self.http_client, httpx.AsyncClient):
+            # 异步客户端绑定后台事件循环，在该事件循环中关闭
+            background_loop.submit(self.http_client.aclose())
+        else:
+            self.http_client.close()
+
+    def stats(self) -> dict:
+        return {
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "hits": self.hits,
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": max(self.requests - self.connections, 0),
+            "in_flight": self.in_flight
+        }
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """流式响应的内容，关闭时结束请求计数"""
+    def __init__(self, stream: httpx.SyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if self._on_close is not None:
+                self._on_close, on_close = None, self._on_close
+                on_close()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    """异步流式响应的内容，关闭时结束请求计数"""
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+
+    def __aiter__(self):
+        return self._stream.__aiter__()
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if self._on_close is not None:
+                self._on_close, on_close = None, self._on_close
+                on_close()
+
+
+class _TrackedClient(httpx.Client):
+    """记录进行中请求数的 httpx 客户端，流式响应在关闭前一直计为进行中"""
+    def __init__(self, entry: PooledClient, **kwargs):
+        super().__init__(**kwargs)
+        self._entry = entry
+
+    def send(self, request: httpx.Request, *, stream: bool = False, **kwargs) -> httpx.Response:
+        self._entry.begin()
+        try:
+            response = super().send(request, stream=stream, **kwargs)
+        except BaseException:
+            self._entry.end()
+            raise
+        if stream:
+            response.stream = _TrackedStream(response.stream, self._entry.end)
+        else:
+            self._entry.end()
+        return response
+
+
+class _AsyncTrackedClient(httpx.AsyncClient):
+    """记录进行中请求数的异步 httpx 客户端"""
+    def __init__(self, entry: PooledClient, **kwargs):
+        super().__init__(**kwargs)
+        self._entry = entry
+
+    async def send(self, request: httpx.Request, *, stream: bool = False, **kwargs) -> httpx.Response:
+        self._entry.begin()
+        try:
+            response = await super().send(request, stream=stream, **kwargs)
+        except BaseException:
+            self._entry.end()
+            raise
+        if stream:
+            response.stream = _AsyncTrackedStream(response.stream, self._entry.end)
+        else:
+            self._entry.end()
+        return response
+
+
+class ClientRegistry:
+    """
+    进程级共享的 HTTP 客户端注册表
+
+    按 (类型, base_url, key, proxy) 复用 httpx 客户端及其 keep-alive 连接池，
+    Streamlit 重新运行脚本、不同会话之间都不会重复建立 TCP/TLS 连接。
+    超过 idle_timeout 未使用、且没有进行中请求（包括未结束的流式响应）的客户端会被关闭并移出注册表。
+    """
+    def __init__(self, idle_timeout: float = 300):
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _evict_idle(self):
+        now = time.time()
+        for key, entry in list(self._entries.items()):
+            if entry.in_flight == 0 and now - entry.last_used > self.idle_timeout:
+                del self._entries[key]
+                entry.close()
+
+    def _create_http_client(self, kind: str, config: LLMConfig, entry: PooledClient) -> httpx.Client | httpx.AsyncClient:
+        if kind == "async":
+            entry_hooks = {"request": [entry.on_request_async], "response": [entry.on_response_async]}
+        else:
+            entry_hooks = {"request": [entry.on_request], "response": [entry.on_response]}
+        kwargs = {
+            "limits": httpx.Limits(
+                max_connections=config.pool_max_connections,
+                max_keepalive_connections=config.pool_max_keepalive,
+                keepalive_expiry=config.pool_keepalive_expiry
+            ),
+            "http2": config.http2 and HTTP2_AVAILABLE,
+            "event_hooks": entry_hooks,
+        }
+        if config.proxy:
+            kwargs["proxy"] = config.proxy
+            kwargs["verify"] = False
+
+        if kind == "raw":
+            kwargs["base_url"] = config.base_url
+            kwargs["headers"] = {
+                "Authorization": f"Bearer {config.api_key}",
+                "Content-Type": "application/json"
+            }
+            kwargs["timeout"] = 60
+        else:
+            kwargs["follow_redirects"] = True
+        if kind == "async":
+            return _AsyncTrackedClient(entry, **kwargs)
+        return _TrackedClient(entry, **kwargs)
+
+    def get(self, kind: str, config: LLMConfig) -> PooledClient:
+        """获取（或创建）共享客户端"""
+        key = (kind, config.base_url, config.api_key, config.proxy)
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = PooledClient()
+                entry.http_client = self._create_http_client(kind, config, entry)
+                self._entries[key] = entry
+            else:
+                entry.hits += 1
+            entry.last_used = time.time()
+            return entry
+
+    def stats(self) -> list[dict]:
+        """各共享客户端的连接复用统计"""
+        with self._lock:
+            return [
+                {"kind": key[0], "base_url": key[1], "proxy": key[3], **entry.stats()}
+                for key, entry in self._entries.items()
+            ]
+
+    def close_all(self):
+        """关闭所有共享客户端"""
+        with self._lock:
+            for entry in self._entries.values():
+                entry.close()
+            self._entries.clear()
+
+
+client_registry = ClientRegistry()
+
+
+def get_pooled_openai_client(config: LLMConfig) -> OpenAI:
+    """获取共享连接池的 OpenAI 客户端"""
+    entry = client_registry.get("openai", config)
+    if entry.openai_client is None:
+        entry.openai_client = OpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url,
+            http_client=entry.http_client
+        )
+    return entry.openai_client
+
+
+def get_pooled_raw_client(config: LLMConfig) -> httpx.Client:
+    """获取共享连接池的原生 httpx 客户端"""
+    return client_registry.get("raw", config).http_client
+
+
+def get_pooled_async_openai_client(config: LLMConfig) -> AsyncOpenAI:
+    """
+    获取共享连接池的 AsyncOpenAI 客户端
+
+    异步客户端绑定事件循环，只能在 common.async_loop 的后台事件循环中获取和使用
+    """
+    entry = client_registry.get("async", config)
+    if entry.openai_client is None:
+        entry.openai_client = AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.base_url,
+            http_client=entry.http_client
+        )
+    return entry.openai_client
@@ -12,8 +12,58 @@ class LLMConfig:
             "key": "",
             "temperature": 0.9,
             "max_tokens": 16000,
-            "proxy": "http://127.0.0.1:8888"
+            "proxy": "http://127.0.0.1:8888",
+            "context_tokens": 32000,
+            "context_strategy": "keep_pinned",
+            "summary_threshold": 60,
+            "summary_chunk": 20,
+            "pool_max_connections": 20,
+            "pool_max_keepalive": 10,
+            "pool_keepalive_expiry": 60,
+            "http2": true,
+            "timeout": 600,
+            "first_token_timeout": 60,
+            "candidates": 3,
+            "candidate_mode": "n",
+            "stream_usage": true,
+            "prompt_cache": "cache_control",
+            "priority": 0,
+            "weight": 1,
+            "completion_cache": false,
+            "completion_cache_ttl": 604800,
+            "completion_cache_size": 1000,
+            "completion_cache_embedding_model": "",
+            "completion_cache_similarity": 0.95,
+            "rpm": 60,
+            "tpm": 100000,
+            "stream_frame_chars": 32,
+            "stream_frame_interval": 0.05,
+            "image_max_side": 2048,
+            "image_quality": 85
         }
+    context_tokens: 发送给模型的上下文token预算，0表示不限制
+    context_strategy: 超出预算时的裁剪策略，可选 sliding_window、keep_pinned、drop_oldest_pairs
+    summary_threshold: 未摘要的对话消息超过该数量时，将最早的消息合并进滚动摘要，0表示不摘要
+    summary_chunk: 每次合并进摘要的消息数量
+    pool_max_connections/pool_max_keepalive/pool_keepalive_expiry: 共享连接池的连接数上限、keep-alive 连接数上限和空闲连接过期秒数
+    http2: 是否启用 HTTP/2（需安装 h2）
+    timeout: 单次对话请求的总超时秒数，0表示不限制
+    first_token_timeout: 等待首个token的超时秒数，0表示只受总超时限制
+    candidates: 每次生成的候选回复数量，多余的候选用于重新生成时直接切换
+    candidate_mode: 多个候选的生成方式，n 使用接口的 n 参数，parallel 并发发起多个请求（适用于不支持 n 参数的接口）
+    stream_usage: 流式请求是否要求返回 usage（用于统计缓存命中的token数），默认不要求，部分接口不支持 stream_options 参数
+    prompt_cache: 提示词缓存方式，为空时依赖接口的自动前缀缓存（OpenAI、DeepSeek等），
+        cache_control 时在固定前缀末尾打上缓存标记（Anthropic、OpenRouter、通义等）
+    priority: 多接口路由时的优先顺序，越小越优先
+    weight: 多接口路由时的权重，越大越优先
+    completion_cache: 是否启用回复缓存，相同的请求直接回放缓存的回复
+    completion_cache_ttl/completion_cache_size: 回复缓存的过期秒数和最大条数
+    completion_cache_embedding_model: 近似匹配使用的向量模型，为空时只进行精确匹配
+    completion_cache_similarity: 近似匹配的相似度阈值
+    rpm/tpm: 该接口每分钟的请求数和token数上限，由进程内共享的限流调度器控制，0表示不限制
+    stream_frame_chars/stream_frame_interval: 流式输出时把细碎的片段合并成帧再交给页面显示，
+        累积到该字符数或距帧内第一个片段超过该秒数时输出一帧，减少页面重绘次数
+    image_max_side/image_quality: 参考图发送前缩小到的最大边长（像素，0表示不缩放）和重新编码的 JPEG 质量
     """
     def __init__(self, config_path):
         self.config_path = config_path
@@ -24,6 +74,33 @@ class LLMConfig:
         self.max_tokens = 200
         self.proxy = ""
         self.break_prompt = ""
+        self.context_tokens = 0
+        self.context_strategy = "keep_pinned"
+        self.summary_threshold = 0
+        self.summary_chunk = 20
+        self.pool_max_connections = 20
+        self.pool_max_keepalive = 10
+        self.pool_keepalive_expiry = 60
+        self.http2 = True
+        self.timeout = 600
+        self.first_token_timeout = 0
+        self.candidates = 1
+        self.candidate_mode = "n"
+        self.stream_usage = False
+        self.prompt_cache = ""
+        self.priority = 0
+        self.weight = 1
+        self.completion_cache = False
+        self.completion_cache_ttl = 7 * 24 * 3600
+        self.completion_cache_size = 1000
+        self.completion_cache_embedding_model = ""
+        self.completion_cache_similarity = 0.95
+        self.rpm = 0
+        self.tpm = 0
+        self.stream_frame_chars = 32
+        self.stream_frame_interval = 0.05
+        self.image_max_side = 2048
+        self.image_quality = 85
         self.load_config()
 
     def load_config(self):
@@ -38,6 +115,35 @@ class LLMConfig:
             self.max_tokens = config.get("max_tokens", self.max_tokens)
             self.proxy = config.get("proxy", self.proxy)
             self.break_prompt = config.get("break_prompt", self.break_prompt)
+            self.context_tokens = config.get("context_tokens", self.context_tokens)
+            self.context_strategy = config.get("context_strategy", self.context_strategy)
+            self.summary_threshold = config.get("summary_threshold", self.summary_threshold)
+            self.summary_chunk = config.get("summary_chunk", self.summary_chunk)
+            self.pool_max_connections = config.get("pool_max_connections", self.pool_max_connections)
+            self.pool_max_keepalive = config.get("pool_max_keepalive", self.pool_max_keepalive)
+            self.pool_keepalive_expiry = config.get("pool_keepalive_expiry", self.pool_keepalive_expiry)
+            self.http2 = config.get("http2", self.http2)
+            self.timeout = config.get("timeout", self.timeout)
+            self.first_token_timeout = config.get("first_token_timeout", self.first_token_timeout)
+            self.candidates = config.get("candidates", self.candidates)
+            self.candidate_mode = config.get("candidate_mode", self.candidate_mode)
+            self.stream_usage = config.get("stream_usage", self.stream_usage)
+            self.prompt_cache = config.get("prompt_cache", self.prompt_cache)
+            self.priority = config.get("priority", self.priority)
+            self.weight = config.get("weight", self.weight)
+            self.completion_cache = config.get("completion_cache", self.completion_cache)
+            self.completion_cache_ttl = config.get("completion_cache_ttl", self.completion_cache_ttl)
+            self.completion_cache_size = config.get("completion_cache_size", self.completion_cache_size)
+            self.completion_cache_embedding_model = config.get("completion_cache_embedding_model",
+                                                               self.completion_cache_embedding_model)
+            self.completion_cache_similarity = config.get("completion_cache_similarity",
+                                                          self.completion_cache_similarity)
+            self.rpm = config.get("rpm", self.rpm)
+            self.tpm = config.get("tpm", self.tpm)
+            self.stream_frame_chars = config.get("stream_frame_chars", self.stream_frame_chars)
+            self.stream_frame_interval = config.get("stream_frame_interval", self.stream_frame_interval)
+            self.image_max_side = config.get("image_max_side", self.image_max_side)
+            self.image_quality = config.get("image_quality", self.image_quality)
 
             self._raw_config = config
         except FileNotFoundError:
@@ -0,0 +1,77 @@
+import os
+import json
+
+
+def atomic_write_json(path: str, data, indent: int = 2):
+    """
+    原子地写入 JSON 文件：先写入临时文件并落盘，再替换目标文件，
+    进程崩溃时目标文件要么是旧内容，要么是新内容，不会出现写了一半的文件
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _truncate_torn_tail(f):
+    """截断文件末尾不完整的行（写入时崩溃留下的半行），f 为以 r+b 打开的文件"""
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+        return
+
+    # 向前查找最后一个换行符
+    pos = size
+    while pos > 0:
+        read_size = min(4096, pos)
+        pos -= read_size
+        f.seek(pos)
+        index = f.read(read_size).rfind(b"\n")
+        if index >= 0:
+            pos += index + 1
+            break
+    print(f"日志文件 {f.name} 末尾存在不完整的记录，已截断")
+    f.truncate(pos)
+
+
+def append_json_line(path: str, record: dict):
+    """
+    向 JSONL 文件追加一行并落盘，一次 write 写入整行
+
+    追加前截断末尾不完整的行，多个写入方需要在调用方加锁（见 common.filelock）
+    """
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    if os.path.exists(path):
+        with open(path, 'r+b') as f:
+            _truncate_torn_tail(f)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_json_lines(path: str) -> list:
+    """
+    读取 JSONL 文件，忽略末尾不完整的行（写入时崩溃留下的半行，或者正在写入的行）
+
+    读取方不修改文件，不完整的行在下次追加时截断
+
+    :return: 完整行解析后的记录列表
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+
+    with open(path, 'rb') as f:
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(raw_line.decode('utf-8')))
+            except ValueError:
+                break
+    return records
@@ -0,0 +1,66 @@
+import os
+import time
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class FileLock:
+    """
+    跨进程的排他文件锁，锁定单独的锁文件，Windows 使用 msvcrt，其他系统使用 fcntl
+
+    只用于写入方之间互斥，读取方不加锁：写入使用原子替换或整行追加，读取时不会看到写了一半的内容。
+    锁文件在使用后保留，删除锁文件会使其他进程锁定已删除的文件。
+
+        with FileLock("xxx.lock"):
+            ...
+    """
+    def __init__(self, lock_path: str, timeout: float = 30, poll_interval: float = 0.05):
+        self._lock_path = lock_path
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if os.name == "nt":
+                # 锁定文件的第一个字节
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self):
+        self._file = open(self._lock_path, 'a+b')
+        deadline = time.monotonic() + self._timeout
+        while not self._try_lock():
+            if time.monotonic() >= deadline:
+                self._file.close()
+                self._file = None
+                raise TimeoutError(f"等待文件锁 {self._lock_path} 超时")
+            time.sleep(self._poll_interval)
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,290 @@
+import os
+import time
+import glob
+import argparse
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common.config import LLMConfig, global_config
+from common.fileio import append_json_line, read_json_lines
+from common.filelock import FileLock
+
+
+# 指标按天写入一个 JSONL 文件，保留最近 RETENTION_DAYS 天
+RETENTION_DAYS = 7
+QUANTILES = (0.5, 0.9, 0.99)
+ERROR_MESSAGE_LENGTH = 200
+# Prometheus 导出的默认统计窗口（秒）
+EXPORT_WINDOW = 3600
+
+
+def percentile(values: list, q: float) -> float | None:
+    """线性插值的分位数，q 取 0~1，values 为空时返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+
+class MetricsStore:
+    """
+    模型调用指标，保存在工作目录的 metrics 目录中，每天一个 JSONL 文件
+
+    每次调用一条记录：
+        {
+            "ts": 1700000000.0,             // 调用结束时间
+            "kind": "chat",                 // chat 或 image
+            "model": "模型名称",
+            "endpoint": "接口地址",
+            "scenario": "场景名称",           // 没有场景时为空字符串
+            "status": "completed",          // completed、error、timeout、cancelled
+            "latency": 3.2,                 // 总耗时（秒）
+            "ttft": 0.8,                    // 首个token延迟（秒），不包括限流排队时间，非流式调用为 null
+            "queue_wait": 0.0,              // 限流排队时间（秒）
+            "prompt_tokens": 1200,
+            "completion_tokens": 300,
+            "tokens_per_second": 125.0,     // 输出速度，从首个token开始计算
+            "error": "错误信息"               // 仅失败时存在
+        }
+    多个进程（页面和批量任务）可以同时写入，写入时加文件锁。
+    """
+    def __init__(self, metrics_dir: str = None):
+        self._metrics_dir = metrics_dir or os.path.join(global_config.workspace, "metrics")
+        self._lock = threading.Lock()
+        self._pruned_day = None
+
+    def _day_path(self, day: str) -> str:
+        return os.path.join(self._metrics_dir, f"{day}.jsonl")
+
+    def _prune(self, today: str):
+        """每天第一次写入时删除过期的文件"""
+        if self._pruned_day == today:
+            return
+        self._pruned_day = today
+        oldest = time.strftime("%Y-%m-%d", time.localtime(time.time() - RETENTION_DAYS * 86400))
+        for path in glob.glob(os.path.join(self._metrics_dir, "*.jsonl")):
+            if os.path.basename(path)[:-len(".jsonl")] < oldest:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"删除过期指标文件 {path} 出错: {e}")
+
+    def record(self, kind: str, config: LLMConfig, status: str, latency: float, scenario: str = "",
+               ttft: float = None, queue_wait: float = 0.0, prompt_tokens: int = None,
+               completion_tokens: int = None, error: Exception | str = None):
+        """
+        记录一次模型调用，写入失败时只打印错误，不影响调用方
+
+        :param latency: 总耗时（秒），包括限流排队时间
+        :param ttft: 从调用开始到首个token的时间（秒），与 ChatStream.ttft 相同包括限流排队时间，记录时扣除
+        :param queue_wait: 限流排队时间（秒）
+        """
+        # 输出速度从首个token开始计算，ttft 已包括排队时间
+        generation_time = latency - (ttft if ttft is not None else queue_wait)
+        if ttft is not None:
+            ttft = max(ttft - queue_wait, 0.0)
+        record = {
+            "ts": time.time(),
+            "kind": kind,
+            "model": config.model,
+            "endpoint": config.base_url,
+            "scenario": scenario or "",
+            "status": status,
+            "latency": round(latency, 4),
+            "ttft": round(ttft, 4) if ttft is not None else None,
+            "queue_wait": round(queue_wait, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_per_second": (round(completion_tokens / generation_time, 2)
+                                  if completion_tokens and generation_time > 0 else None)
+        }
+        if error is not None:
+            record["error"] = str(error)[:ERROR_MESSAGE_LENGTH]
+
+        today = time.strftime("%Y-%m-%d")
+        try:
+            with self._lock:
+                os.makedirs(self._metrics_dir, exist_ok=True)
+                with FileLock(os.path.join(self._metrics_dir, ".lock")):
+                    append_json_line(self._day_path(today), record)
+                    self._prune(today)
+        except (OSError, TimeoutError) as e:
+            print(f"写入调用指标出错: {e}")
+
+    @contextmanager
+    def track(self, kind: str, config: LLMConfig, scenario: str = ""):
+        """
+        记录代码块内的一次非流式调用，调用方可以在返回的字典中补充 status、prompt_tokens、completion_tokens、error，
+        代码块抛出异常时记录为 error
+
+            with metrics_store.track("image", config) as call:
+                response = ...
+                call["completion_tokens"] = ...
+        """
+        call = {"status": "completed"}
+        start = time.monotonic()
+        try:
+            yield call
+        except Exception as e:
+            call["status"] = "error"
+            call["error"] = e
+            raise
+        finally:
+            self.record(kind, config, latency=time.monotonic() - start, scenario=scenario, **call)
+
+    def load(self, since: float = 0.0) -> list[dict]:
+        """读取 since（时间戳）之后的记录"""
+        since_day = time.strftime("%Y-%m-%d", time.localtime(since))
+        records = []
+        for path in sorted(glob.glob(os.path.join(self._metrics_dir, "*.jsonl"))):
+            if os.path.basename(path)[:-len(".jsonl")] < since_day:
+                continue
+            records.extend(r for r in read_json_lines(path) if r["ts"] >= since)
+        return records
+
+
+def summarize(records: list[dict], group_by: tuple = ("kind", "model", "endpoint")) -> list[dict]:
+    """按标签分组统计调用次数、错误率、延迟分位数、token 数和输出速度"""
+    groups = {}
+    for record in records:
+        groups.setdefault(tuple(record.get(label, "") for label in group_by), []).append(record)
+
+    rows = []
+    for key, group in sorted(groups.items()):
+        latencies = [r["latency"] for r in group]
+        ttfts = [r["ttft"] for r in group if r["ttft"] is not None]
+        speeds = [r["tokens_per_second"] for r in group if r["tokens_per_second"]]
+        errors = sum(1 for r in group if r["status"] in ("error", "timeout"))
+        row = dict(zip(group_by, key))
+        row.update({
+            "count": len(group),
+            "error_rate": errors / len(group),
+            "prompt_tokens": sum(r["prompt_tokens"] or 0 for r in group),
+            "completion_tokens": sum(r["completion_tokens"] or 0 for r in group),
+            "tokens_per_second": sum(speeds) / len(speeds) if speeds else None
+        })
+        for q in QUANTILES:
+            row[f"latency_p{int(q * 100)}"] = percentile(latencies, q)
+            row[f"ttft_p{int(q * 100)}"] = percentile(ttfts, q)
+        rows.append(row)
+    return rows
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(labels: dict) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def prometheus_text(records: list[dict], window: float = EXPORT_WINDOW) -> str:
+    """
+    Prometheus 文本格式的指标，按 kind、model、endpoint、scenario 分组
+
+    指标从保留期内的记录重新计算，过期文件删除后数值会下降，因此全部导出为 gauge，
+    取值为最近 window 秒内的调用次数、token 数和分位数，不是单调递增的累计值
+
+    :param records: 调用记录，只统计最近 window 秒内的记录
+    :param window: 统计窗口（秒）
+    """
+    since = time.time() - window
+    records = [r for r in records if r["ts"] >= since]
+    label_names = ("kind", "model", "endpoint", "scenario")
+    window_text = f"最近{int(window)}秒内的"
+    totals = {
+        "prompt_me_llm_requests": "模型调用次数",
+        "prompt_me_llm_errors": "失败（出错或超时）的模型调用次数",
+        "prompt_me_llm_prompt_tokens": "输入token数",
+        "prompt_me_llm_completion_tokens": "输出token数",
+    }
+    quantiles = {
+        "prompt_me_llm_latency_seconds": ("latency", "模型调用总耗时分位数"),
+        "prompt_me_llm_ttft_seconds": ("ttft", "首个token延迟分位数"),
+        "prompt_me_llm_tokens_per_second": ("tokens_per_second", "输出速度分位数"),
+    }
+
+    groups = {}
+    for record in records:
+        groups.setdefault(tuple(record.get(label, "") for label in label_names), []).append(record)
+
+    lines = ["# HELP prompt_me_llm_window_seconds 指标的统计窗口（秒）",
+             "# TYPE prompt_me_llm_window_seconds gauge",
+             f"prompt_me_llm_window_seconds {window:g}"]
+    for name, help_text in totals.items():
+        lines.append(f"# HELP {name} {window_text}{help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, group in sorted(groups.items()):
+            if name == "prompt_me_llm_requests":
+                value = len(group)
+            elif name == "prompt_me_llm_errors":
+                value = sum(1 for r in group if r["status"] in ("error", "timeout"))
+            elif name == "prompt_me_llm_prompt_tokens":
+                value = sum(r["prompt_tokens"] or 0 for r in group)
+            else:
+                value = sum(r["completion_tokens"] or 0 for r in group)
+            lines.append(f"{name}{_labels(dict(zip(label_names, key)))} {value}")
+
+    for name, (field, help_text) in quantiles.items():
+        lines.append(f"# HELP {name} {window_text}{help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, group in sorted(groups.items()):
+            values = [r[field] for r in group if r[field] is not None]
+            if not values:
+                continue
+            labels = dict(zip(label_names, key))
+            for q in QUANTILES:
+                lines.append(f"{name}{_labels({**labels, 'quantile': q})} {percentile(values, q):.6g}")
+    return "\n".join(lines) + "\n"
+
+
+metrics_store = MetricsStore()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    window = EXPORT_WINDOW
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        records = metrics_store.load(time.time() - self.window)
+        body = prometheus_text(records, self.window).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出模型调用指标（Prometheus 文本格式）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="输出到标准输出")
+    serve_parser = subparsers.add_parser("serve", help="在 /metrics 提供 HTTP 抓取接口")
+    for sub in (export_parser, serve_parser):
+        sub.add_argument("--window", type=float, default=EXPORT_WINDOW,
+                         help=f"统计窗口（秒），最大为保留期 {RETENTION_DAYS} 天")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=9464)
+    args = parser.parse_args()
+    window = min(args.window, RETENTION_DAYS * 86400)
+
+    if args.command == "export":
+        print(prometheus_text(metrics_store.load(time.time() - window), window), end="")
+    else:
+        _MetricsHandler.window = window
+        server = ThreadingHTTPServer((args.host, args.port), _MetricsHandler)
+        print(f"指标接口: http://{args.host}:{args.port}/metrics")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import time
+
+import streamlit as st
+
+from common.metrics import metrics_store, summarize, percentile, prometheus_text, QUANTILES
+
+
+# 时间范围 -> (秒数, 图表分桶秒数)
+TIME_RANGES = {
+    "最近1小时": (3600, 300),
+    "最近24小时": (86400, 3600),
+    "最近7天": (7 * 86400, 6 * 3600),
+}
+
+
+def percentile_series(records: list[dict], field: str, bucket: int) -> dict:
+    """按时间分桶计算分位数，返回 st.line_chart 使用的列数据"""
+    buckets = {}
+    for record in records:
+        if record[field] is not None:
+            buckets.setdefault(int(record["ts"] // bucket * bucket), []).append(record[field])
+
+    series = {"时间": [], **{f"p{int(q * 100)}": [] for q in QUANTILES}}
+    for start in sorted(buckets):
+        series["时间"].append(time.strftime("%m-%d %H:%M", time.localtime(start)))
+        for q in QUANTILES:
+            series[f"p{int(q * 100)}"].append(percentile(buckets[start], q))
+    return series
+
+
+def metrics_page():
+    st.set_page_config(page_title="调用监控", layout="wide")
+    st.title("调用监控")
+
+    with st.sidebar:
+        st.subheader("📈 范围")
+        range_name = st.selectbox("时间范围", list(TIME_RANGES.keys()), index=1)
+        seconds, bucket = TIME_RANGES[range_name]
+        records = metrics_store.load(time.time() - seconds)
+
+        kinds = sorted({r["kind"] for r in records})
+        models = sorted({r["model"] for r in records})
+        scenarios = sorted({r["scenario"] for r in records if r["scenario"]})
+        selected_kinds = st.multiselect("类型", kinds, placeholder="全部")
+        selected_models = st.multiselect("模型", models, placeholder="全部")
+        selected_scenarios = st.multiselect("场景", scenarios, placeholder="全部")
+
+    records = [
+        r for r in records
+        if (not selected_kinds or r["kind"] in selected_kinds)
+        and (not selected_models or r["model"] in selected_models)
+        and (not selected_scenarios or r["scenario"] in selected_scenarios)
+    ]
+    if not records:
+        st.info("所选范围内没有调用记录")
+        return
+
+    errors = sum(1 for r in records if r["status"] in ("error", "timeout"))
+    speeds = [r["tokens_per_second"] for r in records if r["tokens_per_second"]]
+    cols = st.columns(4)
+    cols[0].metric("调用次数", len(records))
+    cols[1].metric("错误率", f"{errors / len(records):.1%}")
+    cols[2].metric("P90 总耗时", f"{percentile([r['latency'] for r in records], 0.9):.2f}s")
+    cols[3].metric("平均输出速度", f"{sum(speeds) / len(speeds):.1f} tok/s" if speeds else "-")
+
+    st.subheader("总耗时分位数（秒）")
+    st.line_chart(percentile_series(records, "latency", bucket), x="时间")
+    st.subheader("首个token延迟分位数（秒）")
+    st.line_chart(percentile_series(records, "ttft", bucket), x="时间")
+
+    st.subheader("按模型统计")
+    st.dataframe(summarize(records, ("kind", "model", "endpoint", "scenario")), hide_index=True)
+
+    failed = [r for r in records if r["status"] != "completed"]
+    if failed:
+        with st.expander(f"未完成的调用（{len(failed)}）"):
+            st.dataframe([
+                {"时间": time.strftime("%m-%d %H:%M:%S", time.localtime(r["ts"])), "模型": r["model"],
+                 "场景": r["scenario"], "状态": r["status"], "错误": r.get("error", "")}
+                for r in reversed(failed)
+            ], hide_index=True)
+
+    with st.expander("Prometheus 指标"):
+        st.caption("运行 python -m common.metrics serve 提供 /metrics 抓取接口，指标为所选时间范围内的 gauge")
+        st.code(prometheus_text(records, seconds), language="text")
+
+
+metrics_page()
@@ -0,0 +1,282 @@
+import time
+import heapq
+import asyncio
+import threading
+import itertools
+from email.utils import parsedate_to_datetime
+
+from common.config import LLMConfig
+
+
+# 优先级，数值越小越优先
+PRIORITY_CHAT = 0
+PRIORITY_BATCH = 1
+PRIORITY_IMAGE = 2
+PRIORITY_NAMES = {PRIORITY_CHAT: "chat", PRIORITY_BATCH: "batch", PRIORITY_IMAGE: "image"}
+
+# 没有 Retry-After 时的退避时间（秒），连续限流时翻倍
+BASE_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+
+
+def parse_retry_after(headers) -> float | None:
+    """从 429 响应头中读取需要等待的秒数，支持 retry-after-ms、retry-after（秒数或 HTTP 日期）"""
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    令牌桶，每分钟补充 per_minute 个令牌，最多累积一分钟的量
+
+    :param per_minute: 每分钟的令牌数，0 为不限制
+    """
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self._rate = per_minute / 60
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取得 amount 个令牌还需要等待的秒数"""
+        if not self.capacity:
+            return 0.0
+        self._refill(now)
+        # 超过桶容量的请求在桶满时放行
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self._rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """按实际用量补扣（amount 为负时退还）令牌，允许透支，透支部分由之后的请求等待补足"""
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class Permit:
+    """一次请求的许可，请求结束后用实际 token 用量调用 settle 修正预估"""
+    def __init__(self, limiter: "EndpointLimiter", tokens: int):
+        self._limiter = limiter
+        self._tokens = tokens
+        self._settled = False
+
+    def settle(self, used_tokens: int | None):
+        if self._settled or used_tokens is None:
+            return
+        self._settled = True
+        self._limiter.adjust_tokens(used_tokens - self._tokens)
+
+
+class EndpointLimiter:
+    """
+    单个接口的限流器
+
+    请求数和 token 数各用一个令牌桶；等待中的请求按 (优先级, 到达顺序) 排队，
+    只有队首的请求可以取得令牌，低优先级的请求不会抢在高优先级之前。
+    收到 429 后在 Retry-After 指定的时间内（没有时按指数退避）暂停放行。
+    """
+    def __init__(self, rpm: int = 0, tpm: int = 0):
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._counter = itertools.count()
+        self._blocked_until = 0.0
+        self._backoff = BASE_BACKOFF
+        # 各优先级的排队统计：次数、总等待时间、最大等待时间
+        self._wait_stats = {}
+
+    def configure(self, rpm: int, tpm: int):
+        """配置变化时更新限额"""
+        with self._cond:
+            if self._requests.capacity != rpm:
+                self._requests = TokenBucket(rpm)
+            if self._tokens.capacity != tpm:
+                self._tokens = TokenBucket(tpm)
+
+    def _try_take(self, ticket: tuple, tokens: int) -> float:
+        """在锁内调用，成功取得令牌返回0，否则返回建议的等待秒数"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._queue[0] != ticket:
+            # 等待排在前面的请求
+            return 0.05
+        wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        heapq.heappop(self._queue)
+        return 0.0
+
+    def _record_wait(self, priority: int, waited: float):
+        stats = self._wait_stats.setdefault(priority, {"count": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += waited
+        stats["max"] = max(stats["max"], waited)
+
+    def _leave(self, ticket: tuple):
+        """取消排队"""
+        if ticket in self._queue:
+            self._queue.remove(ticket)
+            heapq.heapify(self._queue)
+        self._cond.notify_all()
+
+    def acquire(self, tokens: int = 0, priority: int = PRIORITY_CHAT) -> Permit:
+        """阻塞等待直到可以发起请求"""
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while (wait := self._try_take(ticket, tokens)) > 0:
+                    self._cond.wait(wait)
+            except BaseException:
+                self._leave(ticket)
+                raise
+            self._record_wait(priority, time.monotonic() - start)
+            self._cond.notify_all()
+        return Permit(self, tokens)
+
+    async def acquire_async(self, tokens: int = 0, priority: int = PRIORITY_CHAT) -> Permit:
+        """在事件循环中等待直到可以发起请求，不阻塞事件循环，可以被取消"""
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._counter))
+            heapq.heappush(self._queue, ticket)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._try_take(ticket, tokens)
+                    if wait <= 0:
+                        self._record_wait(priority, time.monotonic() - start)
+                        self._cond.notify_all()
+                        break
+                await asyncio.sleep(min(wait, 0.5))
+        except BaseException:
+            with self._cond:
+                self._leave(ticket)
+            raise
+        return Permit(self, tokens)
+
+    def adjust_tokens(self, amount: int):
+        with self._cond:
+            self._tokens.adjust(amount)
+
+    def penalize(self, retry_after: float = None):
+        """收到 429 后暂停放行"""
+        with self._cond:
+            if retry_after is None:
+                retry_after = self._backoff
+                self._backoff = min(self._backoff * 2, MAX_BACKOFF)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._cond.notify_all()
+
+    def reset_backoff(self):
+        """请求成功后恢复初始退避时间"""
+        with self._cond:
+            self._backoff = BASE_BACKOFF
+
+    def report(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            return {
+                "queued": len(self._queue),
+                "blocked_seconds": max(self._blocked_until - now, 0.0),
+                "wait": {
+                    PRIORITY_NAMES.get(priority, str(priority)): {
+                        "count": stats["count"],
+                        "avg": stats["total"] / stats["count"],
+                        "max": stats["max"]
+                    }
+                    for priority, stats in sorted(self._wait_stats.items())
+                }
+            }
+
+
+class RateLimiter:
+    """
+    进程内共享的限流调度器，按接口（base_url, model）限流，限额取自配置的 rpm 和 tpm
+
+    对话、批量任务和图片生成共用同一接口时，对话优先，其次是批量任务，最后是图片生成
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    @staticmethod
+    def _key(config: LLMConfig) -> tuple:
+        return (config.base_url, config.model)
+
+    def endpoint(self, config: LLMConfig) -> EndpointLimiter:
+        with self._lock:
+            key = self._key(config)
+            if key not in self._endpoints:
+                self._endpoints[key] = EndpointLimiter(config.rpm, config.tpm)
+            limiter = self._endpoints[key]
+        limiter.configure(config.rpm, config.tpm)
+        return limiter
+
+    def acquire(self, config: LLMConfig, tokens: int = 0, priority: int = PRIORITY_CHAT) -> Permit:
+        """
+        阻塞等待直到可以向该接口发起请求
+
+        :param tokens: 预估的 token 数，请求结束后通过 Permit.settle 按实际用量修正
+        :param priority: 优先级，PRIORITY_CHAT、PRIORITY_BATCH 或 PRIORITY_IMAGE
+        """
+        return self.endpoint(config).acquire(tokens, priority)
+
+    async def acquire_async(self, config: LLMConfig, tokens: int = 0, priority: int = PRIORITY_CHAT) -> Permit:
+        """acquire 的异步版本"""
+        return await self.endpoint(config).acquire_async(tokens, priority)
+
+    def report_error(self, config: LLMConfig, error: Exception):
+        """请求出错时调用，429 错误按 Retry-After 退避"""
+        response = getattr(error, "response", None)
+        status = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+        if status == 429:
+            self.endpoint(config).penalize(parse_retry_after(getattr(response, "headers", None)))
+
+    def report_response(self, config: LLMConfig, response):
+        """直接发送 HTTP 请求时调用，429 响应按 Retry-After 退避"""
+        if response.status_code == 429:
+            self.endpoint(config).penalize(parse_retry_after(response.headers))
+        elif response.status_code < 400:
+            self.report_success(config)
+
+    def report_success(self, config: LLMConfig):
+        self.endpoint(config).reset_backoff()
+
+    def report(self) -> list[dict]:
+        """各接口的排队情况和各优先级的排队等待时间（秒）"""
+        with self._lock:
+            endpoints = list(self._endpoints.items())
+        return [
+            {"base_url": base_url, "model": model, **limiter.report()}
+            for (base_url, model), limiter in endpoints
+        ]
+
+
+rate_limiter = RateLimiter()
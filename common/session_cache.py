@@ -0,0 +1,49 @@
+import os
+
+
+def file_stamp(*paths) -> tuple:
+    """获取文件（或目录）的修改时间戳，文件不存在时为0，只读取元数据不读取内容"""
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except (OSError, TypeError):
+            stamps.append(0)
+    return tuple(stamps)
+
+
+class StampedCache:
+    """
+    会话级对象缓存，保存在 st.session_state 这类字典中
+
+    对象按 (key, 版本戳) 缓存，key 或版本戳变化时才重新构建，
+    版本戳由存储后端提供（如文件修改时间，见 file_stamp），
+    自身写入后调用 refresh 更新版本戳，避免下次重新加载。
+    """
+    def __init__(self, store, name: str):
+        self._store = store
+        self._name = name
+        if self._name not in self._store:
+            self._store[self._name] = None
+
+    def is_fresh(self, key, stamp: tuple) -> bool:
+        """缓存的对象是否仍然有效"""
+        entry = self._store[self._name]
+        return entry is not None and entry[0] == (key, stamp)
+
+    def get(self, key, stamp: tuple, factory):
+        """获取缓存对象，失效时调用 factory 重新构建"""
+        if self.is_fresh(key, stamp):
+            return self._store[self._name][1]
+        obj = factory()
+        self._store[self._name] = ((key, stamp), obj)
+        return obj
+
+    def refresh(self, key, stamp: tuple):
+        """自身写入后更新版本戳"""
+        entry = self._store[self._name]
+        if entry is not None and entry[0][0] == key:
+            self._store[self._name] = ((key, stamp), entry[1])
+
+    def invalidate(self):
+        self._store[self._name] = None
@@ -1,53 +1,30 @@
 import httpx
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 from common.config import LLMConfig
+from common.client_pool import get_pooled_openai_client, get_pooled_raw_client, get_pooled_async_openai_client
 
 def get_openai_client(config: LLMConfig) -> OpenAI:
-    """根据配置获取 OpenAI 客户端实例"""
-    if config.proxy:
-        http_client = httpx.Client(
-            proxy=config.proxy,
-            verify=False
-        )
-        client = OpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url,
-            http_client=http_client
-        )
-    else:
-        client = OpenAI(
-            api_key=config.api_key,
-            base_url=config.base_url
-        )
-    return client
+    """
+    根据配置获取 OpenAI 客户端实例
+
+    客户端来自进程级共享的连接池，相同 (base_url, key, proxy) 的调用方复用同一个连接池，
+    调用方不应长期持有返回的客户端，每次使用前重新获取即可（开销仅为一次字典查找）
+    """
+    return get_pooled_openai_client(config)
+
+
+def get_async_openai_client(config: LLMConfig) -> AsyncOpenAI:
+    """根据配置获取 AsyncOpenAI 客户端实例，只能在后台事件循环（common.async_loop）中调用"""
+    return get_pooled_async_openai_client(config)
 
 
-def get_raw_client(config: LLMConfig) -> tuple[httpx.Client, dict]:
+def get_raw_client(config: LLMConfig) -> httpx.Client:
     """
     当OpenAI Client无法使用的时候，使用原生 httpx 客户端
     
     :param config: LLM配置对象
-    :return: 说明
-    :rtype: tuple[Client, dict]
+    :return: 共享连接池的 httpx 客户端，已设置 base_url 和认证头
+    :rtype: httpx.Client
     """
-    headers = {
-        "Authorization": f"Bearer {config.api_key}",
-        "Content-Type": "application/json"
-    }
-    if config.proxy:
-        http_proxy_client = httpx.Client(
-            base_url=config.base_url,
-            headers=headers,
-            proxy=config.proxy,
-            verify=False,
-            timeout=60
-        )
-        return http_proxy_client
-    else:
-        http_client = httpx.Client(
-            base_url=config.base_url, 
-            headers=headers,
-            timeout=60
-        )
-        return http_client
\ No newline at end of file
+    return get_pooled_raw_client(config)
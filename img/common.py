@@ -2,65 +2,48 @@ import os
 import time
 import base64
 import json
+import threading
+
+from common.config import global_config, LLMConfig
+from img.downloader import get_downloader, DownloadBatch
+from img.image_store import image_store
+
+
+# 分块编码的块大小，必须是3的倍数，各块的 base64 结果才能直接拼接
+ENCODE_CHUNK_SIZE = 3 * 256 * 1024
 
-from io import BytesIO
-
-import requests
-from PIL import Image
-from pillow_heif import register_heif_opener
-
-from common.config import global_config
-
-
-# 注册 HEIF 解码器
-register_heif_opener()
-
-
-def get_image_type_from_bytes(img_bytes: bytes) -> str:
-    if img_bytes.startswith(b'\xff\xd8'):
-        return 'jpeg'
-    elif img_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
-        return 'png'
-    elif img_bytes.startswith(b'GIF87a') or img_bytes.startswith(b'GIF89a'):
-        return 'gif'
-    else:
-        return 'unknown'
-    
-
-def convert_image(img_bytes: bytes) -> bytes:
-    """
-    将非jpeg和png格式的图片转换为jpeg格式
-    
-    :param img_bytes: 原始图片的二进制数据
-    :type img_bytes: bytes
-    :return: 转换后的jpeg格式图片的二进制数据
-    :rtype: bytes
-    """
-    img_type = get_image_type_from_bytes(img_bytes)
-    if img_type in ['jpeg', 'png']:
-        return img_bytes  # 已经是支持的格式，直接返回
-
-    with BytesIO(img_bytes) as input_buffer:
-        with Image.open(input_buffer) as img:
-            with BytesIO() as output_buffer:
-                img.convert("RGB").save(output_buffer, format="JPEG")
-                return output_buffer.getvalue()
-            
 
 def encode_image(img_bytes) -> str:
     # 读取二进制数据并转为 base64 字符串
-    return base64.b64encode(img_bytes).decode('utf-8')
+    # 分块编码，避免同时存在完整的 base64 bytes 和解码后的 str 两份副本
+    view = memoryview(img_bytes)
+    return "".join(
+        base64.b64encode(view[i:i + ENCODE_CHUNK_SIZE]).decode('ascii')
+        for i in range(0, len(view), ENCODE_CHUNK_SIZE)
+    )
+
+
+def encode_image_cached(img_bytes: bytes) -> str:
+    # 预处理过的参考图直接使用缓存中的 base64 文本
+    return image_store.base64_of(img_bytes) or encode_image(img_bytes)
 
 
 def image_bytes_to_base64(img_bytes: bytes) -> str:
-    return f"data:image/jpeg;base64,{encode_image(img_bytes)}"
+    return f"data:image/jpeg;base64,{encode_image_cached(img_bytes)}"
 
 
 class Recorder:
-    def __init__(self):
-        self._name = time.strftime("%Y%m%d_%H%M%S", time.localtime())
+    def __init__(self, name: str = None):
+        """
+        :param name: 记录目录名称（相对于图片工作目录的 history 目录，可以包含子目录），默认为当前时间
+        """
+        self._name = name or time.strftime("%Y%m%d_%H%M%S", time.localtime())
         self._record_path = os.path.join(global_config.get_img_workspace(), "history", self._name)
 
+    @property
+    def record_path(self) -> str:
+        return self._record_path
+
     def record_prompt(self, prompt: str):
         os.makedirs(self._record_path, exist_ok=True)
         with open(os.path.join(self._record_path, "prompt.txt"), "w", encoding="utf-8") as f:
@@ -72,8 +55,12 @@ class Recorder:
             f.write(json.dumps(params, indent=2, ensure_ascii=False))
 
     def record_image(self, image_bytes: bytes, file_name: str):
+        """参考图缓存中已有的图片硬链接到缓存文件，不重复保存"""
         os.makedirs(self._record_path, exist_ok=True)
-        with open(os.path.join(self._record_path, file_name), "wb") as f:
+        path = os.path.join(self._record_path, file_name)
+        if image_store.link(image_bytes, path):
+            return
+        with open(path, "wb") as f:
             f.write(image_bytes)
 
     def record_image_base64(self, image_b64: str, index: int):
@@ -87,16 +74,30 @@ class Recorder:
         with open(os.path.join(self._record_path, f"output_{index}.jpg"), "wb") as f:
             f.write(_decode_base64_image(image_b64))
 
-    def record_image_from_url(self, image_url: str, index: int):
-        os.makedirs(self._record_path, exist_ok=True)
+    def record_images_from_urls(self, image_urls: list[str], config: LLMConfig, on_done=None) -> DownloadBatch:
+        """
+        在后台并发下载全部图片，立即返回，全部结束后将地址、大小和 sha256 写入 downloads.json
 
-        # 通过 image_url 下载图片内容并保存
-        response = requests.get(image_url)
-        if response.status_code == 200:
-            with open(os.path.join(self._record_path, f"output_{index}.jpg"), "wb") as f:
-                f.write(response.content)
-        else:
-            print(f"Failed to download image from {image_url}, status code: {response.status_code}")
+        :param config: 使用该配置的代理和连接池设置
+        :param on_done: 每个图片下载结束时在下载线程中调用 on_done(DownloadResult)
+        """
+        os.makedirs(self._record_path, exist_ok=True)
+        paths = [os.path.join(self._record_path, f"output_{i}.jpg") for i in range(len(image_urls))]
+        results = []
+        lock = threading.Lock()
+
+        def _on_done(result):
+            with lock:
+                results.append(result)
+                finished = len(results) == len(image_urls)
+            if on_done is not None:
+                on_done(result)
+            if finished:
+                manifest = [r.to_json() for r in sorted(results, key=lambda r: r.index)]
+                with open(os.path.join(self._record_path, "downloads.json"), "w", encoding="utf-8") as f:
+                    f.write(json.dumps(manifest, indent=2, ensure_ascii=False))
+
+        return get_downloader(config).download_all(image_urls, paths, _on_done)
 
     def record_response(self, resp: dict):
         os.makedirs(self._record_path, exist_ok=True)
@@ -0,0 +1,175 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+
+import httpx
+
+from common.config import LLMConfig
+from common.client_pool import client_registry
+
+
+CHUNK_SIZE = 64 * 1024
+# 连接超时和两次读取之间的超时（秒），大图片按块读取，不限制总时长
+TIMEOUT = httpx.Timeout(10.0, read=60.0)
+RETRIES = 3
+BACKOFF = 0.5
+# 这些状态码视为临时错误，重试
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+
+class IncompleteDownloadError(Exception):
+    """接收到的内容不完整或为空，重试"""
+
+
+class DownloadResult:
+    """单个图片的下载结果"""
+    def __init__(self, index: int, url: str, path: str):
+        self.index = index
+        self.url = url
+        self.path = path
+        self.ok = False
+        self.size = 0
+        self.sha256 = ""
+        self.attempts = 0
+        self.seconds = 0.0
+        self.error = None
+
+    def to_json(self) -> dict:
+        return {
+            "index": self.index,
+            "url": self.url,
+            "file": os.path.basename(self.path),
+            "ok": self.ok,
+            "size": self.size,
+            "sha256": self.sha256,
+            "attempts": self.attempts,
+            "seconds": round(self.seconds, 3),
+            "error": self.error
+        }
+
+
+class DownloadBatch:
+    """一组并发进行的下载，可以按完成顺序逐个取得结果"""
+    def __init__(self, futures: list[Future]):
+        self._futures = futures
+
+    def as_completed(self):
+        """按完成的先后顺序返回 DownloadResult"""
+        for future in as_completed(self._futures):
+            yield future.result()
+
+    def wait(self) -> list[DownloadResult]:
+        """等待全部下载结束，按序号返回结果"""
+        return [future.result() for future in self._futures]
+
+    @property
+    def done(self) -> bool:
+        return all(future.done() for future in self._futures)
+
+
+class ImageDownloader:
+    """
+    并发下载生成结果的图片
+
+    使用共享连接池的 httpx 客户端，按块写入临时文件，同时计算 sha256，
+    完整接收（与 Content-Length 一致）后再替换为目标文件，不会留下写了一半的图片。
+    连接错误、超时、内容不完整和临时性的状态码（429、5xx）按指数退避重试。
+
+    :param config: 使用该配置的代理和连接池设置
+    :param max_workers: 同时下载的数量
+    """
+    def __init__(self, config: LLMConfig, max_workers: int = 4, retries: int = RETRIES):
+        self._config = config
+        self._retries = retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="img-download")
+
+    @property
+    def _client(self) -> httpx.Client:
+        return client_registry.get("download", self._config).http_client
+
+    def _fetch(self, result: DownloadResult):
+        """下载一次，成功时填写 size 和 sha256，失败时抛出异常"""
+        tmp_path = f"{result.path}.part"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with self._client.stream("GET", result.url, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                expected = response.headers.get("Content-Length")
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_bytes(CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            # 压缩传输时 Content-Length 为压缩后的大小，只在未压缩时校验
+            if expected and not response.headers.get("Content-Encoding") and int(expected) != size:
+                raise IncompleteDownloadError(f"下载不完整: {size}/{expected} 字节")
+            if size == 0:
+                raise IncompleteDownloadError("下载的文件为空")
+            os.replace(tmp_path, result.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        result.size = size
+        result.sha256 = digest.hexdigest()
+
+    @staticmethod
+    def _retryable(error: Exception) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRY_STATUS
+        # 写入临时文件出错（磁盘已满、没有权限等）重试也无法恢复
+        return isinstance(error, (httpx.TransportError, IncompleteDownloadError))
+
+    def _download(self, result: DownloadResult, on_done=None) -> DownloadResult:
+        start = time.monotonic()
+        while True:
+            result.attempts += 1
+            try:
+                self._fetch(result)
+                result.ok = True
+                result.error = None
+                break
+            except Exception as e:
+                result.error = str(e)
+                if result.attempts > self._retries or not self._retryable(e):
+                    print(f"下载图片 {result.url} 失败: {e}")
+                    break
+                time.sleep(BACKOFF * 2 ** (result.attempts - 1))
+        result.seconds = time.monotonic() - start
+        if on_done is not None:
+            try:
+                on_done(result)
+            except Exception as e:
+                print(f"处理下载结果出错: {e}")
+        return result
+
+    def download(self, url: str, path: str) -> DownloadResult:
+        """下载单个图片，阻塞直到结束"""
+        return self._download(DownloadResult(0, url, path))
+
+    def download_all(self, urls: list[str], paths: list[str], on_done=None) -> DownloadBatch:
+        """
+        并发下载，立即返回
+
+        :param on_done: 每个图片下载结束（成功或失败）时在下载线程中调用 on_done(DownloadResult)
+        """
+        futures = [
+            self._executor.submit(self._download, DownloadResult(index, url, path), on_done)
+            for index, (url, path) in enumerate(zip(urls, paths))
+        ]
+        return DownloadBatch(futures)
+
+
+_downloaders = {}
+_downloaders_lock = threading.Lock()
+
+
+def get_downloader(config: LLMConfig) -> ImageDownloader:
+    """按配置共享下载器，同一接口的下载共用线程池和连接池"""
+    key = (config.base_url, config.api_key, config.proxy)
+    with _downloaders_lock:
+        if key not in _downloaders:
+            _downloaders[key] = ImageDownloader(config)
+        return _downloaders[key]
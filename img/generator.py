@@ -1,38 +1,28 @@
 from typing import List, Tuple
 
-from img.common import convert_image, encode_image, Recorder, image_bytes_to_base64
+from img.common import Recorder, image_bytes_to_base64
 from common.config import LLMConfig
 from common.utils import get_openai_client, get_raw_client
+from common.ratelimit import rate_limiter, PRIORITY_IMAGE
+from common.metrics import metrics_store
 
 
 class ImgGenerator:
     """
     图像生成器，使用指定的LLM配置与Banana API进行图像生成和编辑。
     """ 
-    def __init__(self, llm_config: LLMConfig):
+    def __init__(self, llm_config: LLMConfig, recorder: Recorder = None):
         self._llm_config = llm_config
-        self._client = get_openai_client(self._llm_config)
-        self._recorder = Recorder()
+        self._recorder = recorder or Recorder()
+
+    @property
+    def _client(self):
+        return get_openai_client(self._llm_config)
 
     # 3. 调用 API 进行图像编辑（以图生图）
     def generate_img(self, prompt: str, img_files: List[bytes], count=1, size="512x512", 
                     quality="", ratio="") -> Tuple[bool, List[bytes]|str]:
         raise NotImplementedError()
-    
-    def prepare_img(self, img_bytes: bytes, img_name: str) -> bytes:
-        """
-        预处理图片：图片格式统一转换为jpeg，并记录
-        
-        :param img_bytes: 原始图片内容
-        :type img_bytes: bytes
-        :param img_name: 原始图片名称
-        :type img_name: str
-        :return: 转换为jpeg格式后的图片内容
-        :rtype: bytes
-        """
-        new_img_bytes = convert_image(img_bytes)
-        self._recorder.record_image(new_img_bytes, img_name)
-        return new_img_bytes
 
 
 # 生成图片，qwen模型，文生图和图生图需要使用不同模型
@@ -43,8 +33,8 @@ class GeminiImgGenerator(ImgGenerator):
     """
     图像生成器，使用指定的LLM配置与Banana API进行图像生成和编辑。
     """
-    def __init__(self, llm_config: LLMConfig):
-        super().__init__(llm_config)
+    def __init__(self, llm_config: LLMConfig, recorder: Recorder = None):
+        super().__init__(llm_config, recorder)
         self._modalities=["text", "image"]
 
     def generate_img(self, prompt: str, img_files: List[bytes], count=1, size="512x512", 
@@ -54,7 +44,7 @@ class GeminiImgGenerator(ImgGenerator):
                     "text": f"Generate {count} images based on this description:\n {prompt}"
                 }]
         for img_content in img_files:
-            img_url = f"data:image/jpeg;base64,{encode_image(img_content)}"
+            img_url = image_bytes_to_base64(img_content)
             query.append({
                 "type": "image_url",
                 "image_url": {
@@ -87,7 +77,18 @@ class GeminiImgGenerator(ImgGenerator):
         self._recorder.record_prompt(prompt)
         self._recorder.record_params(params)
 
-        response = self._client.chat.completions.create(**params)
+        # 与对话共用接口时排在对话和批量任务之后
+        rate_limiter.acquire(self._llm_config, priority=PRIORITY_IMAGE)
+        try:
+            with metrics_store.track("image", self._llm_config) as call:
+                response = self._client.chat.completions.create(**params)
+                if response.usage is not None:
+                    call["prompt_tokens"] = response.usage.prompt_tokens
+                    call["completion_tokens"] = response.usage.completion_tokens
+        except Exception as e:
+            rate_limiter.report_error(self._llm_config, e)
+            raise
+        rate_limiter.report_success(self._llm_config)
         
         self._recorder.record_response(response.to_dict())
         return self.extract_images(response)
@@ -119,8 +120,8 @@ class SeeDreamGenerator(GeminiImgGenerator):
     """
     适用于SeeDream模型的图像生成器，参考：https://openrouter.ai/bytedance-seed/seedream-4.5/api
     """
-    def __init__(self, llm_config: LLMConfig):
-        super().__init__(llm_config)
+    def __init__(self, llm_config: LLMConfig, recorder: Recorder = None):
+        super().__init__(llm_config, recorder)
         self._modalities=["image"]
 
 
@@ -128,27 +129,41 @@ class Flux2Generator(GeminiImgGenerator):
     """
     适用于Flux2模型的图像生成器，参考：https://openrouter.ai/black-forest-labs/flux.2-max/api
     """
-    def __init__(self, llm_config: LLMConfig):
-        super().__init__(llm_config)
+    def __init__(self, llm_config: LLMConfig, recorder: Recorder = None):
+        super().__init__(llm_config, recorder)
         self._modalities=["image"]
 
 
 class QwenImgGenerator(ImgGenerator):
-    def __init__(self, llm_config: LLMConfig, llm_config_editor: LLMConfig):
+    def __init__(self, llm_config: LLMConfig, llm_config_editor: LLMConfig, recorder: Recorder = None):
         self._llm_config = llm_config
         self._llm_config_editor = llm_config_editor
 
-        self._client = get_openai_client(self._llm_config)
-        self._client_editor = get_raw_client(self._llm_config_editor)
-
-        self._recorder = Recorder()
+        self._recorder = recorder or Recorder()
+        # 最近一次生成的图片下载，见 Recorder.record_images_from_urls
+        self.last_downloads = None
+
+    @property
+    def _client_editor(self):
+        return get_raw_client(self._llm_config_editor)
+
+    def _post(self, model_config: LLMConfig, payload: dict):
+        """经限流发送生成请求，并按实际使用的模型记录调用指标"""
+        rate_limiter.acquire(self._llm_config_editor, priority=PRIORITY_IMAGE)
+        with metrics_store.track("image", model_config) as call:
+            result = self._client_editor.post("/images/generations", json=payload)
+            if result.status_code != 200:
+                call["status"] = "error"
+                call["error"] = f"HTTP {result.status_code}"
+        rate_limiter.report_response(self._llm_config_editor, result)
+        return result
 
     def generate_img(self, prompt, img_files, batch_size=1, size="512x512", steps=20):
         self._recorder.record_prompt(prompt)
 
         # qwen 生成图像只能用qwen-image
         if not img_files:
-            result = self._client_editor.post("/images/generations", json={
+            result = self._post(self._llm_config, {
                 "model": self._llm_config.model,
                 "prompt": prompt,
                 "image_size": size,
@@ -157,19 +172,18 @@ class QwenImgGenerator(ImgGenerator):
                 "size": size
             })
 
-            img_result = []
             if result.status_code != 200 or "images" not in result.json():
                 print("错误响应:", result.text)
                 return False, result.text
             
             self._recorder.record_response(result.json())
-            for i, img in enumerate(result.json().get("images", [])):
-                img_result.append(img["url"]) # 目前qwen图生图只返回url
-                self._recorder.record_image_from_url(img["url"], i)
+            img_result = [img["url"] for img in result.json().get("images", [])] # 目前qwen图生图只返回url
+            # 图片在后台并发下载，不等待下载完成，页面通过 last_downloads 逐个显示下载完成的图片
+            self.last_downloads = self._recorder.record_images_from_urls(img_result, self._llm_config_editor)
             return True, img_result
         # qwen 图生图只能用 qwen-image-edit
         else:
-            result = self._client_editor.post("/images/generations", json={
+            result = self._post(self._llm_config_editor, {
                 "model": self._llm_config_editor.model,
                 "prompt": prompt,
                 "image": image_bytes_to_base64(img_files[0]),
@@ -179,33 +193,33 @@ class QwenImgGenerator(ImgGenerator):
                 "size": size
             })
 
-            img_result = []
             if result.status_code != 200 or "images" not in result.json():
                 print("错误响应:", result.text)
                 return False, result.text
             
             self._recorder.record_response(result.json())
-            for i, img in enumerate(result.json().get("images", [])):
-                img_result.append(img["url"]) # 目前qwen图生图只返回url
-                self._recorder.record_image_from_url(img["url"], i)
+            img_result = [img["url"] for img in result.json().get("images", [])] # 目前qwen图生图只返回url
+            # 图片在后台并发下载，不等待下载完成，页面通过 last_downloads 逐个显示下载完成的图片
+            self.last_downloads = self._recorder.record_images_from_urls(img_result, self._llm_config_editor)
             return True, img_result
     
 
-def get_img_generator(llm_config: LLMConfig) -> ImgGenerator:
+def get_img_generator(llm_config: LLMConfig, recorder: Recorder = None) -> ImgGenerator:
     """
     ImgGenerator的工厂函数
     
     :param llm_config: 模型配置
     :type llm_config: LLMConfig
+    :param recorder: 生成记录，默认按当前时间新建
     :return: ImgGenerator
     :rtype: ImgGenerator
     """
     if "gemini" in llm_config.model.lower():
-        return GeminiImgGenerator(llm_config)
+        return GeminiImgGenerator(llm_config, recorder)
     elif "seedream" in llm_config.model.lower():
-        return SeeDreamGenerator(llm_config)
+        return SeeDreamGenerator(llm_config, recorder)
     elif "flux" in llm_config.model.lower():
-        return Flux2Generator(llm_config)
+        return Flux2Generator(llm_config, recorder)
     elif "qwen" in llm_config.model.lower():
         return QwenImgGenerator(llm_config)
     else:
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+from common.config import global_config
+from common.fileio import atomic_write_json
+from img.preprocess import image_preprocessor
+
+
+STORE_VERSION = 1
+# 预处理逻辑变化时修改，使旧的缓存失效
+PREPROCESS_VERSION = 1
+MAX_BYTES = 512 * 1024 * 1024
+# 只更新最近使用时间时，两次保存索引的最短间隔（秒）
+TOUCH_SAVE_INTERVAL = 10
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class StoredImage(bytes):
+    """
+    缓存中的预处理后图片，可以直接当作 jpeg 内容使用
+
+    同时带有缓存的 key，取 base64 文本、硬链接时直接按 key 查找，不需要重新计算 sha256；
+    base64 文本读取一次后保存在对象上，同一张参考图用于多个请求时不再重复读取
+    """
+    key: str = None
+    base64: str = None
+
+
+def _stored(key: str, jpeg_bytes: bytes) -> StoredImage:
+    image = StoredImage(jpeg_bytes)
+    image.key = key
+    return image
+
+
+class ImageStore:
+    """
+    按内容寻址的参考图缓存，保存在图片工作目录的 store 目录中
+
+    key 为原始图片内容和预处理参数的 sha256，每个条目保存预处理后的 jpeg（<key>.jpg）
+    和它的 base64 文本（<key>.b64）。相同的图片再次上传时直接使用缓存，不再重新解码和编码。
+    条目总大小超过 max_bytes 时淘汰最久未使用的条目。
+    Recorder 记录参考图时通过硬链接引用缓存中的文件，不复制内容；条目被淘汰后硬链接的文件仍然保留。
+
+    index.json 记录每个条目的 digest（预处理后 jpeg 的 sha256）、大小和最近使用时间。
+    preprocess、get 返回 StoredImage，其他接口传入 StoredImage 时按 key 查找，传入普通 bytes 时按 digest 查找。
+    """
+    def __init__(self, store_dir: str = None, max_bytes: int = MAX_BYTES):
+        self._store_dir = store_dir or os.path.join(global_config.get_img_workspace(), "store")
+        self._max_bytes = max_bytes
+        self._lock = threading.RLock()
+        self._entries = None
+        self._digests = {}
+        self._saved_at = 0.0
+
+    # ---------- 索引 ----------
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self._store_dir, key[:2], f"{key}.{ext}")
+
+    def _index_path(self) -> str:
+        return os.path.join(self._store_dir, "index.json")
+
+    def _load(self) -> dict:
+        if self._entries is not None:
+            return self._entries
+        try:
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") != STORE_VERSION:
+                raise ValueError("store version mismatch")
+            entries = data["entries"]
+        except (FileNotFoundError, ValueError, KeyError):
+            entries = {}
+
+        # 删除索引中没有的文件（写入文件后、保存索引前进程退出时留下的）
+        if os.path.isdir(self._store_dir):
+            for sub in os.listdir(self._store_dir):
+                sub_dir = os.path.join(self._store_dir, sub)
+                if not os.path.isdir(sub_dir):
+                    continue
+                for filename in os.listdir(sub_dir):
+                    if filename.split(".")[0] not in entries:
+                        try:
+                            os.remove(os.path.join(sub_dir, filename))
+                        except OSError:
+                            pass
+        # 删除文件已丢失的条目
+        entries = {key: entry for key, entry in entries.items()
+                   if os.path.exists(self._path(key, "jpg")) and os.path.exists(self._path(key, "b64"))}
+
+        self._entries = entries
+        self._digests = {entry["digest"]: key for key, entry in entries.items()}
+        return entries
+
+    def _save(self, force: bool = True):
+        if not force and time.time() - self._saved_at < TOUCH_SAVE_INTERVAL:
+            return
+        try:
+            os.makedirs(self._store_dir, exist_ok=True)
+            atomic_write_json(self._index_path(), {"version": STORE_VERSION, "entries": self._entries}, indent=None)
+            self._saved_at = time.time()
+        except OSError as e:
+            print(f"保存参考图缓存索引出错: {e}")
+
+    def _touch(self, key: str):
+        self._entries[key]["last_used"] = time.time()
+        self._save(force=False)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        # 不同参数可能得到相同的内容（如未缩放的 jpeg），digest 可能已指向其他条目
+        if self._digests.get(entry["digest"]) == key:
+            del self._digests[entry["digest"]]
+        for ext in ("jpg", "b64"):
+            try:
+                os.remove(self._path(key, ext))
+            except OSError:
+                pass
+        try:
+            os.rmdir(os.path.dirname(self._path(key, "jpg")))
+        except OSError:
+            pass
+
+    def _evict(self, keep: str):
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_used"]):
+            if total <= self._max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry["size"]
+            self._remove(key)
+
+    # ---------- 接口 ----------
+
+    @staticmethod
+    def make_key(img_bytes: bytes, max_side: int, quality: int) -> str:
+        """原始图片内容和预处理参数对应的 key"""
+        digest = hashlib.sha256(img_bytes)
+        digest.update(f"|{max_side}|{quality}|{PREPROCESS_VERSION}".encode())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> StoredImage | None:
+        """预处理后的 jpeg 内容，不存在时返回 None"""
+        with self._lock:
+            if key not in self._load():
+                return None
+            try:
+                with open(self._path(key, "jpg"), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                self._remove(key)
+                return None
+            self._touch(key)
+            return _stored(key, data)
+
+    def put(self, key: str, jpeg_bytes: bytes, base64_text: str = None) -> str:
+        """
+        保存预处理后的 jpeg 和它的 base64 文本
+
+        :return: jpeg 文件路径
+        """
+        # 延迟导入，避免与 img.common 循环导入
+        from img.common import encode_image
+
+        base64_text = base64_text or encode_image(jpeg_bytes)
+        with self._lock:
+            entries = self._load()
+            jpg_path = self._path(key, "jpg")
+            if key not in entries:
+                os.makedirs(os.path.dirname(jpg_path), exist_ok=True)
+                for ext, mode, data in (("jpg", "wb", jpeg_bytes), ("b64", "w", base64_text)):
+                    tmp_path = f"{self._path(key, ext)}.tmp"
+                    with open(tmp_path, mode) as f:
+                        f.write(data)
+                    os.replace(tmp_path, self._path(key, ext))
+                digest = _sha256(jpeg_bytes)
+                entries[key] = {"digest": digest, "size": len(jpeg_bytes) + len(base64_text)}
+                self._digests[digest] = key
+            entries[key]["last_used"] = time.time()
+            self._evict(keep=key)
+            self._save()
+            return jpg_path
+
+    def find(self, jpeg_bytes: bytes) -> str | None:
+        """按预处理后的内容查找条目，返回 key"""
+        with self._lock:
+            entries = self._load()
+            if isinstance(jpeg_bytes, StoredImage):
+                return jpeg_bytes.key if jpeg_bytes.key in entries else None
+            return self._digests.get(_sha256(jpeg_bytes))
+
+    def base64_of(self, jpeg_bytes: bytes) -> str | None:
+        """预处理后图片的 base64 文本，不在缓存中时返回 None"""
+        if isinstance(jpeg_bytes, StoredImage) and jpeg_bytes.base64 is not None:
+            return jpeg_bytes.base64
+        with self._lock:
+            key = self.find(jpeg_bytes)
+            if key is None:
+                return None
+            try:
+                with open(self._path(key, "b64"), 'r') as f:
+                    text = f.read()
+            except OSError:
+                self._remove(key)
+                return None
+            self._touch(key)
+        if isinstance(jpeg_bytes, StoredImage):
+            jpeg_bytes.base64 = text
+        return text
+
+    def link(self, jpeg_bytes: bytes, dest_path: str) -> bool:
+        """
+        内容在缓存中时将缓存文件硬链接到 dest_path，不支持硬链接（如跨磁盘）时复制
+
+        :return: 内容不在缓存中时返回 False，由调用方自行写入
+        """
+        with self._lock:
+            key = self.find(jpeg_bytes)
+            if key is None:
+                return False
+            src_path = self._path(key, "jpg")
+            try:
+                if os.path.exists(dest_path):
+                    os.remove(dest_path)
+                try:
+                    os.link(src_path, dest_path)
+                except OSError:
+                    shutil.copyfile(src_path, dest_path)
+            except OSError as e:
+                print(f"引用缓存的参考图出错: {e}")
+                return False
+            self._touch(key)
+            return True
+
+    def preprocess(self, images: list[bytes], max_side: int, quality: int) -> list[StoredImage]:
+        """
+        预处理多张图片，已缓存的直接读取，其余的在进程池中并行处理后存入缓存
+
+        :return: 按输入顺序的预处理后图片内容
+        """
+        # 延迟导入，避免与 img.common 循环导入
+        from img.common import encode_image
+
+        keys = [self.make_key(img_bytes, max_side, quality) for img_bytes in images]
+        results = [self.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            processed = image_preprocessor.process([images[i] for i in missing], max_side, quality)
+            for i, jpeg_bytes in zip(missing, processed):
+                # 与 put 使用同一份 base64 文本，之后的请求不再读取 .b64 文件
+                image = _stored(keys[i], jpeg_bytes)
+                image.base64 = encode_image(jpeg_bytes)
+                self.put(keys[i], jpeg_bytes, image.base64)
+                results[i] = image
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._load()
+            return {"entries": len(entries), "bytes": sum(entry["size"] for entry in entries.values()),
+                    "max_bytes": self._max_bytes}
+
+
+image_store = ImageStore()
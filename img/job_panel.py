@@ -0,0 +1,63 @@
+import time
+
+import streamlit as st
+
+from img.jobs import job_queue, QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED, FINISHED_STATUSES
+
+
+STATUS_LABELS = {
+    QUEUED: "⏳ 排队中",
+    RUNNING: "🔄 生成中",
+    COMPLETED: "✅ 已完成",
+    FAILED: "❌ 失败",
+    CANCELLED: "⏹ 已取消",
+}
+
+
+def _expected_results(job: dict) -> int:
+    return job["count"] if job["kind"] == "qwen" else len(job["configs"]) * job["count"]
+
+
+def _show_job(job: dict):
+    created = time.strftime("%m-%d %H:%M:%S", time.localtime(job["created"]))
+    prompt = " ".join(job["prompt"].split())
+    header = f"{STATUS_LABELS[job['status']]} · {created} · {len(job['results'])}/{_expected_results(job)} · {prompt[:40]}"
+    with st.expander(header, expanded=job["status"] not in FINISHED_STATUSES):
+        st.caption(f"任务ID: {job['id']} · 模型: {', '.join(job['configs'])}")
+        if job["error"]:
+            st.error(job["error"])
+
+        cols = st.columns(4)
+        index = 0
+        for result in job["results"]:
+            if not result["ok"]:
+                st.warning(f"{result['label']} 生成失败: {result['error']}")
+                continue
+            for path in job_queue.result_paths({"results": [result]}):
+                with cols[index % 4]:
+                    st.image(path, caption=f"{result['label']} ({result['seconds']}s)", width='stretch')
+                index += 1
+
+        if job["status"] in (QUEUED, RUNNING):
+            if job["cancel_requested"]:
+                st.caption("正在取消，等待已发出的请求结束")
+            elif st.button("取消任务", key=f"cancel_{job['id']}"):
+                job_queue.cancel(job["id"])
+                st.rerun(scope="fragment")
+        elif st.button("删除记录", key=f"remove_{job['id']}", help="只删除任务记录，生成的图片保留在历史记录中"):
+            job_queue.remove(job["id"])
+            st.rerun(scope="fragment")
+
+
+def job_panel(kind: str, limit: int = 20):
+    """显示最近的任务，有未结束的任务时每2秒刷新"""
+    def panel():
+        jobs = [job for job in job_queue.list_jobs() if job["kind"] == kind][:limit]
+        active = sum(1 for job in jobs if job["status"] in (QUEUED, RUNNING))
+        st.subheader(f"🗂️ 任务（{active} 个进行中）" if active else "🗂️ 任务")
+        if not jobs:
+            st.caption("暂无任务")
+        for job in jobs:
+            _show_job(job)
+
+    st.fragment(panel, run_every=2 if job_queue.active_count() else None)()
@@ -0,0 +1,310 @@
+import os
+import glob
+import json
+import time
+import uuid
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from common.config import global_config
+from common.fileio import atomic_write_json
+from img.common import Recorder
+from img.image_store import image_store
+from img.generator import QwenImgGenerator
+from img.orchestrator import ImageOrchestrator
+
+
+# 任务状态
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATUSES = (COMPLETED, FAILED, CANCELLED)
+
+
+class JobQueue:
+    """
+    进程内的图片生成任务队列
+
+    页面提交任务后立即返回，任务由后台线程执行，页面重新运行、切换页面都不影响执行中的任务。
+    任务记录保存在图片工作目录的 jobs/<任务ID>.json 中：
+        {
+            "id": "20260101_120000_ab12cd",
+            "kind": "image",                // image 使用 ImageOrchestrator 拆分为单图请求，qwen 使用 QwenImgGenerator
+            "status": "queued",             // queued、running、completed、failed、cancelled
+            "prompt": "提示词",
+            "configs": ["gemini.json"],     // 模型配置，qwen 任务为 [文生图配置, 图生图配置]
+            "count": 2,                     // 每个模型配置生成的数量
+            "max_concurrency": 4,           // image 任务同时进行的请求数
+            "params": {"size": "512x512"},  // 传给 generate_img 的其他参数
+            "inputs": ["input_0.jpg"],      // 参考图，保存在记录目录中
+            "input_keys": ["<key>"],        // 参考图在 ImageStore 中的 key，不在缓存中的为 null
+            "results": [                    // 每个请求的结果，按完成顺序
+                {"label": "gemini #1", "ok": true, "images": ["history/<任务ID>/00_gemini/output_0.jpg"],
+                 "error": null, "seconds": 12.3}
+            ],
+            "error": null,
+            "cancel_requested": false,
+            "created": 1700000000.0, "started": null, "finished": null
+        }
+    生成记录（Recorder）保存在 history/<任务ID>/ 下，图片路径相对于图片工作目录。
+    进程重启后排队中的任务继续执行，执行中被中断的任务标记为失败。
+
+    使用线程执行：生成请求主要是等待网络，线程之间可以共享连接池和限流器。
+    所有 image 任务的单图请求在同一个线程池中执行，合计并发不超过 max_concurrency。
+
+    :param workers: 同时执行的任务数
+    :param max_concurrency: 所有任务合计同时进行的请求数
+    """
+    def __init__(self, jobs_dir: str = None, workers: int = 2, max_concurrency: int = 8):
+        self._img_workspace = str(global_config.get_img_workspace())
+        self._jobs_dir = jobs_dir or os.path.join(self._img_workspace, "jobs")
+        self._workers = workers
+        self._max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="img-generate")
+        self._lock = threading.RLock()
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._threads = []
+        self._load()
+
+    # ---------- 持久化 ----------
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self._jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: dict):
+        try:
+            os.makedirs(self._jobs_dir, exist_ok=True)
+            atomic_write_json(self._job_path(job["id"]), job)
+        except OSError as e:
+            print(f"保存任务 {job['id']} 出错: {e}")
+
+    def _load(self):
+        for path in sorted(glob.glob(os.path.join(self._jobs_dir, "*.json"))):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"读取任务 {path} 出错: {e}")
+                continue
+            if job["status"] == RUNNING:
+                job["status"] = FAILED
+                job["error"] = "进程重启，任务被中断"
+                job["finished"] = time.time()
+                self._save(job)
+            self._jobs[job["id"]] = job
+            if job["status"] == QUEUED:
+                self._queue.put(job["id"])
+        if not self._queue.empty():
+            self._start_workers()
+
+    def _update(self, job_id: str, **changes) -> dict:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(changes)
+            self._save(job)
+            return job
+
+    # ---------- 接口 ----------
+
+    def submit(self, kind: str, prompt: str, configs: list[str], count: int = 1, params: dict = None,
+               input_images: list[bytes] = None, max_concurrency: int = None) -> str:
+        """
+        提交任务，立即返回任务ID
+
+        :param kind: image 或 qwen
+        :param configs: 图片模型配置名称，qwen 任务为 [文生图配置, 图生图配置]
+        :param input_images: 参考图（已预处理的 jpeg 内容）
+        :param max_concurrency: image 任务同时进行的请求数，默认及上限为所有任务合计的并发数
+        :return: 任务ID
+        """
+        job_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        recorder = Recorder(job_id)
+        inputs, input_keys = [], []
+        for i, img_bytes in enumerate(input_images or []):
+            recorder.record_image(img_bytes, f"input_{i}.jpg")
+            inputs.append(f"input_{i}.jpg")
+            input_keys.append(getattr(img_bytes, "key", None))
+
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": QUEUED,
+            "prompt": prompt,
+            "configs": configs,
+            "count": count,
+            "max_concurrency": min(max_concurrency or self._max_concurrency, self._max_concurrency),
+            "params": params or {},
+            "inputs": inputs,
+            "input_keys": input_keys,
+            "results": [],
+            "error": None,
+            "cancel_requested": False,
+            "created": time.time(),
+            "started": None,
+            "finished": None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._save(job)
+        self._queue.put(job_id)
+        self._start_workers()
+        return job_id
+
+    def get(self, job_id: str) -> dict | None:
+        """任务记录的副本"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def list_jobs(self, limit: int = None) -> list[dict]:
+        """最新的任务在前"""
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job["created"], reverse=True)
+            return [json.loads(json.dumps(job)) for job in jobs[:limit]]
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        取消任务：排队中的任务不再执行；执行中的任务不再发起新的请求，已发出的请求结束后保留其结果
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                return False
+            if job["status"] == QUEUED:
+                self._update(job_id, status=CANCELLED, finished=time.time())
+            else:
+                self._update(job_id, cancel_requested=True)
+            return True
+
+    def remove(self, job_id: str) -> bool:
+        """删除已结束的任务记录，生成记录（图片）保留"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] not in FINISHED_STATUSES:
+                return False
+            del self._jobs[job_id]
+            try:
+                os.remove(self._job_path(job_id))
+            except OSError:
+                pass
+            return True
+
+    def result_paths(self, job: dict) -> list[str]:
+        """任务已生成的图片的完整路径"""
+        return [os.path.join(self._img_workspace, path)
+                for result in job["results"] for path in result["images"]]
+
+    def active_count(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] in (QUEUED, RUNNING))
+
+    # ---------- 执行 ----------
+
+    def _start_workers(self):
+        with self._lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            for i in range(len(self._threads), self._workers):
+                thread = threading.Thread(target=self._worker, name=f"img-job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job["status"] != QUEUED:
+                    continue
+                self._update(job_id, status=RUNNING, started=time.time())
+            try:
+                if job["kind"] == "qwen":
+                    self._run_qwen(job)
+                else:
+                    self._run_image(job)
+                results = self.get(job_id)["results"]
+                with self._lock:
+                    if self._jobs[job_id]["cancel_requested"]:
+                        status = CANCELLED
+                    elif results and not any(result["ok"] for result in results):
+                        status = FAILED
+                    else:
+                        status = COMPLETED
+                    self._update(job_id, status=status, finished=time.time())
+            except Exception as e:
+                print(f"执行任务 {job_id} 出错: {e}")
+                self._update(job_id, status=FAILED, error=str(e), finished=time.time())
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            return self._jobs[job_id]["cancel_requested"]
+
+    def _add_result(self, job_id: str, result: dict):
+        with self._lock:
+            job = self._jobs[job_id]
+            self._update(job_id, results=job["results"] + [result])
+
+    def _relative_images(self, record_path: str) -> list[str]:
+        paths = sorted(glob.glob(os.path.join(record_path, "output_*.jpg")))
+        return [os.path.relpath(path, self._img_workspace).replace(os.sep, "/") for path in paths]
+
+    def _inputs(self, job: dict) -> list[bytes]:
+        """参考图仍在缓存中时直接按 key 读取（带有缓存的 base64），否则读取记录目录中的文件"""
+        record_path = Recorder(job["id"]).record_path
+        keys = job.get("input_keys") or [None] * len(job["inputs"])
+        images = []
+        for name, key in zip(job["inputs"], keys):
+            image = image_store.get(key) if key else None
+            if image is None:
+                with open(os.path.join(record_path, name), 'rb') as f:
+                    image = f.read()
+            images.append(image)
+        return images
+
+    def _run_image(self, job: dict):
+        """拆分为单图请求，每个请求完成后立即写入结果"""
+        orchestrator = ImageOrchestrator(job.get("max_concurrency", self._max_concurrency), self._executor)
+        image_jobs = orchestrator.plan(job["configs"], job["count"])
+        runner = orchestrator.run(image_jobs, job["prompt"], self._inputs(job), batch_name=job["id"], **job["params"])
+        try:
+            for image_job in runner:
+                self._add_result(job["id"], {
+                    "label": image_job.label,
+                    "ok": image_job.ok,
+                    "images": self._relative_images(image_job.record_path) if image_job.ok else [],
+                    "error": image_job.error,
+                    "seconds": round(image_job.seconds, 1)
+                })
+                if self._cancel_requested(job["id"]):
+                    break
+        finally:
+            runner.close()
+
+    def _run_qwen(self, job: dict):
+        """Qwen 一次请求生成多张，每张图片下载完成后立即写入结果"""
+        start = time.monotonic()
+        config = global_config.get_llm_config(type="img", name=job["configs"][0])
+        editor_config = global_config.get_llm_config(type="img", name=job["configs"][1])
+        generator = QwenImgGenerator(config, editor_config, Recorder(job["id"]))
+        ok, result = generator.generate_img(job["prompt"], self._inputs(job), batch_size=job["count"],
+                                            **job["params"])
+        name = os.path.splitext(job["configs"][0])[0]
+        if not ok:
+            self._add_result(job["id"], {"label": name, "ok": False, "images": [], "error": result,
+                                         "seconds": round(time.monotonic() - start, 1)})
+            return
+        for download in generator.last_downloads.as_completed():
+            self._add_result(job["id"], {
+                "label": f"{name} #{download.index + 1}",
+                "ok": download.ok,
+                "images": [os.path.relpath(download.path, self._img_workspace).replace(os.sep, "/")]
+                if download.ok else [],
+                "error": download.error,
+                "seconds": round(time.monotonic() - start, 1)
+            })
+
+
+job_queue = JobQueue()
@@ -0,0 +1,98 @@
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from common.config import global_config
+from img.common import Recorder
+from img.generator import get_img_generator
+
+
+class ImageJob:
+    """批量生成中的一次单图请求"""
+    def __init__(self, index: int, config_name: str, number: int = 1):
+        self.index = index
+        self.config_name = config_name
+        # 该模型配置的第几张
+        self.number = number
+        self.ok = False
+        # 生成的图片（data URL 或图片地址），部分接口一次返回多张
+        self.images = []
+        self.error = None
+        self.seconds = 0.0
+        # 该请求的记录目录，生成的图片保存为其中的 output_*.jpg
+        self.record_path = None
+
+    @property
+    def label(self) -> str:
+        return f"{Path(self.config_name).stem} #{self.number}"
+
+
+class ImageOrchestrator:
+    """
+    把一批图片拆分成并发的单图请求，可以同时使用多个模型配置
+
+    许多接口会忽略 n 参数只返回一张图片，拆分后每个请求只要求一张，
+    结果按完成顺序返回，页面可以逐张显示。每个请求使用单独的记录目录，
+    同一批次的记录放在 history/<批次时间>/ 下。
+
+    :param max_concurrency: 本批次同时进行的请求数上限（所有模型配置合计）
+    :param executor: 多个批次共用的线程池，所有批次合计的并发不超过线程池大小，为 None 时每个批次单独创建
+    """
+    def __init__(self, max_concurrency: int = 4, executor: ThreadPoolExecutor = None):
+        self._max_concurrency = max(max_concurrency, 1)
+        self._executor = executor
+
+    @staticmethod
+    def plan(config_names: list[str], count: int) -> list[ImageJob]:
+        """每个模型配置生成 count 张，各配置的请求交替排列，并发受限时各配置都能尽早出图"""
+        return [
+            ImageJob(i * len(config_names) + j, name, i + 1)
+            for i in range(count)
+            for j, name in enumerate(config_names)
+        ]
+
+    @staticmethod
+    def _run_job(job: ImageJob, batch_name: str, prompt: str, img_files: list[bytes], params: dict) -> ImageJob:
+        start = time.monotonic()
+        try:
+            config = global_config.get_llm_config(type="img", name=job.config_name)
+            recorder = Recorder(f"{batch_name}/{job.index:02d}_{Path(job.config_name).stem}")
+            job.record_path = recorder.record_path
+            generator = get_img_generator(config, recorder)
+            ok, result = generator.generate_img(prompt, img_files, count=1, **params)
+            if ok:
+                job.ok = True
+                job.images = result
+            else:
+                job.error = result
+        except Exception as e:
+            job.error = str(e)
+        job.seconds = time.monotonic() - start
+        return job
+
+    def run(self, jobs: list[ImageJob], prompt: str, img_files: list[bytes], batch_name: str = None, **params):
+        """
+        并发执行请求，按完成顺序返回 ImageJob
+
+        :param batch_name: 批次记录目录名称，默认为当前时间
+        :param params: 传给 generate_img 的其他参数（size、quality、ratio）
+        """
+        batch_name = batch_name or time.strftime("%Y%m%d_%H%M%S", time.localtime())
+        executor = self._executor or ThreadPoolExecutor(max_workers=max(min(self._max_concurrency, len(jobs)), 1),
+                                                        thread_name_prefix="img-generate")
+        pending = list(jobs)
+        running = set()
+        try:
+            while pending or running:
+                # 本批次最多同时提交 max_concurrency 个请求，共用线程池时其余请求留给其他批次
+                while pending and len(running) < self._max_concurrency:
+                    running.add(executor.submit(self._run_job, pending.pop(0), batch_name, prompt, img_files, params))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        finally:
+            # 迭代被中止（如页面重新运行）时不再发起排队中的请求，已发出的请求在后台结束
+            for future in running:
+                future.cancel()
+            if self._executor is None:
+                executor.shutdown(wait=False, cancel_futures=True)
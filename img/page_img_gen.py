@@ -3,29 +3,23 @@ from io import BytesIO
 import streamlit as st
 
 from common.config import global_config, LLMConfig
-from img.generator import ImgGenerator, get_img_generator
+from img.image_store import image_store
+from img.jobs import job_queue
+from img.job_panel import job_panel
 
 
 class PageState:
     def __init__(self):
         if not st.session_state.get("llm_config", None):
             st.session_state.llm_config = global_config.get_llm_config(type="img")
-        
-        if "generator" not in st.session_state:
-            st.session_state.generator = get_img_generator(st.session_state.llm_config)
 
     @property
     def llm_config(self) -> LLMConfig:
         return st.session_state.llm_config
     
-    @property
-    def generator(self) -> ImgGenerator:
-        return st.session_state.generator
-    
     def select_llm(self, llm_name) -> None:
         llm_config = global_config.get_llm_config(type="img", name=llm_name)
         st.session_state.llm_config = llm_config
-        st.session_state.generator = get_img_generator(llm_config)
 
 
 def page(state: PageState):
@@ -39,9 +33,13 @@ def page(state: PageState):
         selected_llm = st.selectbox("选择模型配置", llm_names, key="llm_selector", index=0)
         if selected_llm:
             state.select_llm(selected_llm)
+        # 同时使用多个模型配置生成，便于比较
+        extra_llms = st.multiselect("同时使用", [name for name in llm_names if name != selected_llm],
+                                    key="extra_llm_selector")
 
         st.subheader("设置")
-        count = st.slider("生成数量", 1, 4, 1)
+        count = st.slider("生成数量", 1, 4, 1, help="每个模型配置生成的数量，每张图片单独请求")
+        max_concurrency = st.slider("最大并发", 1, 8, 4, help="本任务同时进行的请求数，所有任务合计不超过 8")
         size = st.selectbox("图片大小", options=["256x256", "512x512", "768x768", "1024x1024"], index=1)
         ratio = st.selectbox("图片比例", options=["", "1:1", "9:16", "3:4", "16:9", "4:3"], index=2)
         quality = st.selectbox("图片质量", options=["", "standard", "hd"], index=1)
@@ -54,10 +52,12 @@ def page(state: PageState):
     if st.button("生成图片"):
         example_images = []  # 处理后的参考图列表
         if input_images:
-            for input_img in input_images:
-                # 预处理图片：图片格式统一转换为jpeg，并记录
-                new_img_bytes = state.generator.prepare_img(input_img.read(), input_img.name)
-                example_images.append(new_img_bytes)
+            # 预处理图片：图片格式统一转换为jpeg并缩小，多张图片并行处理，处理过的图片直接使用缓存
+            # 参考图由任务队列记录到任务的记录目录中
+            with st.spinner("正在处理参考图..."):
+                example_images = image_store.preprocess([img.read() for img in input_images],
+                                                        state.llm_config.image_max_side,
+                                                        state.llm_config.image_quality)
 
         # 在这里展示参考图 example_images，一行最多显示4张
         if example_images:
@@ -66,23 +66,13 @@ def page(state: PageState):
                 with cols[i % 4]:
                     st.image(BytesIO(img_bytes), caption=f"参考图 {i+1}")
 
-        img_results = []
-        ok, img_results = state.generator.generate_img(
-                                   prompt, 
-                                   example_images,
-                                   count=count, 
-                                   size=size, 
-                                   ratio=ratio, 
-                                   quality=quality)
-        
-        if not ok:
-            st.error(f"图片生成失败: {img_results}")
-            return
-
-        # 显示生成结果 img_results
-        if img_results:
-            for idx, img_url in enumerate(img_results):
-                st.image(img_url, caption=f"生成图片 {idx+1}", width='stretch')
+        # 提交到后台任务队列，拆分为单图请求并发生成，可以继续提交其他任务
+        job_id = job_queue.submit("image", prompt, [selected_llm] + extra_llms, count,
+                                  {"size": size, "ratio": ratio, "quality": quality}, example_images,
+                                  max_concurrency)
+        st.toast(f"已提交任务 {job_id}")
+
+    job_panel("image")
 
 
 state = PageState()
@@ -1,9 +1,12 @@
 from io import BytesIO
+from pathlib import Path
 
 import streamlit as st
 
 from common.config import global_config, LLMConfig
-from img.generator import ImgGenerator, QwenImgGenerator
+from img.image_store import image_store
+from img.jobs import job_queue
+from img.job_panel import job_panel
 
 
 class PageState:
@@ -11,9 +14,6 @@ class PageState:
         if not st.session_state.get("llm_config", None):
             st.session_state.llm_config = global_config.get_llm_config(type="img", name="qwen.json")
             st.session_state.llm_config_editor = global_config.get_llm_config(type="img", name="qwen-edit.json")
-        
-        if "generator" not in st.session_state:
-            st.session_state.generator = QwenImgGenerator(st.session_state.llm_config, st.session_state.llm_config_editor)
 
     @property
     def llm_config(self) -> LLMConfig:
@@ -22,10 +22,6 @@ class PageState:
     @property
     def llm_config_editor(self) -> LLMConfig:
         return st.session_state.llm_config_editor
-    
-    @property
-    def generator(self) -> ImgGenerator:
-        return st.session_state.generator
 
 
 def page(state: PageState):
@@ -45,10 +41,12 @@ def page(state: PageState):
     if st.button("生成图片"):
         example_images = []  # 处理后的参考图列表
         if input_images:
-            for input_img in input_images:
-                # 预处理图片：图片格式统一转换为jpeg，并记录
-                new_img_bytes = state.generator.prepare_img(input_img.read(), input_img.name)
-                example_images.append(new_img_bytes)
+            # 预处理图片：图片格式统一转换为jpeg并缩小，多张图片并行处理，处理过的图片直接使用缓存
+            # 参考图由任务队列记录到任务的记录目录中
+            with st.spinner("正在处理参考图..."):
+                example_images = image_store.preprocess([img.read() for img in input_images],
+                                                        state.llm_config.image_max_side,
+                                                        state.llm_config.image_quality)
 
         # 在这里展示参考图 example_images，一行最多显示4张
         if example_images:
@@ -57,21 +55,12 @@ def page(state: PageState):
                 with cols[i % 4]:
                     st.image(BytesIO(img_bytes), caption=f"参考图 {i+1}")
 
-        img_results = []
-        ok, img_results = state.generator.generate_img(
-                                   prompt, 
-                                   example_images,
-                                   batch_size=count, 
-                                   size=size)
-        
-        if not ok:
-            st.error(f"图片生成失败: {img_results}")
-            return
-
-        # 显示生成结果 img_results
-        if img_results:
-            for idx, img_url in enumerate(img_results):
-                st.image(img_url, caption=f"生成图片 {idx+1}", width='stretch')
+        # 提交到后台任务队列，可以继续提交其他任务
+        configs = [Path(state.llm_config.config_path).name, Path(state.llm_config_editor.config_path).name]
+        job_id = job_queue.submit("qwen", prompt, configs, count, {"size": size}, example_images)
+        st.toast(f"已提交任务 {job_id}")
+
+    job_panel("qwen")
 
 
 state = PageState()
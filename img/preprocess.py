@@ -0,0 +1,110 @@
+import os
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image, ImageOps
+from pillow_heif import register_heif_opener
+
+
+# 进程池的子进程也需要注册 HEIF 解码器
+register_heif_opener()
+
+# 超过该大小的图片使用进程池处理，小图片直接在当前线程处理更快
+POOL_MIN_BYTES = 512 * 1024
+
+
+def _is_jpeg(img_bytes: bytes) -> bool:
+    return img_bytes.startswith(b'\xff\xd8')
+
+
+def preprocess_image(img_bytes: bytes, max_side: int = 2048, quality: int = 85) -> bytes:
+    """
+    将参考图统一转换为 jpeg，长边缩小到 max_side 以内并按 quality 重新编码
+
+    尺寸未超出的 jpeg 原样返回；jpeg 解码时直接按缩小后的尺寸解码（draft），
+    大尺寸照片不需要先解码出完整分辨率的位图。
+
+    :param max_side: 长边的最大像素数，0 表示不缩放
+    :param quality: jpeg 质量（1-95）
+    """
+    with Image.open(BytesIO(img_bytes)) as img:
+        too_large = max_side and max(img.size) > max_side
+        if _is_jpeg(img_bytes) and not too_large and img.getexif().get(0x0112, 1) == 1:
+            return img_bytes
+        if too_large and img.format == "JPEG":
+            img.draft("RGB", (max_side, max_side))
+
+        # 按照片的 EXIF 方向旋转，重新编码后不再保留 EXIF
+        img = ImageOps.exif_transpose(img)
+        if too_large:
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        if img.mode in ("RGBA", "LA", "P"):
+            # 透明部分填充白色
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        with BytesIO() as output:
+            img.save(output, format="JPEG", quality=quality, optimize=True)
+            return output.getvalue()
+
+
+class ImagePreprocessor:
+    """
+    在进程池中并行预处理参考图，解码和缩放不占用页面脚本线程，也不受 GIL 限制
+
+    进程池创建失败（如运行环境不支持多进程）时退回到当前线程处理
+    """
+    def __init__(self, max_workers: int = None):
+        self._max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 页面进程中有事件循环、任务队列等多个线程，fork 时其他线程持有的锁会使子进程死锁，使用 spawn
+                self._executor = ProcessPoolExecutor(max_workers=self._max_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def process(self, images: list[bytes], max_side: int = 2048, quality: int = 85) -> list[bytes]:
+        """预处理多张图片，按输入顺序返回"""
+        large = [i for i, img_bytes in enumerate(images) if len(img_bytes) >= POOL_MIN_BYTES]
+        results = list(images)
+        futures = {}
+        if large:
+            try:
+                executor = self._get_executor()
+                futures = {i: executor.submit(preprocess_image, images[i], max_side, quality) for i in large}
+            except Exception as e:
+                print(f"创建图片预处理进程池出错，改为在当前线程处理: {e}")
+                self._reset_executor()
+                futures = {}
+
+        for i, img_bytes in enumerate(images):
+            if i in futures:
+                try:
+                    results[i] = futures[i].result()
+                    continue
+                except BrokenProcessPool as e:
+                    # 子进程异常退出时进程池不可再用
+                    print(f"进程池预处理图片出错，改为在当前线程处理: {e}")
+                    self._reset_executor()
+            results[i] = preprocess_image(img_bytes, max_side, quality)
+        return results
+
+
+image_preprocessor = ImagePreprocessor()
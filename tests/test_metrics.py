@@ -0,0 +1,60 @@
+import time
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from common.metrics import MetricsStore, prometheus_text
+
+
+CONFIG = SimpleNamespace(model="test-model", base_url="http://localhost/v1")
+
+
+class MetricsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.store = MetricsStore(self._dir.name)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_queue_wait_excluded_from_ttft_and_speed(self):
+        # 排队 2 秒，之后 0.5 秒出首个token，再用 1 秒输出 100 个token
+        self.store.record("chat", CONFIG, "completed", latency=3.5, ttft=2.5, queue_wait=2.0,
+                          completion_tokens=100)
+        record, = self.store.load()
+        self.assertEqual(record["ttft"], 0.5)
+        self.assertEqual(record["queue_wait"], 2.0)
+        self.assertEqual(record["tokens_per_second"], 100.0)
+
+    def test_queue_wait_longer_than_generation(self):
+        self.store.record("chat", CONFIG, "completed", latency=12.0, ttft=10.5, queue_wait=10.0,
+                          completion_tokens=30)
+        record, = self.store.load()
+        self.assertEqual(record["ttft"], 0.5)
+        self.assertEqual(record["tokens_per_second"], 20.0)
+
+    def test_non_streaming_call_excludes_queue_wait(self):
+        self.store.record("image", CONFIG, "completed", latency=5.0, queue_wait=1.0, completion_tokens=40)
+        record, = self.store.load()
+        self.assertIsNone(record["ttft"])
+        self.assertEqual(record["tokens_per_second"], 10.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+
+class PrometheusTextTest(unittest.TestCase):
+    def test_exports_gauges_within_window(self):
+        now = time.time()
+        records = [
+            {"ts": ts, "kind": "chat", "model": "m", "endpoint": "e", "scenario": "", "status": "completed",
+             "latency": 1.0, "ttft": 0.5, "prompt_tokens": 10, "completion_tokens": 5, "tokens_per_second": 10.0}
+            for ts in (now - 7200, now - 10)
+        ]
+        text = prometheus_text(records, 3600)
+        self.assertNotIn(" counter", text)
+        self.assertNotIn(" summary", text)
+        self.assertIn("# TYPE prompt_me_llm_requests gauge", text)
+        # 只统计窗口内的记录
+        self.assertIn('prompt_me_llm_requests{kind="chat",model="m",endpoint="e",scenario=""} 1', text)